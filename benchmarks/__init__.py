@@ -0,0 +1 @@
+"""Offline benchmarks of the assistant, against a local stand-in for the API."""
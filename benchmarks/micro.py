@@ -0,0 +1,170 @@
+"""Micro-benchmarks of the CPU-bound hot paths, over inputs of growing size.
+
+Each case is timed on synthetic modules from 1 KB to 10 MB, and the growth of
+its runtime with the size of the input is reported as an exponent: 1 for
+linear code, 2 for quadratic. The same measurements back the scaling tests,
+which fail if any case grows super-linearly."""
+import dataclasses
+import math
+import pathlib
+import random
+import time
+import typing
+
+import click
+
+from assistant.coding.applier import ApplierMode
+from assistant.coding.applier import DocstringApplier
+from assistant.coding.iterator import FileIterator
+from assistant.coding.parsed import ParsedFile
+from assistant.coding.sanitizer import ResponseSanitizer
+from benchmarks.mock_api import respond
+from benchmarks.synthetic import RepoShape
+from benchmarks.synthetic import module
+
+
+# A unit of code that sized modules are made of.
+UNIT_SHAPE = RepoShape(files=1, functions=10, classes=2, methods=5, nesting=1)
+
+SIZES = [2**10, 2**14, 2**17, 2**20, 10 * 2**20]
+
+
+@dataclasses.dataclass(frozen=True)
+class Case:
+    """A hot path to time.
+
+    Attributes:
+        name (str): The name of the case.
+        setup (Callable[[str], Callable[[], object]]): Given the code of a
+            module, prepares everything but the work to time, and returns a
+            function doing that work."""
+
+    name: str
+    setup: typing.Callable[[str], typing.Callable[[], object]]
+
+
+def sized_module(size: int, seed: int = 0) -> str:
+    """Generate a module of about a given size.
+
+    Args:
+        size (int): The size of the module, in bytes.
+        seed (int): Seed from which the code is generated.
+
+    Returns:
+        str: The code of the module, at least `size` bytes long."""
+    unit = len(module(UNIT_SHAPE, random.Random(seed)))
+    units = math.ceil(size / unit)
+    shape = dataclasses.replace(
+        UNIT_SHAPE,
+        functions=UNIT_SHAPE.functions * units,
+        classes=UNIT_SHAPE.classes * units,
+    )
+    return module(shape, random.Random(seed))
+
+
+def _iterate(code: str) -> typing.Callable[[], object]:
+    file_iterator = FileIterator(pathlib.Path("module.py"), code)
+    tree = file_iterator.parsed.tree
+    return lambda: list(file_iterator._extract_ast(tree))
+
+
+def _combine(code: str) -> typing.Callable[[], object]:
+    (node,) = FileIterator(pathlib.Path("module.py"), code).iterate()
+    return node.combine_child_code
+
+
+def _apply(code: str) -> typing.Callable[[], object]:
+    replacement = ResponseSanitizer().sanitize(respond(code))
+    applier = DocstringApplier(code, ApplierMode.KEEP, parsed=ParsedFile(code))
+    return lambda: applier.apply(replacement)
+
+
+def _sanitize(code: str) -> typing.Callable[[], object]:
+    content = respond(code)
+    return lambda: ResponseSanitizer().sanitize(content)
+
+
+CASES = {
+    case.name: case
+    for case in [
+        Case("iterate", _iterate),
+        Case("combine_child_code", _combine),
+        Case("apply", _apply),
+        Case("sanitize", _sanitize),
+    ]
+}
+
+
+def measure(case: Case, code: str, repeat: int = 3) -> float:
+    """Time a case on one module.
+
+    Args:
+        case (Case): The case to time.
+        code (str): The code of the module.
+        repeat (int): The number of runs, of which the fastest is taken.
+
+    Returns:
+        float: The fastest time of the case, in seconds."""
+    work = case.setup(code)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        work()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def exponent(timings: dict[int, float]) -> float:
+    """Estimate how runtime grows with the size of the input.
+
+    Args:
+        timings (dict[int, float]): Runtimes keyed by the size of the input.
+
+    Returns:
+        float: The slope of a least-squares fit of log runtime against log
+        size. About 1 for linear growth, and 2 for quadratic."""
+    points = [(math.log(size), math.log(t)) for size, t in timings.items()]
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return covariance / variance
+
+
+@click.command()
+@click.option(
+    "--case",
+    "cases",
+    type=click.Choice(list(CASES)),
+    multiple=True,
+    help="Case to time. May be repeated. Defaults to all.",
+)
+@click.option(
+    "--max-size",
+    type=int,
+    default=SIZES[-1],
+    show_default=True,
+    help="Largest module to time, in bytes.",
+)
+@click.option("--repeat", type=int, default=3, show_default=True)
+def main(cases: tuple[str, ...], max_size: int, repeat: int) -> None:
+    """Time the hot paths on modules from 1 KB up to 10 MB."""
+    sizes = [size for size in SIZES if size <= max_size]
+    modules = {size: sized_module(size) for size in sizes}
+
+    header = f"{'case':<20}" + "".join(f"{_size(s):>10}" for s in sizes)
+    click.echo(header + f"{'exponent':>10}")
+    for name in cases or CASES:
+        timings = {s: measure(CASES[name], modules[s], repeat) for s in sizes}
+        row = f"{name:<20}" + "".join(f"{t * 1000:>8.1f}ms" for t in timings.values())
+        click.echo(row + f"{exponent(timings):>10.2f}")
+
+
+def _size(size: int) -> str:
+    if size >= 2**20:
+        return f"{size / 2**20:g} MB"
+    return f"{size / 2**10:g} KB"
+
+
+if __name__ == "__main__":
+    main()
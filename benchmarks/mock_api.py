@@ -0,0 +1,304 @@
+"""A local stand-in for the chat completions API.
+
+The server answers each request by repeating the code it was sent, with a
+placeholder docstring added to every class and function that lacks one. It
+can delay responses, fail some of them, and stream them in chunks, so that the
+assistant can be measured without sending anything to the real API.
+
+Run it on its own with `python -m benchmarks.mock_api`, and point the assistant
+at it by setting `OPENAI_API_BASE` to the URL it prints."""
+import ast
+import collections.abc
+import contextlib
+import dataclasses
+import http.server
+import json
+import random
+import threading
+import time
+import typing
+
+import click
+
+from assistant.coding.request import SEPARATOR
+
+
+DOCSTRING = '"""Placeholder docstring from the mock API."""'
+
+# Characters per token when estimating the usage of a request.
+CHARS_PER_TOKEN = 4
+
+
+@dataclasses.dataclass
+class MockSettings:
+    """How the mock API behaves.
+
+    Attributes:
+        latency (float): Seconds before each response is sent.
+        jitter (float): Up to this many seconds are added to the latency.
+        error_rate (float): Fraction of requests failing with a 503 error.
+        rate_limit_rate (float): Fraction of requests failing with a 429 error.
+        retry_after (float): Seconds given in the `Retry-After` header of 429
+            errors.
+        stream_chunk (int): Characters in each chunk of a streamed response.
+        seed (int): Seed of the delays and failures."""
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 0.0
+    stream_chunk: int = 16
+    seed: int = 0
+
+
+class MockServer(http.server.ThreadingHTTPServer):
+    """Serves the chat completions API, handling each request in a thread.
+
+    Attributes:
+        settings (MockSettings): How the API behaves.
+        requests (int): The number of requests received.
+        failures (int): The number of requests that were failed on purpose."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], settings: MockSettings):
+        """Start listening.
+
+        Args:
+            address (tuple[str, int]): The host and port to listen on. Port 0
+                picks a free port.
+            settings (MockSettings): How the API behaves."""
+        super().__init__(address, MockHandler)
+        self.settings = settings
+        self.requests = 0
+        self.failures = 0
+        self._rng = random.Random(settings.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """The base URL of the API, as used for `OPENAI_API_BASE`."""
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}/v1"
+
+    def draw(self) -> tuple[float, int | None]:
+        """Decide how to answer the next request.
+
+        Returns:
+            tuple[float, int | None]: The delay before answering, and the
+            status of the error to fail with, if any."""
+        settings = self.settings
+        with self._lock:
+            self.requests += 1
+            delay = settings.latency + self._rng.uniform(0, settings.jitter)
+            roll = self._rng.random()
+
+            status = None
+            if roll < settings.rate_limit_rate:
+                status = 429
+            elif roll < settings.rate_limit_rate + settings.error_rate:
+                status = 503
+            if status is not None:
+                self.failures += 1
+        return delay, status
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    """Answers one request to the chat completions API."""
+
+    server: MockServer
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Answer a chat completion, fail it, or stream it."""
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, _error(f"Unknown endpoint {self.path}."))
+            return
+
+        delay, status = self.server.draw()
+        time.sleep(delay)
+        if status == 429:
+            headers = {"Retry-After": str(self.server.settings.retry_after)}
+            self._send_json(429, _error("Rate limit reached."), headers)
+            return
+        if status is not None:
+            self._send_json(status, _error("The server is overloaded."))
+            return
+
+        prompt = "\n".join(m["content"] for m in body["messages"])
+        content = respond(prompt)
+        if body.get("stream"):
+            self._stream(body["model"], content)
+            return
+
+        self._send_json(
+            200,
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": _usage(prompt, content),
+            },
+        )
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        """Keep quiet, rather than logging every request."""
+
+    def _send_json(
+        self, status: int, data: object, headers: dict[str, str] | None = None
+    ) -> None:
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, model: str, content: str) -> None:
+        # Without a length, the end of the stream is marked by closing it.
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        size = self.server.settings.stream_chunk
+        deltas: list[dict[str, str]] = [{"role": "assistant"}]
+        deltas.extend(
+            {"content": content[i : i + size]} for i in range(0, len(content), size)
+        )
+        for i, delta in enumerate(deltas):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": "stop" if i == len(deltas) - 1 else None,
+                    }
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def respond(prompt: str) -> str:
+    """Answer a prompt asking for docstrings.
+
+    Args:
+        prompt (str): The prompt, with the code after a line of scissors.
+
+    Returns:
+        str: A fenced code block repeating the code, with a placeholder
+        docstring added to each class and function lacking one. Prompts asking
+        for JSON are answered with code too, which the assistant accepts."""
+    code = prompt.partition(SEPARATOR)[2] or prompt
+    lines = code.splitlines()
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        tree = ast.Module(body=[], type_ignores=[])
+
+    # Insert from the bottom up, so line numbers stay valid.
+    for line, indent in sorted(_docstring_positions(tree), reverse=True):
+        lines.insert(line, " " * indent + DOCSTRING)
+    return "```python\n" + "\n".join(lines) + "\n```\n"
+
+
+def _docstring_positions(tree: ast.AST) -> collections.abc.Iterator[tuple[int, int]]:
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        first = node.body[0]
+        # Bodies on the same line as the signature are left alone.
+        if ast.get_docstring(node) is None and first.lineno > node.lineno:
+            yield first.lineno - 1, first.col_offset
+
+
+def _usage(prompt: str, content: str) -> dict[str, int]:
+    prompt_tokens = -(-len(prompt) // CHARS_PER_TOKEN)
+    completion_tokens = -(-len(content) // CHARS_PER_TOKEN)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _error(message: str) -> dict[str, typing.Any]:
+    return {"error": {"message": message, "type": "mock_error", "code": None}}
+
+
+@contextlib.contextmanager
+def running(
+    settings: MockSettings, host: str = "127.0.0.1", port: int = 0
+) -> collections.abc.Iterator[MockServer]:
+    """Run the mock API in a background thread.
+
+    Args:
+        settings (MockSettings): How the API behaves.
+        host (str): The host to listen on.
+        port (int): The port to listen on, or 0 for any free port.
+
+    Yields:
+        MockServer: The running server."""
+    server = MockServer((host, port), settings)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8000, show_default=True)
+@click.option("--latency", type=float, default=0.0, help="Seconds per response.")
+@click.option("--jitter", type=float, default=0.0, help="Extra random seconds.")
+@click.option("--error-rate", type=float, default=0.0, help="Fraction of 503s.")
+@click.option("--rate-limit-rate", type=float, default=0.0, help="Fraction of 429s.")
+def main(
+    host: str,
+    port: int,
+    latency: float,
+    jitter: float,
+    error_rate: float,
+    rate_limit_rate: float,
+) -> None:
+    """Serve a mock chat completions API until interrupted."""
+    settings = MockSettings(
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        rate_limit_rate=rate_limit_rate,
+    )
+    server = MockServer((host, port), settings)
+    click.echo(f"OPENAI_API_BASE={server.url}", err=True)
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Benchmarks `assistant add-docstrings` on synthetic repositories.
+
+Each repository is generated afresh, and documented in place by a separate
+process talking to the mock API, with the response cache disabled. Timings
+and token usage come from the `--metrics` trace of that process.
+
+The tokenizer of the model is loaded as usual, so its vocabulary must have
+been downloaded once, or be in `$XDG_CACHE_HOME/assistant/tiktoken`."""
+import dataclasses
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import click
+
+from benchmarks.mock_api import MockServer
+from benchmarks.mock_api import MockSettings
+from benchmarks.mock_api import running
+from benchmarks.synthetic import SHAPES
+from benchmarks.synthetic import RepoShape
+from benchmarks.synthetic import generate
+
+
+@dataclasses.dataclass
+class Result:
+    """The measurements of one benchmark.
+
+    Attributes:
+        shape (str): The name of the shape of the repository.
+        files (int): The number of modules in the repository.
+        exit_code (int): The exit code of the assistant.
+        wall (float): Seconds taken by the assistant, including starting up.
+        requests (int): Requests answered by the mock API, including failures.
+        latency (dict[str, float]): Percentiles of the time taken by each
+            request, including retries, in seconds.
+        peak_rss (int): Peak resident set size of the assistant, in bytes.
+        prompt_tokens (int): Tokens sent, as reported by the mock API.
+        completion_tokens (int): Tokens received, as reported by the mock API.
+        counters (dict[str, int]): Every counter of the assistant's metrics."""
+
+    shape: str
+    files: int
+    exit_code: int
+    wall: float
+    requests: int
+    latency: dict[str, float]
+    peak_rss: int
+    prompt_tokens: int
+    completion_tokens: int
+    counters: dict[str, int]
+
+    @property
+    def throughput(self) -> float:
+        """Modules documented per second."""
+        return self.files / self.wall
+
+    @property
+    def tokens_per_file(self) -> float:
+        """Tokens sent and received per module."""
+        return (self.prompt_tokens + self.completion_tokens) / self.files
+
+
+def run_benchmark(
+    name: str,
+    shape: RepoShape,
+    server: MockServer,
+    workdir: pathlib.Path,
+    options: list[str],
+) -> Result:
+    """Document a synthetic repository, measuring the assistant.
+
+    Args:
+        name (str): The name of the shape of the repository.
+        shape (RepoShape): The size and shape of the repository.
+        server (MockServer): The running mock API.
+        workdir (pathlib.Path): Empty directory in which to work.
+        options (list[str]): Extra options of `add-docstrings`.
+
+    Returns:
+        Result: The measurements."""
+    repo = workdir / "repo"
+    files = generate(repo, shape)
+    metrics_path = workdir / "metrics.json"
+
+    env = {
+        **os.environ,
+        "OPENAI_API_BASE": server.url,
+        "OPENAI_API_KEY": "benchmark",
+        "ASSISTANT_NO_SERVER": "1",
+    }
+    command = [
+        sys.executable,
+        "-m",
+        "assistant",
+        "--no-cache",
+        "--metrics",
+        str(metrics_path),
+        "--metrics-format",
+        "trace",
+        "add-docstrings",
+        "--inplace",
+        *options,
+        str(repo),
+    ]
+
+    requests = server.requests
+    started = time.perf_counter()
+    with open(workdir / "output.log", "w") as log:
+        process = subprocess.Popen(command, env=env, stdout=log, stderr=log)
+        # Unlike `wait`, `wait4` reports the peak memory of the process.
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - started
+
+    trace = json.loads(metrics_path.read_text()) if metrics_path.exists() else {}
+    counters = trace.get("summary", {}).get("counters", {})
+    durations = [
+        event["dur"] / 1e6
+        for event in trace.get("traceEvents", [])
+        if event["name"] == "request"
+    ]
+
+    return Result(
+        shape=name,
+        files=len(files),
+        exit_code=process.returncode,
+        wall=wall,
+        requests=server.requests - requests,
+        latency=_percentiles(durations),
+        # Linux reports kilobytes.
+        peak_rss=usage.ru_maxrss * 1024,
+        prompt_tokens=counters.get("prompt_tokens", 0),
+        completion_tokens=counters.get("completion_tokens", 0),
+        counters=counters,
+    )
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    if len(values) < 2:
+        return {p: values[0] if values else 0.0 for p in ("p50", "p90", "p99")}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p90": cuts[89], "p99": cuts[98]}
+
+
+def _report(results: list[Result]) -> str:
+    header = (
+        f"{'shape':<14} {'files':>6} {'files/s':>8} {'p50 ms':>8} {'p90 ms':>8} "
+        f"{'p99 ms':>8} {'RSS MB':>7} {'tok/file':>9} {'retries':>7} {'exit':>4}"
+    )
+    lines = [header]
+    for r in results:
+        lines.append(
+            f"{r.shape:<14} {r.files:>6} {r.throughput:>8.1f} "
+            f"{r.latency['p50'] * 1000:>8.1f} {r.latency['p90'] * 1000:>8.1f} "
+            f"{r.latency['p99'] * 1000:>8.1f} {r.peak_rss / 2**20:>7.1f} "
+            f"{r.tokens_per_file:>9.1f} {r.counters.get('retries', 0):>7} "
+            f"{r.exit_code:>4}"
+        )
+    return "\n".join(lines)
+
+
+@click.command(
+    context_settings={"ignore_unknown_options": True, "allow_extra_args": True}
+)
+@click.option(
+    "--shape",
+    "shapes",
+    type=click.Choice(list(SHAPES)),
+    multiple=True,
+    help="Shape of repository to benchmark. May be repeated. Defaults to all.",
+)
+@click.option(
+    "--scale",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Multiplies the number of modules of each shape.",
+)
+@click.option("--latency", type=float, default=0.05, show_default=True)
+@click.option("--jitter", type=float, default=0.05, show_default=True)
+@click.option("--error-rate", type=float, default=0.0, show_default=True)
+@click.option("--rate-limit-rate", type=float, default=0.0, show_default=True)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),  # type: ignore
+    default=None,
+    help="Also write the results to this JSON file.",
+)
+@click.pass_context
+def main(
+    ctx: click.Context,
+    shapes: tuple[str, ...],
+    scale: float,
+    latency: float,
+    jitter: float,
+    error_rate: float,
+    rate_limit_rate: float,
+    output: pathlib.Path | None,
+) -> None:
+    """Benchmark add-docstrings against a mock API.
+
+    Any other options, such as `--jobs 4` or `--pack`, are passed on to
+    `add-docstrings`.
+    """
+    settings = MockSettings(
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        rate_limit_rate=rate_limit_rate,
+    )
+
+    results = []
+    with running(settings) as server:
+        for name in shapes or SHAPES:
+            shape = SHAPES[name].scaled(scale)
+            with tempfile.TemporaryDirectory() as workdir:
+                result = run_benchmark(
+                    name, shape, server, pathlib.Path(workdir), ctx.args
+                )
+                if result.exit_code != 0:
+                    click.echo((pathlib.Path(workdir) / "output.log").read_text())
+            results.append(result)
+            click.echo(_report(results[-1:]).splitlines()[-1], err=True)
+
+    click.echo(_report(results))
+    if output is not None:
+        data: list[dict[str, typing.Any]] = [dataclasses.asdict(r) for r in results]
+        output.write_text(json.dumps(data, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Generates synthetic repositories of undocumented Python code."""
+import dataclasses
+import pathlib
+import random
+
+
+@dataclasses.dataclass(frozen=True)
+class RepoShape:
+    """The size and shape of a synthetic repository.
+
+    Attributes:
+        files (int): The number of modules.
+        files_per_package (int): The number of modules in each package.
+        functions (int): The number of top-level functions in each module.
+        classes (int): The number of top-level classes in each module.
+        methods (int): The number of methods in each class.
+        nesting (int): The depth of classes nested in each top-level class.
+        body_lines (int): The number of statements in each function."""
+
+    files: int
+    files_per_package: int = 20
+    functions: int = 3
+    classes: int = 1
+    methods: int = 2
+    nesting: int = 0
+    body_lines: int = 4
+
+    def scaled(self, factor: float) -> "RepoShape":
+        """Scale the number of modules.
+
+        Args:
+            factor (float): The factor to scale by.
+
+        Returns:
+            RepoShape: The shape with at least one module."""
+        return dataclasses.replace(self, files=max(1, round(self.files * factor)))
+
+
+SHAPES = {
+    "small-files": RepoShape(files=200),
+    "huge-modules": RepoShape(
+        files=3, functions=300, classes=30, methods=10, body_lines=12
+    ),
+    "deep-nesting": RepoShape(files=20, functions=0, classes=2, methods=3, nesting=6),
+}
+
+
+def generate(root: pathlib.Path, shape: RepoShape, seed: int = 0) -> list[pathlib.Path]:
+    """Write a synthetic repository.
+
+    Modules are spread over packages, none of which have docstrings.
+
+    Args:
+        root (pathlib.Path): The directory to write to, which is created.
+        shape (RepoShape): The size and shape of the repository.
+        seed (int): Seed from which the code is generated.
+
+    Returns:
+        list[pathlib.Path]: The modules that were written."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(shape.files):
+        package = root / f"package_{i // shape.files_per_package}"
+        package.mkdir(parents=True, exist_ok=True)
+        (package / "__init__.py").touch()
+
+        path = package / f"module_{i}.py"
+        path.write_text(module(shape, rng))
+        paths.append(path)
+    return paths
+
+
+def module(shape: RepoShape, rng: random.Random) -> str:
+    """Generate the source of one module.
+
+    Args:
+        shape (RepoShape): The size and shape of the repository.
+        rng (random.Random): Source of variation between functions.
+
+    Returns:
+        str: The source code."""
+    lines = ["import math", ""]
+    for i in range(shape.functions):
+        lines.extend(["", *_function(f"function_{i}", "", shape, rng), ""])
+    for i in range(shape.classes):
+        lines.extend(["", *_class(f"Class{i}", "", shape.nesting, shape, rng), ""])
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def _class(
+    name: str, indent: str, nesting: int, shape: RepoShape, rng: random.Random
+) -> list[str]:
+    lines = [f"{indent}class {name}:"]
+    body = indent + "    "
+    for i in range(shape.methods):
+        lines.extend([*_function(f"method_{i}", body, shape, rng, method=True), ""])
+    if nesting > 0:
+        lines.extend(_class(f"{name}Inner", body, nesting - 1, shape, rng))
+    if len(lines) == 1:
+        lines.append(f"{body}pass")
+    return lines
+
+
+def _function(
+    name: str, indent: str, shape: RepoShape, rng: random.Random, method: bool = False
+) -> list[str]:
+    params = ["self"] if method else []
+    params.extend(f"arg_{i}" for i in range(rng.randint(1, 4)))
+    lines = [f"{indent}def {name}({', '.join(params)}):"]
+
+    body = indent + "    "
+    value = params[-1]
+    for i in range(shape.body_lines):
+        operation = rng.choice(["+", "-", "*"])
+        lines.append(f"{body}value_{i} = math.floor({value} {operation} {i + 1})")
+        value = f"value_{i}"
+    lines.append(f"{body}return {value}")
+    return lines
@@ -1,12 +1,15 @@
 """Command-line interface to coding assistant."""
 import assistant.coding.cli
 import assistant.conversation.cli
+import assistant.server
 from assistant.cli import main
 
 
 # Register subcommands.
 main.add_command(assistant.conversation.cli.converse)
 main.add_command(assistant.coding.cli.add_docstrings)
+main.add_command(assistant.coding.cli.plan)
+main.add_command(assistant.server.serve)
 
 if __name__ == "__main__":
     main(prog_name="assistant")  # pragma: no cover
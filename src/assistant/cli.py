@@ -1,12 +1,33 @@
+import collections.abc
 import dataclasses
+import functools
 import os
+import pathlib
+import sys
+import typing
 
 import click
-import openai
-import tiktoken
-from dotenv import load_dotenv
 
-import assistant.model
+from assistant import metrics
+from assistant import startup
+from assistant.conversation.cache import ResponseCache
+from assistant.conversation.cache import default_cache_dir
+from assistant.model import Router
+from assistant.model import RoutingPolicy
+from assistant.model import model_info
+
+
+# The CLI imports slow libraries only when they are needed, so that --help and
+# tab completion are quick.
+if typing.TYPE_CHECKING:
+    import asyncio
+
+    import aiohttp
+    import tiktoken
+
+    from assistant.conversation.scheduler import RequestScheduler
+
+T = typing.TypeVar("T")
 
 
 @dataclasses.dataclass
@@ -17,12 +38,214 @@ class AppContext:
         model (str): Transformer model to be used
         max_tokens (int): Maximum number of tokens that can be generated
         temperature (float): Model's randomness. Higher value means more randomness
-        tokenizer (tiktoken.Encoding): Encoder for the model"""
+        cache (ResponseCache | None): Cache of model responses, or None if
+            caching is disabled
+        make_scheduler (Callable[[str], RequestScheduler] | None): Creates the
+            scheduler of a model, when it is first used
+        router (Router | None): Chooses the model of each request by its
+            size, or None to send every request to `model`
+        resources (Resources | None): The shared resources, whose event loop
+            and HTTP session asynchronous commands run in"""
 
     model: str
     max_tokens: int
     temperature: float
-    tokenizer: tiktoken.Encoding
+    cache: ResponseCache | None = None
+    make_scheduler: collections.abc.Callable[[str], "RequestScheduler"] | None = None
+    router: Router | None = None
+    resources: "Resources | None" = None
+    _schedulers: dict[str, "RequestScheduler"] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    @property
+    def scheduler(self) -> "RequestScheduler | None":
+        """Paces and retries requests to `model` to stay within rate limits."""
+        return self.scheduler_for(self.model)
+
+    @property
+    def schedulers(self) -> dict[str, "RequestScheduler"]:
+        """The scheduler of each model that requests may be routed to."""
+        models = [m.name for m in self.router.models] if self.router else [self.model]
+        return {m: s for m in models if (s := self.scheduler_for(m)) is not None}
+
+    def scheduler_for(self, model: str) -> "RequestScheduler | None":
+        """Return the scheduler of a model, creating it when it is first used.
+
+        Args:
+            model (str): The name of the model.
+
+        Returns:
+            RequestScheduler | None: The scheduler, or None if requests are
+            not scheduled."""
+        if self.make_scheduler is None:
+            return None
+        if model not in self._schedulers:
+            self._schedulers[model] = self.make_scheduler(model)
+        return self._schedulers[model]
+
+    def run(self, coroutine: collections.abc.Coroutine[typing.Any, typing.Any, T]) -> T:
+        """Run a coroutine to completion, on the shared event loop if any.
+
+        Args:
+            coroutine (Coroutine): The coroutine.
+
+        Returns:
+            T: The result of the coroutine."""
+        if self.resources is None:
+            import asyncio
+
+            return asyncio.run(coroutine)
+        return self.resources.run(coroutine)
+
+    @property
+    def tokenizer(self) -> "tiktoken.Encoding":
+        """Encoder for the model, loaded on first use."""
+        return load_tokenizer(self.model)
+
+
+# Key under which shared resources are kept in the metadata of the context.
+RESOURCES_KEY = "assistant.resources"
+
+
+@functools.cache
+def load_tokenizer(model: str) -> "tiktoken.Encoding":
+    """Load the tokenizer of a model, once per process.
+
+    The vocabulary is downloaded once and kept in the `tiktoken` directory of
+    the default cache directory, or in `$TIKTOKEN_CACHE_DIR` if set, so that
+    later loads don't need the network.
+
+    Args:
+        model (str): The name of the model.
+
+    Returns:
+        tiktoken.Encoding: The tokenizer."""
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", str(default_cache_dir() / "tiktoken"))
+    with startup.phase("tokenizer"):
+        import tiktoken
+
+        return tiktoken.encoding_for_model(model)
+
+
+class Resources:
+    """Objects that are expensive to create, shared between invocations.
+
+    A single invocation of the CLI creates its own, closed when it exits. The
+    server created by `assistant serve` keeps one for its whole life, so that
+    each command it runs finds the caches open, the schedulers already
+    tracking the rate limits, and the connections to the API open.
+
+    Attributes:
+        caches (dict[pathlib.Path, ResponseCache]): The open cache of each
+            cache directory.
+        schedulers (dict[tuple[str, int | None, int | None, int | None], RequestScheduler]):
+            The scheduler for each model and set of limits.
+        loop (asyncio.AbstractEventLoop | None): The event loop on which
+            asynchronous commands run, once one has.
+        session (aiohttp.ClientSession | None): The HTTP session over which
+            asynchronous requests are sent, once one has been."""
+
+    def __init__(self) -> None:
+        """Initialize, with nothing created yet."""
+        self.caches: dict[pathlib.Path, ResponseCache] = {}
+        self.schedulers: dict[
+            tuple[str, int | None, int | None, int | None], "RequestScheduler"
+        ] = {}
+        self.loop: "asyncio.AbstractEventLoop | None" = None
+        self.session: "aiohttp.ClientSession | None" = None
+
+    def cache(self, cache_dir: pathlib.Path) -> ResponseCache:
+        """Return the cache of a directory, with its counts of hits reset.
+
+        Args:
+            cache_dir (pathlib.Path): Directory in which the cache is stored.
+
+        Returns:
+            ResponseCache: The cache."""
+        cache = self.caches.setdefault(cache_dir, ResponseCache(cache_dir))
+        cache.hits = cache.misses = 0
+        return cache
+
+    def scheduler(
+        self,
+        model: str,
+        requests_per_minute: int | None,
+        tokens_per_minute: int | None,
+        max_retries: int | None,
+    ) -> "RequestScheduler":
+        """Return the scheduler for a model, with its counts of retries reset.
+
+        Args:
+            model (str): The name of the model.
+            requests_per_minute (int | None): The limit of requests per
+                minute, if any.
+            tokens_per_minute (int | None): The limit of tokens per minute, if
+                any.
+            max_retries (int | None): The number of times a request is
+                retried, or None for the default.
+
+        Returns:
+            RequestScheduler: The scheduler."""
+        from assistant.conversation.scheduler import DEFAULT_MAX_RETRIES
+        from assistant.conversation.scheduler import RequestScheduler
+
+        key = (model, requests_per_minute, tokens_per_minute, max_retries)
+        if (scheduler := self.schedulers.get(key)) is None:
+            scheduler = self.schedulers[key] = RequestScheduler(
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=tokens_per_minute,
+                max_retries=DEFAULT_MAX_RETRIES if max_retries is None else max_retries,
+                # Token counts are only needed to keep within a token limit.
+                tokenizer=load_tokenizer(model) if tokens_per_minute else None,
+            )
+        scheduler.retries = scheduler.rate_limited = 0
+        return scheduler
+
+    def run(self, coroutine: collections.abc.Coroutine[typing.Any, typing.Any, T]) -> T:
+        """Run a coroutine on the event loop shared by every command.
+
+        The HTTP session, and the connections it keeps alive, are bound to the
+        loop, so they are reused by every command until the resources close.
+
+        Args:
+            coroutine (Coroutine): The coroutine.
+
+        Returns:
+            T: The result of the coroutine."""
+        if self.loop is None:
+            import asyncio
+
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(self._in_session(coroutine))
+
+    async def _in_session(
+        self, coroutine: collections.abc.Coroutine[typing.Any, typing.Any, T]
+    ) -> T:
+        import aiohttp
+        import openai
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        token = openai.aiosession.set(self.session)
+        try:
+            return await coroutine
+        finally:
+            openai.aiosession.reset(token)
+
+    def close(self) -> None:
+        """Close every cache, the HTTP session and the event loop."""
+        for cache in self.caches.values():
+            cache.close()
+        self.caches.clear()
+
+        if self.loop is not None:
+            if self.session is not None:
+                self.loop.run_until_complete(self.session.close())
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.run_until_complete(self.loop.shutdown_default_executor())
+            self.loop.close()
+            self.loop = self.session = None
 
 
 @click.group()
@@ -33,6 +256,27 @@ class AppContext:
     help="Transformer model",
     default="gpt-3.5-turbo",
 )
+@click.option(
+    "--route",
+    "routes",
+    type=str,
+    multiple=True,
+    help=(
+        "Model that requests may be routed to, by their size, unless --routing "
+        "is off. May be repeated. Defaults to --model and the models of its "
+        "family with larger context windows."
+    ),
+)
+@click.option(
+    "--routing",
+    type=click.Choice([policy.name.lower() for policy in RoutingPolicy]),
+    help=(
+        "Send every request to --model, or each request to the cheapest or the "
+        "fastest model it fits."
+    ),
+    default="off",
+    show_default=True,
+)
 @click.option(
     "-t",
     "--temperature",
@@ -40,31 +284,182 @@ class AppContext:
     help="Model temperature",
     default=1.0,
 )
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),  # type: ignore
+    help="Directory in which model responses are cached.",
+    default=default_cache_dir,
+    show_default="$XDG_CACHE_HOME/assistant",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Always send requests to the API, bypassing the response cache.",
+    default=False,
+)
+@click.option(
+    "--requests-per-minute",
+    type=click.IntRange(min=0),
+    help="Rate limit on requests to each model. 0 means no limit.",
+    default=None,
+)
+@click.option(
+    "--tokens-per-minute",
+    type=click.IntRange(min=0),
+    help=(
+        "Rate limit on tokens sent to and received from each model. 0 means no "
+        "limit."
+    ),
+    default=None,
+)
+@click.option(
+    "--model-rate-limits",
+    is_flag=True,
+    help=(
+        "Pace each model to its usual rate limits, unless --requests-per-minute "
+        "or --tokens-per-minute is given."
+    ),
+    default=False,
+)
+@click.option(
+    "--max-retries",
+    type=click.IntRange(min=0),
+    help="Number of times rate-limited or failed requests are retried.",
+    # The scheduler's default, which is not imported until it is needed.
+    default=None,
+    show_default="6",
+)
+@click.option(
+    startup.PROFILE_OPTION,
+    "startup_profile",
+    is_flag=True,
+    help="Report the time spent starting up, and in the slowest imports.",
+    default=False,
+)
+@click.option(
+    "--metrics",
+    "metrics_path",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),  # type: ignore
+    help="Write timings, token usage, retries and cache hits to this JSON file.",
+    default=None,
+)
+@click.option(
+    "--metrics-format",
+    type=click.Choice(["summary", "trace"]),
+    help="Write totals only, or every span in the Trace Event Format.",
+    default="summary",
+    show_default=True,
+)
 @click.pass_context
 def main(
     ctx: click.Context,
     model: str,
+    routes: tuple[str, ...],
+    routing: str,
     temperature: float,
+    cache_dir: pathlib.Path,
+    no_cache: bool,
+    requests_per_minute: int | None,
+    tokens_per_minute: int | None,
+    model_rate_limits: bool,
+    max_retries: int | None,
+    startup_profile: bool,
+    metrics_path: pathlib.Path | None,
+    metrics_format: str,
 ) -> None:
     """Coding assistant, using OpenAI's APIs to generate code."""
-    # During development, the OpenAPI key can be stored in a .env file.
+    try:
+        router = Router.for_model(model, routes, RoutingPolicy[routing.upper()])
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--model or --route") from e
+    # With one model to route to, it is used for every request, and the size
+    # of requests needn't be counted to choose it.
+    if len(router.models) == 1:
+        model = router.models[0].name
+
+    if startup_profile:
+        profile = startup.start()
+        ctx.call_on_close(lambda: click.echo(profile.report(), err=True))
+    if metrics_path is not None:
+        recorded = metrics.start(trace=metrics_format == "trace")
+        ctx.call_on_close(metrics.stop)
+        ctx.call_on_close(lambda: recorded.write(metrics_path))
+
+    # During development, the OpenAPI key can be stored in a .env file. The
+    # openai library reads it from the environment when it is imported.
+    from dotenv import load_dotenv
+
     load_dotenv()
-    if key := os.getenv("OPENAI_API_KEY"):
-        openai.api_key = key
+    _refresh_openai_settings()
 
-    tokenizer = tiktoken.encoding_for_model(model)
+    # Under `assistant serve`, resources outlive the invocation.
+    if (resources := ctx.meta.get(RESOURCES_KEY)) is None:
+        resources = ctx.meta[RESOURCES_KEY] = Resources()
+        ctx.call_on_close(resources.close)
+
+    cache = None if no_cache else resources.cache(cache_dir)
+
+    def make_scheduler(name: str) -> "RequestScheduler":
+        info = model_info(name)
+        return resources.scheduler(
+            name,
+            _rate_limit(
+                requests_per_minute,
+                info.requests_per_minute if model_rate_limits else None,
+            ),
+            _rate_limit(
+                tokens_per_minute,
+                info.tokens_per_minute if model_rate_limits else None,
+            ),
+            max_retries,
+        )
 
     ctx.obj = AppContext(
         model=model,
-        max_tokens=assistant.model.MAX_TOKENS[model],
+        max_tokens=router.max_tokens,
         temperature=temperature,
-        tokenizer=tokenizer,
+        cache=cache,
+        make_scheduler=make_scheduler,
+        router=router if len(router.models) > 1 else None,
+        resources=resources,
     )
 
 
+def _rate_limit(given: int | None, usual: int | None) -> int | None:
+    """Choose the rate limit of a model.
+
+    Args:
+        given (int | None): The limit given on the command line, if any, where
+            0 means no limit.
+        usual (int | None): The usual limit of the model, if requests are
+            paced to it.
+
+    Returns:
+        int | None: The limit, or None if there is none."""
+    if given is None:
+        return usual
+    return given or None
+
+
+def _refresh_openai_settings() -> None:
+    """Apply the settings of the environment to openai, if already imported.
+
+    Under `assistant serve`, openai was imported by an earlier command, and
+    read its settings from the environment of that command."""
+    openai: typing.Any = sys.modules.get("openai")
+    if openai is None:
+        return
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    openai.api_key_path = os.getenv("OPENAI_API_KEY_PATH")
+    openai.organization = os.getenv("OPENAI_ORGANIZATION")
+    openai.api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+
+
 @main.command()
 def list_models() -> None:
     """List available OpenAI models."""
+    import openai
+
     print("Available models:")
     models = sorted(openai.Model.list()["data"], key=lambda m: m["id"])  # type: ignore
     for model in models:
@@ -0,0 +1,201 @@
+"""Runs commands through the `assistant serve` server, if one is running.
+
+This module is the entry point of the `assistant` script, so it only imports
+the standard library: the point of the server is that clients don't pay for
+importing openai, libcst and tiktoken."""
+import contextlib
+import json
+import os
+import pathlib
+import socket
+import sys
+import tempfile
+
+from assistant import startup
+
+
+# Options of the `assistant` group that take a value, so that the subcommand
+# can be found without importing the command line.
+GROUP_VALUE_OPTIONS = frozenset(
+    {
+        "--model",
+        "--route",
+        "--routing",
+        "-t",
+        "--temperature",
+        "--cache-dir",
+        "--requests-per-minute",
+        "--tokens-per-minute",
+        "--max-retries",
+        "--metrics",
+        "--metrics-format",
+    }
+)
+
+
+# Environment variables that commands on the server take from the client:
+# credentials and settings of the assistant and the API, and what git and the
+# caches depend on. Nothing else leaves the client.
+FORWARDED_PREFIXES = ("ASSISTANT_", "OPENAI_", "GIT_")
+FORWARDED_VARIABLES = frozenset(
+    {
+        "HOME",
+        "PATH",
+        "TIKTOKEN_CACHE_DIR",
+        "XDG_CACHE_HOME",
+        "HTTP_PROXY",
+        "HTTPS_PROXY",
+        "NO_PROXY",
+        "http_proxy",
+        "https_proxy",
+        "no_proxy",
+    }
+)
+
+
+def is_forwarded(name: str) -> bool:
+    """Check whether an environment variable is sent to the server.
+
+    Args:
+        name (str): The name of the variable.
+
+    Returns:
+        bool: Whether commands on the server use the client's value."""
+    return name in FORWARDED_VARIABLES or name.startswith(FORWARDED_PREFIXES)
+
+
+def default_socket_path() -> pathlib.Path:
+    """Return the path of the socket on which the server listens by default.
+
+    Returns:
+        pathlib.Path: `$ASSISTANT_SOCKET` if set, else `assistant.sock` in
+        `$XDG_RUNTIME_DIR`, falling back to a directory of the current user
+        in the temporary directory."""
+    if path := os.getenv("ASSISTANT_SOCKET"):
+        return pathlib.Path(path)
+    if runtime_dir := os.getenv("XDG_RUNTIME_DIR"):
+        return pathlib.Path(runtime_dir) / "assistant.sock"
+    user_dir = pathlib.Path(tempfile.gettempdir()) / f"assistant-{os.getuid()}"
+    return user_dir / "assistant.sock"
+
+
+def check_private(socket_path: pathlib.Path) -> None:
+    """Check that no other user can have created or replaced the socket.
+
+    Args:
+        socket_path (pathlib.Path): The socket on which the server listens.
+
+    Raises:
+        FileNotFoundError: If the directory of the socket doesn't exist.
+        PermissionError: If the directory or the socket belongs to another
+            user, or other users can write to the directory."""
+    uid = os.getuid()
+    directory = os.stat(socket_path.parent)
+    if directory.st_uid != uid or directory.st_mode & 0o022:
+        raise PermissionError(
+            f"{socket_path.parent} is not private to the current user."
+        )
+    with contextlib.suppress(FileNotFoundError):
+        if os.lstat(socket_path).st_uid != uid:
+            raise PermissionError(f"{socket_path} belongs to another user.")
+
+
+def connect(socket_path: pathlib.Path) -> socket.socket | None:
+    """Connect to the server, if it belongs to the current user.
+
+    Args:
+        socket_path (pathlib.Path): The socket on which the server listens.
+
+    Returns:
+        socket.socket | None: The connection, or None if no server is
+        listening.
+
+    Raises:
+        PermissionError: If another user could have put the socket there."""
+    try:
+        check_private(socket_path)
+    except FileNotFoundError:
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(socket_path))
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def subcommand(argv: list[str]) -> str | None:
+    """Find the subcommand in the arguments of the command line.
+
+    Args:
+        argv (list[str]): The arguments, without the name of the program.
+
+    Returns:
+        str | None: The first argument that is neither an option of the group
+        nor the value of one, or None if there is none."""
+    args = iter(argv)
+    for arg in args:
+        if arg == "--":
+            return next(args, None)
+        if not arg.startswith("-"):
+            return arg
+        if arg in GROUP_VALUE_OPTIONS:
+            next(args, None)
+    return None
+
+
+def run_remote(connection: socket.socket, argv: list[str]) -> int:
+    """Run a command on the server, relaying its output as it is written.
+
+    The command runs in the working directory of the client, with the
+    variables of its environment that the server uses.
+
+    Args:
+        connection (socket.socket): The connection to the server.
+        argv (list[str]): The arguments of the command.
+
+    Returns:
+        int: The exit code of the command."""
+    env = {name: value for name, value in os.environ.items() if is_forwarded(name)}
+    request = {"argv": argv, "cwd": os.getcwd(), "env": env}
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(request).encode() + b"\n")
+        stream.flush()
+
+        for line in stream:
+            message = json.loads(line)
+            if "exit" in message:
+                return int(message["exit"])
+            output = sys.stdout if "stdout" in message else sys.stderr
+            output.write(message.get("stdout", message.get("stderr", "")))
+            output.flush()
+
+    print("Error: the server closed the connection.", file=sys.stderr)
+    return 1
+
+
+def run() -> None:
+    """Run the command line, on the server if one is listening.
+
+    Set `ASSISTANT_NO_SERVER` to always run commands in this process."""
+    argv = sys.argv[1:]
+    if startup.PROFILE_OPTION in argv:
+        # Start before anything else is imported. The profile is only of
+        # interest in this process, not in the server.
+        startup.start()
+    # The server can't start another server, so `serve` always runs here.
+    elif subcommand(argv) != "serve" and not os.getenv("ASSISTANT_NO_SERVER"):
+        try:
+            connection = connect(default_socket_path())
+        except PermissionError as e:
+            print(f"Warning: not using the server: {e}", file=sys.stderr)
+            connection = None
+        if connection is not None:
+            sys.exit(run_remote(connection, argv))
+
+    # Registers the commands of the command line.
+    import assistant.__main__  # noqa: F401
+    from assistant.cli import main
+
+    main(prog_name="assistant")
@@ -1,5 +1,6 @@
 """Adds docstrings suggested by the OpenAI model back to the source code."""
 import ast
+import collections.abc
 import enum
 import textwrap
 from collections.abc import Sequence
@@ -8,9 +9,14 @@ from typing import TypeVar
 
 import libcst as cst
 
+from assistant import metrics
+from assistant.coding.parsed import ParsedFile
+
 
 T = TypeVar("T", cst.FunctionDef, cst.ClassDef, cst.Module)
 
+Definition = ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef
+
 
 class ApplierMode(enum.Enum):
     REPLACE = enum.auto()
@@ -61,13 +67,33 @@ class DocstringTransformer(cst.CSTTransformer):
         if isinstance(node, cst.Module):
             return self._add_docstring_to_module(docstring_node, has_docstring, node)
 
-        body: Sequence[cst.BaseStatement] | Sequence[cst.BaseSmallStatement] = (
-            node.body.body[1:] if has_docstring else node.body.body
-        )
+        block = node.body
+        if isinstance(block, cst.SimpleStatementSuite):
+            # A one-line body must become an indented block to hold a docstring.
+            block = cst.IndentedBlock(body=[cst.SimpleStatementLine(block.body)])
+        assert isinstance(block, cst.IndentedBlock)
+
+        statements: Sequence[cst.BaseStatement] = block.body
+        if has_docstring:
+            statements = self._without_docstring(statements)
         return node.with_changes(
-            body=node.body.with_changes(body=(docstring_node, *body))
+            body=block.with_changes(body=(docstring_node, *statements))
         )
 
+    @staticmethod
+    def _without_docstring(
+        body: Sequence[cst.BaseStatement],
+    ) -> Sequence[cst.BaseStatement]:
+        # Keep any statements following the docstring on the same line.
+        first = body[0]
+        if isinstance(first, cst.SimpleStatementLine) and len(first.body) > 1:
+            rest = [
+                s.with_changes(semicolon=cst.MaybeSentinel.DEFAULT)
+                for s in first.body[1:]
+            ]
+            return (first.with_changes(body=rest, leading_lines=()), *body[1:])
+        return body[1:]
+
     @staticmethod
     def _add_docstring_to_module(
         docstring_node: cst.SimpleStatementLine,
@@ -93,7 +119,12 @@ class DocstringTransformer(cst.CSTTransformer):
     ) -> cst.FunctionDef:
         key = tuple(self.stack)
         self.stack.pop()
-        return self._add_docstring(updated_node, self.function_defs.get(key, None))
+        # libcst represents both kinds of function with FunctionDef.
+        if updated_node.asynchronous:
+            docstrings = self.async_function_defs
+        else:
+            docstrings = self.function_defs
+        return self._add_docstring(updated_node, docstrings.get(key, None))
 
     def leave_ClassDef(
         self, original_node: cst.ClassDef, updated_node: cst.ClassDef
@@ -108,6 +139,163 @@ class DocstringTransformer(cst.CSTTransformer):
         return self._add_docstring(updated_node, self.module_docstring)
 
 
+class DocstringSplicer:
+    """Applies docstrings by splicing lines of text, without parsing with libcst.
+
+    Positions of the nodes are taken from `ast`, which is much faster to parse.
+    The output is the same as that of `DocstringTransformer`. Code that can't
+    safely be spliced, such as bodies sharing a line with their signature or
+    statements separated by semicolons, is left to the transformer.
+
+    Attributes:
+        async_function_defs (dict[tuple[str, ...], str | None]): Docstrings of
+            async functions, keyed by their path.
+        function_defs (dict[tuple[str, ...], str | None]): Docstrings of
+            functions, keyed by their path.
+        classes (dict[tuple[str, ...], str | None]): Docstrings of classes,
+            keyed by their path.
+        module_docstring (str | None): Docstring of the module.
+        mode (ApplierMode): The mode of applying the docstrings."""
+
+    def __init__(
+        self,
+        async_function_defs: dict[tuple[str, ...], str | None],
+        function_defs: dict[tuple[str, ...], str | None],
+        classes: dict[tuple[str, ...], str | None],
+        module_docstring: str | None,
+        mode: ApplierMode,
+    ):
+        """Initialize the splicer.
+
+        Args:
+            async_function_defs (dict[tuple[str, ...], str | None]): Docstrings
+                of async functions, keyed by their path.
+            function_defs (dict[tuple[str, ...], str | None]): Docstrings of
+                functions, keyed by their path.
+            classes (dict[tuple[str, ...], str | None]): Docstrings of classes,
+                keyed by their path.
+            module_docstring (str | None): Docstring of the module.
+            mode (ApplierMode): The mode of applying the docstrings."""
+        self.async_function_defs = async_function_defs
+        self.function_defs = function_defs
+        self.classes = classes
+        self.module_docstring = module_docstring
+        self.mode = mode
+
+    def splice(self, text: str, tree: ast.Module | None = None) -> str | None:
+        """Apply the docstrings to some code.
+
+        Args:
+            text (str): The code to which to apply the docstrings.
+            tree (ast.Module | None): The syntax tree of the code, if it has
+                already been parsed.
+
+        Returns:
+            str | None: The modified code, or None if it can't be spliced."""
+        if "\r" in text:
+            return None
+
+        if tree is None:
+            tree = ast.parse(text)
+        if self.module_docstring and (
+            self.mode == ApplierMode.REPLACE or ast.get_docstring(tree) is None
+        ):
+            # The module header is stored differently by libcst; leave it be.
+            return None
+
+        lines = text.split("\n")
+        edits: list[tuple[int, int, str]] = []
+        for node, key in self._definitions(tree, ()):
+            edit = self._edit(node, self._docstring(node, key), lines)
+            if edit is None:
+                return None
+            if edit:
+                edits.append(edit)
+
+        # Copy the lines between edits once, rather than splicing the list in
+        # place, which shifts every later line for each edit.
+        spliced: list[str] = []
+        copied = 0
+        for start, end, line in sorted(edits):
+            spliced.extend(lines[copied:start])
+            spliced.append(line)
+            copied = end
+        spliced.extend(lines[copied:])
+        return "\n".join(spliced)
+
+    def _definitions(
+        self, node: ast.AST, stack: tuple[str, ...]
+    ) -> collections.abc.Iterable[tuple[Definition, tuple[str, ...]]]:
+        """Yield every class and function, with the same keys as the transformer.
+
+        Args:
+            node (ast.AST): The node to search.
+            stack (tuple[str, ...]): Path to the node.
+
+        Yields:
+            tuple[Definition, tuple[str, ...]]: Each definition and its path."""
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, Definition):
+                key = (*stack, child.name)
+                yield child, key
+                yield from self._definitions(child, key)
+            else:
+                yield from self._definitions(child, stack)
+
+    def _docstring(self, node: Definition, key: tuple[str, ...]) -> str | None:
+        if isinstance(node, ast.AsyncFunctionDef):
+            return self.async_function_defs.get(key, None)
+        elif isinstance(node, ast.FunctionDef):
+            return self.function_defs.get(key, None)
+        return self.classes.get(key, None)
+
+    def _edit(
+        self, node: Definition, docstring: str | None, lines: list[str]
+    ) -> tuple[int, int, str] | tuple[()] | None:
+        """Work out the lines to replace to give a node its docstring.
+
+        Args:
+            node (Definition): The class or function.
+            docstring (str | None): The docstring to give it.
+            lines (list[str]): The lines of the original code.
+
+        Returns:
+            tuple[int, int, str] | tuple[()] | None: The start and end of the
+            lines to replace, and the line to replace them with. An empty tuple
+            if the node is left as it is, or None if it can't be spliced."""
+        has_docstring = ast.get_docstring(node) is not None
+        if not docstring or (has_docstring and self.mode == ApplierMode.KEEP):
+            return ()
+
+        first = node.body[0]
+        decorators = getattr(first, "decorator_list", [])
+        first_line = min([first.lineno, *(d.lineno for d in decorators)])
+        prefix = lines[first_line - 1].encode()[: first.col_offset]
+        if prefix.strip():
+            # The body starts on the same line as the signature.
+            return None
+
+        # Comments and blank lines before the body follow the new docstring.
+        start = first_line - 1
+        while start > node.lineno and _is_blank(lines[start - 1]):
+            start -= 1
+
+        end = start
+        if has_docstring:
+            if len(node.body) > 1 and node.body[1].lineno == first.end_lineno:
+                # The docstring is followed by another statement on its line.
+                return None
+            end = first.end_lineno or first.lineno
+
+        docstring_line = f'{prefix.decode()}"""{textwrap.dedent(docstring)}"""'
+        return start, end, docstring_line
+
+
+def _is_blank(line: str) -> bool:
+    stripped = line.strip()
+    return not stripped or stripped.startswith("#")
+
+
 class ReplacementDocstringExtractor(ast.NodeVisitor):
     def __init__(self) -> None:
         """AST visitor to extract docstrings.
@@ -120,7 +308,50 @@ class ReplacementDocstringExtractor(ast.NodeVisitor):
         self.module_docstring: str | None = None
         self.stack: list[str] = []
 
-    def _key(self, name: str) -> tuple[str]:
+    def add(self, replacement: str, prefix: tuple[str, ...] = ()) -> None:
+        """Extract the docstrings from a piece of code.
+
+        Can be called repeatedly to merge docstrings from several responses.
+
+        Args:
+            replacement (str): Code containing the docstrings.
+            prefix (tuple[str, ...]): Path to the scope in which the code is
+                defined. For example, methods of class `A` taken out of their
+                class have the prefix `("A",)`."""
+        self.stack = list(prefix)
+        self.visit(ast.parse(replacement))
+        self.stack = []
+
+    def add_mapping(
+        self, docstrings: dict[str, str], prefix: tuple[str, ...] = ()
+    ) -> None:
+        """Add docstrings keyed by dotted name, without parsing any code.
+
+        Args:
+            docstrings (dict[str, str]): Docstrings keyed by the dotted path to
+                their node, such as `"A.f"` for method `f` of class `A`.
+            prefix (tuple[str, ...]): Path to the scope the names are relative to.
+        """
+        for name, docstring in docstrings.items():
+            key = (*prefix, *name.split("."))
+            # A mapping doesn't say what kind of node each name refers to, but
+            # the transformer only looks each node up under its own kind.
+            self.async_function_defs[key] = docstring
+            self.function_defs[key] = docstring
+            self.classes[key] = docstring
+
+    def retain(self, keys: collections.abc.Container[tuple[str, ...]]) -> None:
+        """Drop every docstring except those of some nodes.
+
+        Args:
+            keys (Container[tuple[str, ...]]): Paths of the nodes whose
+                docstrings are kept. The module docstring is always dropped."""
+        for docstrings in (self.async_function_defs, self.function_defs, self.classes):
+            for key in [k for k in docstrings if k not in keys]:
+                del docstrings[key]
+        self.module_docstring = None
+
+    def _key(self, name: str) -> tuple[str, ...]:
         self.stack.append(name)
         return tuple(self.stack)
 
@@ -149,19 +380,33 @@ class ReplacementDocstringExtractor(ast.NodeVisitor):
         return result
 
     def visit_Module(self, node: ast.Module) -> Any:
-        self.module_docstring = ast.get_docstring(node)
+        # Code extracted from inside a class or function has no module docstring.
+        if not self.stack and self.module_docstring is None:
+            self.module_docstring = ast.get_docstring(node)
         return super().generic_visit(node)
 
 
 class DocstringApplier:
-    def __init__(self, text: str, mode: ApplierMode):
+    def __init__(
+        self,
+        text: str,
+        mode: ApplierMode,
+        splice: bool = True,
+        parsed: ParsedFile | None = None,
+    ):
         """Initialize DocstringApplier class.
 
         Args:
             text (str): The text to which to apply the docstrings.
-            mode (ApplierMode): The mode of applying the docstrings."""
+            mode (ApplierMode): The mode of applying the docstrings.
+            splice (bool): Whether to try splicing docstrings into the text
+                before falling back to a full libcst round-trip.
+            parsed (ParsedFile | None): The text, already parsed. If given,
+                its trees are reused rather than parsing the text again."""
         self.text = text
         self.mode = mode
+        self.splice = splice
+        self.parsed = parsed
 
     def apply(self, replacement: str) -> str:
         """Applies the replacement docstring to the text based on the mode.
@@ -171,18 +416,45 @@ class DocstringApplier:
 
         Returns:
             str: The modified code with revised docstrings."""
-        original_cst = cst.parse_module(self.text)
-        replacement_ast = ast.parse(replacement)
-
         docstring_extractor = ReplacementDocstringExtractor()
-        docstring_extractor.visit(replacement_ast)
-
-        docstring_transformer = DocstringTransformer(
-            docstring_extractor.async_function_defs,
-            docstring_extractor.function_defs,
-            docstring_extractor.classes,
-            docstring_extractor.module_docstring,
-            self.mode,
-        )
-        modified = original_cst.visit(docstring_transformer)
-        return modified.code
+        docstring_extractor.add(replacement)
+        return self.apply_extracted(docstring_extractor)
+
+    def apply_extracted(
+        self, docstring_extractor: ReplacementDocstringExtractor
+    ) -> str:
+        """Applies docstrings that have already been extracted to the text.
+
+        Args:
+            docstring_extractor (ReplacementDocstringExtractor): Extractor that
+                has collected the replacement docstrings.
+
+        Returns:
+            str: The modified code with revised docstrings."""
+        with metrics.span("apply"):
+            if self.splice:
+                splicer = DocstringSplicer(
+                    docstring_extractor.async_function_defs,
+                    docstring_extractor.function_defs,
+                    docstring_extractor.classes,
+                    docstring_extractor.module_docstring,
+                    self.mode,
+                )
+                tree = self.parsed.tree if self.parsed else None
+                if (spliced := splicer.splice(self.text, tree)) is not None:
+                    return spliced
+
+            if self.parsed is not None:
+                original_cst = self.parsed.cst_module
+            else:
+                original_cst = cst.parse_module(self.text)
+
+            docstring_transformer = DocstringTransformer(
+                docstring_extractor.async_function_defs,
+                docstring_extractor.function_defs,
+                docstring_extractor.classes,
+                docstring_extractor.module_docstring,
+                self.mode,
+            )
+            modified = original_cst.visit(docstring_transformer)
+            return modified.code
@@ -1,78 +1,82 @@
+import collections.abc
 import pathlib
+import typing
 
 import click
-import tiktoken
 
 import assistant.cli
-import assistant.coding.model
-from assistant.coding.applier import ApplierMode
-from assistant.coding.applier import DocstringApplier
-from assistant.coding.iterator import FileIterator
-from assistant.coding.iterator import RepositoryIterator
-from assistant.coding.sanitizer import ResponseSanitizer
-from assistant.conversation.model import Conversation
-from assistant.conversation.model import Message
+from assistant import metrics
 
 
-def iterate_single_file(
-    model: str, tokenizer: tiktoken.Encoding, max_tokens: int, file_path: pathlib.Path
-) -> str:
-    """Iterates over one single file and applies docstrings to the code nodes.
+# Only the command line itself is imported up front, so that --help is quick.
+if typing.TYPE_CHECKING:
+    from assistant.coding.diff import GitDiff
+    from assistant.coding.manifest import ChangeSet
+    from assistant.coding.manifest import Manifest
+    from assistant.coding.pipeline import FileResult
+    from assistant.coding.plan import FileEstimate
+    from assistant.coding.request import ResponseFormat
+
+
+def load_diff(since: str | None, path: pathlib.Path) -> "GitDiff | None":
+    """Find the changes made since a git revision, if one was given.
 
     Args:
-        model (str): The trained model used for generating docstrings.
-        tokenizer (tiktoken.Encoding): The tokenizer used to encode code into tokens.
-        max_tokens (int): The maximum number of tokens a code can have to be processed.
-        file_path (pathlib.Path): The path of the single file to be processed.
+        since (str | None): The revision.
+        path (pathlib.Path): The file or directory being processed.
 
     Returns:
-        str: The reformatted code with added docstrings.
+        GitDiff | None: The changes, or None if no revision was given.
 
     Raises:
-        Exception: If no docstring nodes are found in the file or if the file is too large
-                   to process."""
-    file_iterator = FileIterator(file_path)
+        click.ClickException: If git can't compare against the revision."""
+    import subprocess
 
-    directives = [
-        "Add docstrings to this code, where necessary.",
-        "Use the Google docstring convention.",
-        "Elide the code itself. Only return function signatures and docstrings.",
-    ]
+    from assistant.coding.diff import GitDiff
 
-    sanitizer = ResponseSanitizer()
+    if since is None:
+        return None
+    try:
+        return GitDiff.since(since, path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        message = getattr(e, "stderr", None) or str(e)
+        raise click.ClickException(f"Could not diff against {since}: {message}")
 
-    for node in file_iterator.iterate():
-        node_text = node.code_snippet or node.combine_child_code()
 
-        if not node_text.strip():
-            continue
+def write_result(
+    result: "FileResult", inplace: bool, manifest: "Manifest | None" = None
+) -> None:
+    """Write the result of processing a file, or report its error.
 
-        message = Message(
-            "user",
-            " ".join(directives) + "\n\n✂✂✂✂✂✂✂✂✂✂✂\n\n" + node_text,
-        )
-        node_tokens = tokenizer.encode(message.content)
-
-        if len(node_tokens) < max_tokens:
-            conversation = Conversation(model, [message])
-            response = conversation.request()
-            response_text = response.choices[0].message.content
-            sanitized_text = sanitizer.sanitize(response_text)
-
-            applier = DocstringApplier(node_text, ApplierMode.KEEP)
-            reformatted_text = applier.apply(sanitized_text)
-            return reformatted_text
-        else:
-            raise Exception(
-                "Node too large to process. If necessary, we could split it up but I"
-                "haven't had a need yet. Let me know if you need this feature."
-            )
+    Args:
+        result (FileResult): The result of processing a file.
+        inplace (bool): Whether to overwrite the file rather than print it.
+        manifest (Manifest | None): Manifest in which to record files whose
+            final contents are on disk."""
+    if result.error is not None or result.text is None:
+        print(f"ERROR: {result.file_path}")
+        print(result.error)
+        return
+
+    if result.skipped:
+        # Nothing was requested, so the file on disk is already up to date.
+        pass
+    elif inplace:
+        with metrics.span("write"):
+            result.file_path.write_text(result.text)
+    else:
+        # Printed results never reach the disk, so they are not recorded.
+        print(f"FILE: {result.file_path}")
+        print(result.text)
+        return
 
-    raise Exception("No docstring nodes found in file")
+    if manifest is not None:
+        manifest.record(result.file_path, result.text)
 
 
-@click.command()
-@click.argument(
+# Arguments and options shared by add-docstrings and plan, so that a plan
+# describes the run that the same options would make.
+REPO_ROOT_ARGUMENT = click.argument(
     "repo_root",
     type=click.Path(
         exists=True,
@@ -81,6 +85,87 @@ def iterate_single_file(
         path_type=pathlib.Path,  # type: ignore
     ),
 )
+
+CONCURRENCY_OPTION = click.option(
+    "-c",
+    "--concurrency",
+    type=click.IntRange(min=1),
+    help="Maximum number of requests in flight when processing a directory.",
+    default=8,
+    show_default=True,
+)
+
+JOBS_OPTION = click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    help=(
+        "Number of processes used to parse, tokenize and apply docstrings, and "
+        "of threads finding files, when processing a directory."
+    ),
+    default=1,
+    show_default=True,
+)
+
+SINCE_OPTION = click.option(
+    "--since",
+    metavar="REF",
+    help=(
+        "Only document classes and functions changed since this git revision, "
+        "such as origin/main, including uncommitted changes and untracked files."
+    ),
+    default=None,
+)
+
+BODY_TOKENS_OPTION = click.option(
+    "--body-tokens",
+    type=click.IntRange(min=0),
+    help=(
+        "Send signature skeletons instead of full source, summarizing each "
+        "body in at most this many tokens."
+    ),
+    default=None,
+)
+
+RESPONSE_FORMAT_OPTION = click.option(
+    "--response-format",
+    type=click.Choice(["code", "json"]),
+    help=(
+        "Ask for docstrings as code with signatures, or as a compact JSON "
+        "object mapping names to docstrings."
+    ),
+    default="code",
+    show_default=True,
+)
+
+INCLUDE_OPTION = click.option(
+    "--include",
+    multiple=True,
+    help=(
+        "Only process files matching this glob, in .gitignore syntax, when "
+        "processing a directory. May be repeated."
+    ),
+)
+
+EXCLUDE_OPTION = click.option(
+    "--exclude",
+    multiple=True,
+    help=(
+        "Skip files and directories matching this glob, in .gitignore syntax, "
+        "in addition to those ignored by git. May be repeated."
+    ),
+)
+
+MAX_FILE_SIZE_OPTION = click.option(
+    "--max-file-size",
+    type=click.IntRange(min=0),
+    help="Skip files larger than this many bytes when processing a directory.",
+    default=None,
+)
+
+
+@click.command()
+@REPO_ROOT_ARGUMENT
 @click.option(
     "-i",
     "--inplace",
@@ -88,13 +173,79 @@ def iterate_single_file(
     help="Overwrite the file in-place.",
     default=False,
 )
+@CONCURRENCY_OPTION
+@JOBS_OPTION
+@click.option(
+    "--manifest",
+    "manifest_path",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),  # type: ignore
+    help=(
+        "Incremental mode: record processed files in this manifest and skip "
+        "files, classes and functions unchanged since the last run. Only files "
+        "written with --inplace are recorded."
+    ),
+    default=None,
+)
+@SINCE_OPTION
+@click.option(
+    "--pack",
+    is_flag=True,
+    help=(
+        "Pack undocumented classes and functions from several files into each "
+        "request when processing a directory. Identical classes and functions "
+        "are only requested once."
+    ),
+    default=False,
+)
+@BODY_TOKENS_OPTION
+@RESPONSE_FORMAT_OPTION
+@INCLUDE_OPTION
+@EXCLUDE_OPTION
+@MAX_FILE_SIZE_OPTION
 @click.pass_context
-def add_docstrings(ctx: click.Context, repo_root: pathlib.Path, inplace: bool) -> None:
+def add_docstrings(
+    ctx: click.Context,
+    repo_root: pathlib.Path,
+    inplace: bool,
+    concurrency: int,
+    jobs: int,
+    manifest_path: pathlib.Path | None,
+    since: str | None,
+    pack: bool,
+    body_tokens: int | None,
+    response_format: str,
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+    max_file_size: int | None,
+) -> None:
     """Add docstrings to Python modules, classes and functions.
 
     REPO_ROOT: Either a single Python file or a directory containing Python files.
+    Files and directories ignored by git are skipped.
     """
+    import functools
+
+    from assistant.coding.engine import DocstringEngine
+    from assistant.coding.engine import iterate_single_file
+    from assistant.coding.iterator import RepositoryIterator
+    from assistant.coding.manifest import Manifest
+    from assistant.coding.pipeline import FileResult
+    from assistant.coding.request import ResponseFormat
+    from assistant.coding.skeleton import SkeletonBuilder
+
     app_context: assistant.cli.AppContext = ctx.obj
+    manifest = Manifest.load(manifest_path) if manifest_path else None
+    diff = load_diff(since, repo_root)
+    # Changes since the revision take precedence over those since the manifest.
+    changes = diff if diff is not None else manifest
+    skeleton = None
+    if body_tokens is not None:
+        skeleton = SkeletonBuilder(app_context.tokenizer, body_tokens)
+    format_ = ResponseFormat[response_format.upper()]
+    scheduler, schedulers = app_context.scheduler, app_context.schedulers
+    # Every request is sent to one of these models.
+    for each in schedulers.values():
+        each.max_concurrency = concurrency
 
     if repo_root.is_file():
         reformatted_text = iterate_single_file(
@@ -102,28 +253,260 @@ def add_docstrings(ctx: click.Context, repo_root: pathlib.Path, inplace: bool) -
             app_context.tokenizer,
             app_context.max_tokens,
             repo_root,
+            app_context.cache,
+            changes,
+            skeleton,
+            format_,
+            scheduler,
+            app_context.router,
+            schedulers,
         )
-        if inplace:
-            repo_root.write_text(reformatted_text)
-        else:
-            print(f"FILE: {repo_root}")
-            print(reformatted_text)
+        write_result(FileResult(repo_root, text=reformatted_text), inplace, manifest)
 
     else:
-        file_iterator = RepositoryIterator(repo_root)
-        for file_path in file_iterator.iterate():
-            try:
-                reformatted_text = iterate_single_file(
-                    app_context.model,
-                    app_context.tokenizer,
-                    app_context.max_tokens,
-                    file_path,
-                )
-                if inplace:
-                    file_path.write_text(reformatted_text)
-                else:
-                    print(f"FILE: {file_path}")
-                    print(reformatted_text)
-            except Exception as e:
-                print(f"ERROR: {file_path}")
-                print(e)
+        engine = DocstringEngine(
+            app_context.model,
+            app_context.tokenizer,
+            app_context.max_tokens,
+            concurrency,
+            app_context.cache,
+            changes,
+            skeleton,
+            format_,
+            jobs,
+            scheduler=scheduler,
+            router=app_context.router,
+            schedulers=schedulers,
+        )
+        file_iterator = RepositoryIterator(
+            repo_root, include, exclude, max_file_size, workers=jobs
+        )
+        # With a diff, only changed files are visited, however large the
+        # repository is.
+        paths = (
+            file_iterator.iterate()
+            if diff is None
+            else file_iterator.select(diff.paths())
+        )
+        run = engine.run_packed if pack else engine.run
+        failures = app_context.run(
+            run(
+                paths,
+                functools.partial(write_result, inplace=inplace, manifest=manifest),
+            )
+        )
+        if failures:
+            click.echo(f"{len(failures)} file(s) could not be processed.", err=True)
+        if (packer := engine.packer) and packer.pieces:
+            click.echo(
+                f"Deduplicated {packer.duplicates} of {packer.pieces} piece(s) "
+                f"({packer.dedup_ratio:.0%}).",
+                err=True,
+            )
+        if len(engine.routed) > 1:
+            click.echo(f"Requests by model: {_by_model(engine.routed)}.", err=True)
+
+    if manifest is not None:
+        manifest.save()
+
+    if cache := app_context.cache:
+        click.echo(f"Cache: {cache.hits} hit(s), {cache.misses} miss(es).", err=True)
+
+    if retries := sum(s.retries for s in schedulers.values()):
+        rate_limited = sum(s.rate_limited for s in schedulers.values())
+        click.echo(
+            f"Retried {retries} request(s), {rate_limited} after being rate limited.",
+            err=True,
+        )
+
+
+@click.command()
+@REPO_ROOT_ARGUMENT
+@CONCURRENCY_OPTION
+@JOBS_OPTION
+@click.option(
+    "--manifest",
+    "manifest_path",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),  # type: ignore
+    help=(
+        "Estimate an incremental run, leaving out files, classes and functions "
+        "unchanged since they were recorded in this manifest."
+    ),
+    default=None,
+)
+@SINCE_OPTION
+@BODY_TOKENS_OPTION
+@RESPONSE_FORMAT_OPTION
+@INCLUDE_OPTION
+@EXCLUDE_OPTION
+@MAX_FILE_SIZE_OPTION
+@click.option(
+    "--generation-rate",
+    type=click.FloatRange(min=1),
+    help="Tokens the model generates per second, to project the wall time.",
+    # The planner's default, which is not imported until it is needed.
+    default=None,
+    show_default="40",
+)
+@click.pass_context
+def plan(
+    ctx: click.Context,
+    repo_root: pathlib.Path,
+    concurrency: int,
+    jobs: int,
+    manifest_path: pathlib.Path | None,
+    since: str | None,
+    body_tokens: int | None,
+    response_format: str,
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+    max_file_size: int | None,
+    generation_rate: float | None,
+) -> None:
+    """Estimate the requests and tokens of add-docstrings, without calling the API.
+
+    Files are parsed and tokenized as add-docstrings would, and the requests,
+    prompt tokens and estimated completion tokens of each are listed, along
+    with the files that would fail. The wall time is projected from the
+    concurrency, and from any rate limits given to assistant.
+    """
+    from assistant.coding.iterator import RepositoryIterator
+    from assistant.coding.manifest import Manifest
+    from assistant.coding.plan import DEFAULT_GENERATION_RATE
+    from assistant.coding.plan import Plan
+    from assistant.coding.request import ResponseFormat
+
+    app_context: assistant.cli.AppContext = ctx.obj
+    manifest = Manifest.load(manifest_path) if manifest_path else None
+    diff = load_diff(since, repo_root)
+    changes = diff if diff is not None else manifest
+
+    paths: collections.abc.Iterable[pathlib.Path] = [repo_root]
+    if repo_root.is_dir():
+        file_iterator = RepositoryIterator(
+            repo_root, include, exclude, max_file_size, workers=jobs
+        )
+        paths = (
+            file_iterator.iterate()
+            if diff is None
+            else file_iterator.select(diff.paths())
+        )
+
+    totals = Plan()
+    click.echo(f"{'requests':>8} {'prompt':>9} {'completion':>10}  file")
+    estimates = _estimates(
+        paths,
+        app_context,
+        changes,
+        body_tokens,
+        ResponseFormat[response_format.upper()],
+        jobs,
+    )
+    for estimate in estimates:
+        totals.add(estimate)
+        if estimate.error is not None:
+            click.echo(f"{'-':>8} {'-':>9} {'-':>10}  {estimate.file_path}")
+        elif estimate.requests:
+            click.echo(
+                f"{estimate.requests:>8} {estimate.prompt_tokens:>9} "
+                f"{estimate.completion_tokens:>10}  {estimate.file_path}"
+            )
+
+    scheduler = app_context.scheduler
+    requests, tokens = (
+        (scheduler.requests, scheduler.tokens) if scheduler else (None, None)
+    )
+    wall_time = totals.wall_time(
+        concurrency,
+        requests.per_minute if requests else None,
+        tokens.per_minute if tokens else None,
+        generation_rate or DEFAULT_GENERATION_RATE,
+    )
+
+    click.echo(
+        f"\nFiles: {totals.files}, of which {totals.unchanged} have nothing to "
+        f"request and {len(totals.failures)} would fail.\n"
+        f"Requests: {totals.requests}\n"
+        f"Prompt tokens: {totals.prompt_tokens}\n"
+        f"Completion tokens (estimated): {totals.completion_tokens}\n"
+        f"Projected wall time: {_duration(wall_time)}, with {concurrency} "
+        "request(s) in flight."
+    )
+    if len(totals.models) > 1:
+        click.echo(f"Requests by model: {_by_model(totals.models)}.")
+    for failure in totals.failures:
+        click.echo(f"Would fail: {failure.file_path}: {failure.error}")
+
+
+def _estimates(
+    paths: collections.abc.Iterable[pathlib.Path],
+    app_context: assistant.cli.AppContext,
+    changes: "ChangeSet | None",
+    body_tokens: int | None,
+    response_format: "ResponseFormat",
+    jobs: int,
+) -> "collections.abc.Iterator[FileEstimate]":
+    """Estimate each file, in a pool of processes if more than one job is asked for.
+
+    Args:
+        paths (Iterable[pathlib.Path]): The files to estimate.
+        app_context (AppContext): The model and its tokenizer.
+        changes (ChangeSet | None): The code that changed, if only it would be
+            requested.
+        body_tokens (int | None): If given, code would be sent as skeletons
+            with bodies summarized in at most this many tokens.
+        response_format (ResponseFormat): The format the model would be asked
+            to respond in.
+        jobs (int): The number of processes.
+
+    Yields:
+        FileEstimate: The estimate of each file, in order."""
+    from assistant.coding.plan import FileEstimate
+    from assistant.coding.skeleton import SkeletonBuilder
+    from assistant.coding.workers import PrepareItem
+    from assistant.coding.workers import WorkerPool
+
+    tokenizer, max_tokens = app_context.tokenizer, app_context.max_tokens
+    if jobs == 1:
+        skeleton = None
+        if body_tokens is not None:
+            skeleton = SkeletonBuilder(tokenizer, body_tokens)
+        for path in paths:
+            yield FileEstimate.from_file(
+                path,
+                tokenizer,
+                max_tokens,
+                changes,
+                skeleton,
+                response_format,
+                app_context.router,
+            )
+        return
+
+    items = (
+        PrepareItem(
+            file_path=path,
+            budget=max_tokens,
+            changes=changes.subset(path) if changes else None,
+            body_tokens=body_tokens,
+            response_format=response_format,
+            router=app_context.router,
+        )
+        for path in paths
+    )
+    with WorkerPool(jobs, tokenizer) as pool:
+        yield from pool.estimate(items)
+
+
+def _by_model(requests: collections.Counter[str]) -> str:
+    return ", ".join(f"{model} {count}" for model, count in requests.most_common())
+
+
+def _duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02}m"
+    if minutes:
+        return f"{minutes}m{seconds:02}s"
+    return f"{seconds}s"
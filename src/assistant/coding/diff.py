@@ -0,0 +1,269 @@
+"""Selects the code changed since a git revision, for runs scoped to a diff."""
+import bisect
+import dataclasses
+import pathlib
+import re
+import subprocess
+
+from assistant.coding.model import DocstringNode
+
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+# Escapes in the file names that git quotes, such as names with a double quote.
+QUOTED_ESCAPE = re.compile(r"\\([0-7]{3}|.)")
+QUOTED_CHARACTERS = {
+    "a": b"\a",
+    "b": b"\b",
+    "t": b"\t",
+    "n": b"\n",
+    "v": b"\v",
+    "f": b"\f",
+    "r": b"\r",
+}
+
+# Changed lines of a file, as sorted and disjoint ranges of line numbers,
+# inclusive of the start and exclusive of the end. None if the whole file is new.
+LineRanges = list[tuple[int, int]] | None
+
+
+def parse_diff(diff: str, top: pathlib.Path) -> dict[pathlib.Path, LineRanges]:
+    """Read the changed lines of each file from a unified diff.
+
+    Lines are numbered as in the new version of each file. A hunk that only
+    deletes lines marks the lines either side of the deletion as changed, so
+    that the definition the lines were deleted from counts as changed.
+
+    Args:
+        diff (str): Output of `git diff`, with no context lines.
+        top (pathlib.Path): The directory that paths in the diff are relative
+            to.
+
+    Returns:
+        dict[pathlib.Path, LineRanges]: The changed lines of each file that
+        still exists, keyed by its absolute path."""
+    files: dict[pathlib.Path, LineRanges] = {}
+    ranges: list[tuple[int, int]] | None = None
+    for line in diff.splitlines():
+        if line.startswith("+++ "):
+            # Git ends the name with a tab if it contains a space.
+            name = _unquoted(line[4:].removesuffix("\t"))
+            ranges = None
+            if name != "/dev/null":
+                ranges = files.setdefault(top / name.removeprefix("b/"), [])
+        elif ranges is not None and (match := HUNK_HEADER.match(line)):
+            start = int(match[1])
+            count = 1 if match[2] is None else int(match[2])
+            # An empty hunk starts at the line before the deletion.
+            ranges.append((start, start + count) if count else (start, start + 2))
+    return {path: _merged(lines) for path, lines in files.items()}
+
+
+def _unquoted(name: str) -> str:
+    """Undo the quoting of a file name in a diff.
+
+    Args:
+        name (str): The name, which git quotes like a C string if it contains
+            unusual characters.
+
+    Returns:
+        str: The name of the file."""
+    if not (len(name) > 1 and name.startswith('"') and name.endswith('"')):
+        return name
+
+    body = name[1:-1]
+    raw = bytearray()
+    end = 0
+    for match in QUOTED_ESCAPE.finditer(body):
+        raw += body[end : match.start()].encode()
+        code = match[1]
+        if len(code) == 3:
+            raw.append(int(code, 8))
+        else:
+            raw += QUOTED_CHARACTERS.get(code, code.encode())
+        end = match.end()
+    raw += body[end:].encode()
+    return raw.decode(errors="surrogateescape")
+
+
+def _merged(ranges: LineRanges) -> LineRanges:
+    """Sort ranges of lines, merging those that overlap.
+
+    Args:
+        ranges (LineRanges): The ranges.
+
+    Returns:
+        LineRanges: Sorted and disjoint ranges."""
+    if ranges is None:
+        return None
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+@dataclasses.dataclass
+class GitDiff:
+    """The code changed since a revision, and files that git doesn't track.
+
+    Classes and functions whose lines, including decorators, overlap a change
+    are selected. Within them, nested definitions that were not changed are
+    only sent as context, reduced to their signatures.
+
+    Attributes:
+        files (dict[pathlib.Path, LineRanges]): The changed lines of each
+            file, keyed by its absolute path."""
+
+    files: dict[pathlib.Path, LineRanges] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def since(cls, revision: str, path: pathlib.Path) -> "GitDiff":
+        """Find the changes made since a revision.
+
+        Changes are compared to the last common ancestor of the revision and
+        `HEAD`, so that changes made to the revision since a branch was
+        started are not included. Uncommitted changes and untracked files are.
+
+        Args:
+            revision (str): The revision, such as `origin/main`.
+            path (pathlib.Path): The file or directory in which to look for
+                changes.
+
+        Returns:
+            GitDiff: The changes.
+
+        Raises:
+            subprocess.CalledProcessError: If git fails, for example because
+                the revision doesn't exist."""
+        directory = path if path.is_dir() else path.parent
+        top = pathlib.Path(_git(directory, "rev-parse", "--show-toplevel").strip())
+        base = _git(directory, "merge-base", revision, "HEAD").strip()
+
+        diff = _git(
+            directory,
+            "-c",
+            "core.quotePath=off",
+            "diff",
+            "--unified=0",
+            "--no-color",
+            "--no-ext-diff",
+            "--src-prefix=a/",
+            "--dst-prefix=b/",
+            base,
+            "--",
+            str(path.resolve()),
+        )
+        files = parse_diff(diff, top)
+
+        untracked = _git(
+            directory,
+            "ls-files",
+            "-z",
+            "--others",
+            "--exclude-standard",
+            "--full-name",
+            "--",
+            str(path.resolve()),
+        )
+        files.update((top / name, None) for name in untracked.split("\0") if name)
+        return cls(files)
+
+    def paths(self) -> list[pathlib.Path]:
+        """The changed Python files that exist, in sorted order."""
+        return sorted(p for p in self.files if p.suffix == ".py" and p.is_file())
+
+    def subset(self, file_path: pathlib.Path) -> "GitDiff":
+        """Copy the changes, keeping only those of a single file.
+
+        Args:
+            file_path (pathlib.Path): The file to keep.
+
+        Returns:
+            GitDiff: The changes of the file."""
+        key = file_path.resolve()
+        return GitDiff({key: self.files[key]} if key in self.files else {})
+
+    def is_unchanged(self, file_path: pathlib.Path, text: str) -> bool:
+        """Check whether a file has no changes.
+
+        Args:
+            file_path (pathlib.Path): The file to check.
+            text (str): The current contents of the file.
+
+        Returns:
+            bool: True if the file has not changed since the revision."""
+        return file_path.resolve() not in self.files
+
+    def changed_nodes(
+        self, file_path: pathlib.Path, module: DocstringNode
+    ) -> list[DocstringNode]:
+        """Select the top-level classes and functions that overlap a change.
+
+        Args:
+            file_path (pathlib.Path): The file containing the module.
+            module (DocstringNode): The module node of the file.
+
+        Returns:
+            list[DocstringNode]: The changed children of the module. Their
+            unchanged descendants are copied and marked as context."""
+        key = file_path.resolve()
+        if key not in self.files:
+            return []
+        if (ranges := self.files[key]) is None:
+            return list(module.children)
+
+        return [
+            _scoped(child, ranges)
+            for child in module.children
+            if _overlaps(child, ranges)
+        ]
+
+
+def _scoped(node: DocstringNode, ranges: list[tuple[int, int]]) -> DocstringNode:
+    """Copy a changed node, marking its unchanged descendants as context.
+
+    Args:
+        node (DocstringNode): A class or function that overlaps a change.
+        ranges (list[tuple[int, int]]): The changed lines of the file.
+
+    Returns:
+        DocstringNode: The copy."""
+    children = [
+        _scoped(child, ranges)
+        if _overlaps(child, ranges)
+        else dataclasses.replace(child, context=True)
+        for child in node.children
+    ]
+    return dataclasses.replace(node, children=children)
+
+
+def _overlaps(node: DocstringNode, ranges: list[tuple[int, int]]) -> bool:
+    """Check whether the lines of a node overlap any changed lines.
+
+    Args:
+        node (DocstringNode): A class or function.
+        ranges (list[tuple[int, int]]): The changed lines of the file.
+
+    Returns:
+        bool: True if any line of the node or its decorators changed."""
+    # The last range starting at or before the node's last line.
+    i = bisect.bisect_right(ranges, node.end_lineno, key=lambda r: r[0]) - 1
+    return i >= 0 and ranges[i][1] > node.first_lineno
+
+
+def _git(directory: pathlib.Path, *args: str) -> str:
+    """Run a git command.
+
+    Args:
+        directory (pathlib.Path): The directory in which to run it.
+        *args (str): The arguments of the command.
+
+    Returns:
+        str: The output of the command."""
+    result = subprocess.run(
+        ["git", *args], cwd=directory, capture_output=True, text=True, check=True
+    )
+    return result.stdout
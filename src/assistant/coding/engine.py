@@ -0,0 +1,630 @@
+"""Requests docstrings for a single file, or for many files at once."""
+import asyncio
+import collections
+import collections.abc
+import contextlib
+import functools
+import pathlib
+import typing
+
+import tiktoken
+
+from assistant.coding.manifest import ChangeSet
+from assistant.coding.packer import Batch
+from assistant.coding.packer import PackedFile
+from assistant.coding.packer import RequestPacker
+from assistant.coding.pipeline import DEFAULT_QUEUE_SIZE
+from assistant.coding.pipeline import FileResult
+from assistant.coding.pipeline import Job
+from assistant.coding.pipeline import Pipeline
+from assistant.coding.pipeline import Stage
+from assistant.coding.pipeline import iterate_in_thread
+from assistant.coding.request import DocstringRequest
+from assistant.coding.request import ResponseFormat
+from assistant.coding.request import apply_docstrings
+from assistant.coding.request import count_tokens
+from assistant.coding.skeleton import SkeletonBuilder
+from assistant.coding.workers import PrepareItem
+from assistant.coding.workers import WorkerPool
+from assistant.conversation.cache import ResponseCache
+from assistant.conversation.model import Conversation
+from assistant.conversation.model import Message
+from assistant.conversation.model import shared_session
+from assistant.conversation.scheduler import RequestScheduler
+from assistant.model import RESPONSE_TOKEN_FRACTION
+from assistant.model import Router
+
+
+def iterate_single_file(
+    model: str,
+    tokenizer: tiktoken.Encoding,
+    max_tokens: int,
+    file_path: pathlib.Path,
+    cache: ResponseCache | None = None,
+    changes: ChangeSet | None = None,
+    skeleton: SkeletonBuilder | None = None,
+    response_format: ResponseFormat = ResponseFormat.CODE,
+    scheduler: RequestScheduler | None = None,
+    router: Router | None = None,
+    schedulers: collections.abc.Mapping[str, RequestScheduler] | None = None,
+) -> str:
+    """Iterates over one single file and applies docstrings to the code nodes.
+
+    Args:
+        model (str): The trained model used for generating docstrings.
+        tokenizer (tiktoken.Encoding): The tokenizer used to encode code into tokens.
+        max_tokens (int): The maximum number of tokens a code can have to be processed.
+        file_path (pathlib.Path): The path of the single file to be processed.
+        cache (ResponseCache | None): Cache of previous responses, if any.
+        changes (ChangeSet | None): The code that changed, since a previous
+            run or a git revision, if only it is requested.
+        skeleton (SkeletonBuilder | None): If given, code is sent as skeletons
+            rather than as its full source.
+        response_format (ResponseFormat): The format the model is asked to
+            respond in.
+        scheduler (RequestScheduler | None): Paces and retries requests to stay
+            within rate limits, if given.
+        router (Router | None): Chooses the model of each request by its size,
+            if given, instead of using `model`.
+        schedulers (Mapping[str, RequestScheduler] | None): The scheduler of
+            each model requests are routed to. Other models use `scheduler`.
+
+    Returns:
+        str: The reformatted code with added docstrings.
+
+    Raises:
+        Exception: If no docstring nodes are found in the file or if a single
+                   function is too large to process."""
+    request = DocstringRequest.from_file(
+        file_path, tokenizer, max_tokens, changes, skeleton, response_format, router
+    )
+    contents = []
+    for chunk in request.chunks:
+        if router is not None:
+            model = router.route(chunk.tokens).name
+        conversation = Conversation(
+            model,
+            [chunk.message],
+            cache=cache,
+            scheduler=(schedulers or {}).get(model, scheduler),
+        )
+        response = conversation.request(chunk.tokens)
+        contents.append(response.choices[0].message.content)
+
+    return request.apply_responses(contents)
+
+
+class DocstringEngine:
+    """Requests docstrings for many files, keeping several requests in flight.
+
+    Files are finished as soon as their responses arrive, so results are not
+    necessarily reported in the order the files were supplied.
+
+    Attributes:
+        model (str): The model used to generate docstrings.
+        tokenizer (tiktoken.Encoding): The tokenizer used to count prompt tokens.
+        max_tokens (int): The maximum number of tokens a prompt may use.
+        concurrency (int): The maximum number of files being processed, and of
+            requests in flight, at once.
+        cache (ResponseCache | None): Cache of previous responses, if any.
+        scheduler (RequestScheduler | None): Paces and retries requests to stay
+            within rate limits, if given.
+        changes (ChangeSet | None): The code that changed, since a previous
+            run or a git revision, if only it is requested.
+        skeleton (SkeletonBuilder | None): If given, code is sent as skeletons
+            rather than as its full source.
+        response_format (ResponseFormat): The format the model is asked to
+            respond in.
+        jobs (int): The number of processes used to parse, tokenize and apply
+            docstrings. If 1, this is done in the current process.
+        queue_size (int): The maximum number of files waiting between stages.
+        packer (RequestPacker | None): The packer of the last packed run, which
+            counts the pieces that were deduplicated.
+        router (Router | None): Chooses the model of each request by its size,
+            if given. Otherwise every request is sent to `model`.
+        routed (collections.Counter[str]): The number of requests sent to each
+            model.
+        schedulers (Mapping[str, RequestScheduler]): The scheduler of each
+            model requests are routed to. Other models use `scheduler`.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        tokenizer: tiktoken.Encoding,
+        max_tokens: int,
+        concurrency: int,
+        cache: ResponseCache | None = None,
+        changes: ChangeSet | None = None,
+        skeleton: SkeletonBuilder | None = None,
+        response_format: ResponseFormat = ResponseFormat.CODE,
+        jobs: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        scheduler: RequestScheduler | None = None,
+        router: Router | None = None,
+        schedulers: collections.abc.Mapping[str, RequestScheduler] | None = None,
+    ):
+        """Initialize the engine.
+
+        Args:
+            model (str): The model used to generate docstrings.
+            tokenizer (tiktoken.Encoding): The tokenizer used to count prompt tokens.
+            max_tokens (int): The maximum number of tokens a prompt may use.
+            concurrency (int): The maximum number of requests in flight at once.
+            cache (ResponseCache | None): Cache of previous responses, if any.
+            changes (ChangeSet | None): The code that changed, if only it is
+                requested.
+            skeleton (SkeletonBuilder | None): If given, code is sent as
+                skeletons rather than as its full source.
+            response_format (ResponseFormat): The format the model is asked
+                to respond in.
+            jobs (int): The number of processes used to parse, tokenize and
+                apply docstrings.
+            queue_size (int): The maximum number of files waiting between
+                stages.
+            scheduler (RequestScheduler | None): Paces and retries requests to
+                stay within rate limits.
+            router (Router | None): Chooses the model of each request by its
+                size. `max_tokens` should be the largest context window it
+                routes to.
+            schedulers (Mapping[str, RequestScheduler] | None): The scheduler
+                of each model requests are routed to, so that each model is
+                paced to its own limits.
+
+        Raises:
+            ValueError: If `concurrency` or `jobs` is less than one."""
+        if concurrency < 1:
+            raise ValueError(f"Concurrency must be at least 1, got {concurrency}")
+        if jobs < 1:
+            raise ValueError(f"Jobs must be at least 1, got {jobs}")
+
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.concurrency = concurrency
+        self.cache = cache
+        self.changes = changes
+        self.skeleton = skeleton
+        self.response_format = response_format
+        self.jobs = jobs
+        self.queue_size = queue_size
+        self.scheduler = scheduler
+        self.packer: RequestPacker | None = None
+        self.router = router
+        self.routed: collections.Counter[str] = collections.Counter()
+        self.schedulers = schedulers or {}
+        self._requests = asyncio.Semaphore(concurrency)
+
+    async def _prepare(self, job: Job, pool: WorkerPool | None) -> None:
+        """Parse a file and build its prompts.
+
+        Args:
+            job (Job): The file to prepare.
+            pool (WorkerPool | None): If given, the file is prepared in this
+                pool."""
+        if pool is None:
+            request = DocstringRequest.from_file(
+                job.file_path,
+                self.tokenizer,
+                self.max_tokens,
+                self.changes,
+                self.skeleton,
+                self.response_format,
+                self.router,
+            )
+        else:
+            item = self._work_item(job.file_path, self.max_tokens)
+            request = await pool.prepare_request(item)
+
+        if not request.chunks:
+            job.result = FileResult(job.file_path, text=request.source, skipped=True)
+        job.request = request
+
+    async def _request(self, job: Job) -> None:
+        """Request docstrings for every chunk of a file.
+
+        Args:
+            job (Job): The prepared file."""
+        assert job.request is not None
+        job.contents = await asyncio.gather(
+            *(
+                self._complete(chunk.message, chunk.tokens)
+                for chunk in job.request.chunks
+            )
+        )
+
+    async def _sanitize(self, job: Job) -> None:
+        """Extract the docstrings from the responses for a file.
+
+        Args:
+            job (Job): The file with its responses."""
+        assert job.request is not None and job.contents is not None
+        job.replacements = job.request.replacements(job.contents)
+        job.contents = None
+
+    async def _apply(self, job: Job, pool: WorkerPool | None) -> None:
+        """Apply the docstrings to a file.
+
+        Args:
+            job (Job): The file with its parsed responses.
+            pool (WorkerPool | None): If given, docstrings are applied in this
+                pool."""
+        assert job.request is not None and job.replacements is not None
+        request, replacements = job.request, job.replacements
+        # Release the syntax tree as soon as it is no longer needed.
+        job.request = job.replacements = None
+
+        if pool is None:
+            text = apply_docstrings(
+                request.source, replacements, request.parsed, request.targets
+            )
+        else:
+            text = await pool.apply(request.source, replacements, request.targets)
+        job.result = FileResult(job.file_path, text=text)
+
+    def _work_item(
+        self, file_path: pathlib.Path, budget: int, max_budget: int | None = None
+    ) -> PrepareItem:
+        """Describe the preparation of a file for a worker process.
+
+        Args:
+            file_path (pathlib.Path): The file to prepare.
+            budget (int): The token budget of its prompts or pieces.
+            max_budget (int | None): The token budget of pieces that can't be
+                split, if larger.
+
+        Returns:
+            PrepareItem: The work item."""
+        return PrepareItem(
+            file_path=file_path,
+            budget=budget,
+            changes=self.changes.subset(file_path) if self.changes else None,
+            body_tokens=self.skeleton.body_tokens if self.skeleton else None,
+            response_format=self.response_format,
+            router=self.router,
+            max_budget=max_budget,
+        )
+
+    def _pool(self) -> contextlib.AbstractContextManager[WorkerPool | None]:
+        """Start a pool of worker processes, if more than one job was asked for.
+
+        Returns:
+            AbstractContextManager[WorkerPool | None]: Context manager giving
+            the pool, or None if work should be done in this process."""
+        if self.jobs == 1:
+            return contextlib.nullcontext()
+        return WorkerPool(self.jobs, self.tokenizer)
+
+    @contextlib.asynccontextmanager
+    async def _resources(self) -> collections.abc.AsyncIterator[WorkerPool | None]:
+        """Open a shared HTTP session and the worker pool for a run.
+
+        Yields:
+            WorkerPool | None: The pool, or None if work should be done in this
+            process."""
+        async with shared_session():
+            with self._pool() as pool:
+                yield pool
+
+    async def _complete(self, message: Message, tokens: int | None = None) -> str:
+        """Send a single prompt to the model, waiting for a free request slot.
+
+        Args:
+            message (Message): The prompt.
+            tokens (int | None): The number of tokens in the prompt, if they
+                were already counted. Otherwise they are counted to route it,
+                or estimated by the scheduler.
+
+        Returns:
+            str: The content of the model's response."""
+        model = self.model
+        if self.router is not None:
+            if tokens is None:
+                tokens = count_tokens(self.tokenizer, message.content)
+            model = self.router.route(tokens).name
+        self.routed[model] += 1
+
+        async with self._requests:
+            conversation = Conversation(
+                model,
+                [message],
+                cache=self.cache,
+                scheduler=self.schedulers.get(model, self.scheduler),
+            )
+            response = await conversation.arequest(tokens)
+        return typing.cast(str, response.choices[0].message.content)
+
+    async def run(
+        self,
+        file_paths: collections.abc.Iterable[pathlib.Path],
+        on_result: collections.abc.Callable[[FileResult], None],
+    ) -> list[FileResult]:
+        """Add docstrings to every file, reporting each result as it arrives.
+
+        Files flow through a pipeline of stages: preparing prompts, requesting
+        docstrings, sanitizing the responses and applying them. Preparing and
+        applying use `jobs` workers, and requesting uses `concurrency`. Paths
+        are consumed lazily, and the queues between stages are bounded, so
+        memory use does not grow with the number of files.
+
+        Args:
+            file_paths (Iterable[pathlib.Path]): The files to process.
+            on_result (Callable[[FileResult], None]): Called with the result of
+                each file as soon as it is finished.
+
+        Returns:
+            list[FileResult]: The results of the files that failed."""
+        failures: list[FileResult] = []
+
+        def report(result: FileResult) -> None:
+            if result.error is not None:
+                failures.append(result)
+            on_result(result)
+
+        async with self._resources() as pool:
+            pipeline = Pipeline(
+                [
+                    Stage(
+                        "prepare",
+                        functools.partial(self._prepare, pool=pool),
+                        self.jobs,
+                    ),
+                    Stage("request", self._request, self.concurrency),
+                    Stage("sanitize", self._sanitize),
+                    Stage(
+                        "apply", functools.partial(self._apply, pool=pool), self.jobs
+                    ),
+                ],
+                self.queue_size,
+            )
+            await pipeline.run((Job(path) for path in file_paths), report)
+
+        return failures
+
+    async def run_packed(
+        self,
+        file_paths: collections.abc.Iterable[pathlib.Path],
+        on_result: collections.abc.Callable[[FileResult], None],
+    ) -> list[FileResult]:
+        """Add docstrings to every file, packing many files into each request.
+
+        Undocumented classes and functions from all files are bin-packed into
+        requests close to the token budget. Identical pieces are requested
+        once, and the response is applied to every copy. A file is finished
+        once every request containing one of its pieces has been answered.
+
+        Args:
+            file_paths (Iterable[pathlib.Path]): The files to process.
+            on_result (Callable[[FileResult], None]): Called with the result of
+                each file as soon as it is finished.
+
+        Returns:
+            list[FileResult]: The results of the files that failed."""
+        failures: list[FileResult] = []
+        pending: set[asyncio.Task[tuple[Batch, str | Exception]]] = set()
+
+        def report(result: FileResult) -> None:
+            if result.error is not None:
+                failures.append(result)
+            on_result(result)
+
+        budget = int(self.max_tokens * (1 - RESPONSE_TOKEN_FRACTION))
+        # Batches are filled to the budget of the preferred model. A piece too
+        # large for it is sent on its own, to be routed to a larger model.
+        pack_budget = self.router.models[0].prompt_budget if self.router else budget
+        preamble_tokens = count_tokens(
+            self.tokenizer, Batch(response_format=self.response_format).message.content
+        )
+        packer = RequestPacker(
+            self.tokenizer,
+            min(pack_budget, budget) - preamble_tokens,
+            response_format=self.response_format,
+            max_budget=budget - preamble_tokens,
+        )
+        self.packer = packer
+
+        def send(batches: list[Batch]) -> None:
+            pending.update(asyncio.create_task(self._send(b)) for b in batches)
+
+        async with self._resources() as pool:
+            # Files are prepared ahead in the pool, but packed in file order so
+            # that batches, and their cache keys, don't depend on timing.
+            preparing: collections.deque[asyncio.Task[PackedFile | FileResult]]
+            preparing = collections.deque()
+            window = 2 * pool.jobs if pool else 1
+
+            async for file_path in iterate_in_thread(file_paths):
+                task = self._prepare_packed(file_path, packer, pool)
+                preparing.append(asyncio.create_task(task))
+                if len(preparing) >= window:
+                    prepared = await preparing.popleft()
+                    send(await self._pack(prepared, packer, pool, report))
+                    pending = await self._drain(pending, self.concurrency, pool, report)
+
+            while preparing:
+                prepared = await preparing.popleft()
+                send(await self._pack(prepared, packer, pool, report))
+
+            send(packer.flush())
+            await self._drain(pending, 1, pool, report)
+
+        return failures
+
+    async def _drain(
+        self,
+        pending: set[asyncio.Task[tuple[Batch, str | Exception]]],
+        limit: int,
+        pool: WorkerPool | None,
+        report: collections.abc.Callable[[FileResult], None],
+    ) -> set[asyncio.Task[tuple[Batch, str | Exception]]]:
+        """Finish batches until fewer than `limit` are in flight.
+
+        Args:
+            pending (set[asyncio.Task[tuple[Batch, str | Exception]]]): The
+                batches in flight.
+            limit (int): The number of batches that may remain in flight.
+            pool (WorkerPool | None): If given, docstrings are applied in this
+                pool.
+            report (Callable[[FileResult], None]): Called with each file that
+                is finished or failed.
+
+        Returns:
+            set[asyncio.Task[tuple[Batch, str | Exception]]]: The batches still
+            in flight."""
+        while len(pending) >= limit and pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                for packed_file in self._finish_batch(*task.result(), report):
+                    report(await self._apply_packed(packed_file, pool))
+        return pending
+
+    async def _prepare_packed(
+        self, file_path: pathlib.Path, packer: RequestPacker, pool: WorkerPool | None
+    ) -> PackedFile | FileResult:
+        """Collect the undocumented pieces of a file.
+
+        Args:
+            file_path (pathlib.Path): The file to prepare.
+            packer (RequestPacker): The packer, which sets the budget of each
+                piece of code.
+            pool (WorkerPool | None): If given, the file is prepared in this
+                pool.
+
+        Returns:
+            PackedFile | FileResult: The file and its pieces, or the result of
+            a file that failed or has nothing to request."""
+        try:
+            if pool is None:
+                packed_file = PackedFile.from_file(
+                    file_path,
+                    self.tokenizer,
+                    packer.piece_budget,
+                    self.changes,
+                    self.skeleton,
+                    packer.max_piece_budget,
+                )
+            else:
+                item = self._work_item(
+                    file_path, packer.piece_budget, packer.max_piece_budget
+                )
+                packed_file = await pool.prepare_packed(item)
+        except Exception as e:
+            return FileResult(file_path=file_path, error=e)
+
+        if not packed_file.pieces:
+            return FileResult(
+                file_path=file_path, text=packed_file.source, skipped=True
+            )
+        return packed_file
+
+    async def _pack(
+        self,
+        prepared: PackedFile | FileResult,
+        packer: RequestPacker,
+        pool: WorkerPool | None,
+        report: collections.abc.Callable[[FileResult], None],
+    ) -> list[Batch]:
+        """Add the pieces of a prepared file to the packer.
+
+        Args:
+            prepared (PackedFile | FileResult): The prepared file, or its
+                result if there is nothing to pack.
+            packer (RequestPacker): The packer collecting pieces.
+            pool (WorkerPool | None): If given, docstrings are applied in this
+                pool.
+            report (Callable[[FileResult], None]): Called if there is nothing to
+                pack, or if every piece was already answered for a copy.
+
+        Returns:
+            list[Batch]: Batches that are ready to be sent."""
+        if isinstance(prepared, FileResult):
+            report(prepared)
+            return []
+
+        closed = packer.add(prepared)
+        if prepared.outstanding == 0:
+            report(await self._apply_packed(prepared, pool))
+        return closed
+
+    @staticmethod
+    async def _apply_packed(
+        packed_file: PackedFile, pool: WorkerPool | None
+    ) -> FileResult:
+        """Apply every docstring returned for a file.
+
+        Args:
+            packed_file (PackedFile): A file that has received every response.
+            pool (WorkerPool | None): If given, docstrings are applied in this
+                pool.
+
+        Returns:
+            FileResult: The reformatted code, or the error that prevented it
+            from being produced."""
+        try:
+            if pool is None:
+                text = packed_file.apply()
+            else:
+                text = await pool.apply(
+                    packed_file.source, packed_file.replacements, packed_file.targets
+                )
+        except Exception as e:
+            packed_file.error = e
+            return FileResult(file_path=packed_file.file_path, error=e)
+        return FileResult(file_path=packed_file.file_path, text=text)
+
+    async def _send(self, batch: Batch) -> tuple[Batch, str | Exception]:
+        """Request docstrings for a batch, capturing any error.
+
+        Args:
+            batch (Batch): The batch to send.
+
+        Returns:
+            tuple[Batch, str | Exception]: The batch, and either the content of
+            the response or the error raised while requesting it."""
+        try:
+            return batch, await self._complete(batch.message)
+        except Exception as e:
+            return batch, e
+
+    @staticmethod
+    def _finish_batch(
+        batch: Batch,
+        content: str | Exception,
+        report: collections.abc.Callable[[FileResult], None],
+    ) -> list[PackedFile]:
+        """Route the response to a batch, and report any files that failed.
+
+        Files spread over several batches are only reported once, even if more
+        than one of their batches fails.
+
+        Args:
+            batch (Batch): The batch that was answered.
+            content (str | Exception): The response, or the error that
+                prevented it from being received.
+            report (Callable[[FileResult], None]): Called with each file that
+                failed.
+
+        Returns:
+            list[PackedFile]: Files that have now received every response, and
+            are ready to have their docstrings applied."""
+        finished: list[PackedFile] = []
+
+        if isinstance(content, Exception):
+            batch.error = content
+        else:
+            try:
+                finished = batch.route(content)
+            except Exception as e:
+                batch.error = e
+
+        if (error := batch.error) is not None:
+            for packed_file in batch.files:
+                if packed_file.error is None:
+                    packed_file.error = error
+                    report(FileResult(file_path=packed_file.file_path, error=error))
+            # Copies still to come are packed again, rather than failing too.
+            batch.items, batch.copies = [], []
+
+        return [f for f in finished if f.error is None]
@@ -0,0 +1,167 @@
+"""Matches paths against `.gitignore` files and gitignore-style glob patterns."""
+import dataclasses
+import pathlib
+import re
+
+
+@dataclasses.dataclass(frozen=True)
+class GlobPattern:
+    """A single pattern, with the syntax of a line of a `.gitignore` file.
+
+    A pattern without a slash matches a file or directory of that name at any
+    depth. Otherwise it is matched against the whole path, relative to the
+    directory the pattern belongs to. `*` and `?` don't match slashes, while
+    `**` matches any number of directories.
+
+    Attributes:
+        regex (re.Pattern[str]): The compiled pattern.
+        negated (bool): True if the pattern started with `!`, re-including
+            paths excluded by earlier patterns.
+        directory_only (bool): True if the pattern ended with a slash, and so
+            only matches directories.
+        anchored (bool): True if the pattern is matched against the whole path
+            rather than just its last component."""
+
+    regex: re.Pattern[str]
+    negated: bool = False
+    directory_only: bool = False
+    anchored: bool = False
+
+    @classmethod
+    def parse(cls, line: str) -> "GlobPattern | None":
+        """Parse a pattern.
+
+        Args:
+            line (str): The pattern, or a line of a `.gitignore` file.
+
+        Returns:
+            GlobPattern | None: The pattern, or None for blank lines and
+            comments."""
+        if line.endswith(" ") and not line.endswith("\\ "):
+            line = line.rstrip(" ")
+        if not line or line.startswith("#"):
+            return None
+
+        negated = line.startswith("!")
+        if negated or line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if not line:
+            return None
+
+        return cls(
+            regex=re.compile(_translate(line)),
+            negated=negated,
+            directory_only=directory_only,
+            anchored=anchored,
+        )
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        """Check whether the pattern matches a path.
+
+        Args:
+            path (str): The path, relative to the directory the pattern
+                belongs to, with forward slashes.
+            is_dir (bool): Whether the path is a directory.
+
+        Returns:
+            bool: True if the pattern matches, regardless of negation."""
+        if self.directory_only and not is_dir:
+            return False
+        if not self.anchored:
+            path = path.rpartition("/")[2]
+        return self.regex.fullmatch(path) is not None
+
+
+class GitIgnore:
+    """The patterns of one `.gitignore` file.
+
+    Attributes:
+        patterns (list[GlobPattern]): The patterns, in order."""
+
+    def __init__(self, patterns: list[GlobPattern]):
+        """Initialize from patterns.
+
+        Args:
+            patterns (list[GlobPattern]): The patterns, in order."""
+        self.patterns = patterns
+
+    @classmethod
+    def from_file(cls, path: pathlib.Path) -> "GitIgnore":
+        """Read a `.gitignore` file.
+
+        Args:
+            path (pathlib.Path): The file.
+
+        Returns:
+            GitIgnore: The patterns of the file."""
+        text = path.read_text(errors="replace")
+        patterns = (GlobPattern.parse(line) for line in text.splitlines())
+        return cls([p for p in patterns if p is not None])
+
+    def match(self, path: str, is_dir: bool) -> bool | None:
+        """Decide whether a path is ignored.
+
+        Args:
+            path (str): The path, relative to the directory of the file, with
+                forward slashes.
+            is_dir (bool): Whether the path is a directory.
+
+        Returns:
+            bool | None: True if ignored, False if explicitly re-included, or
+            None if no pattern matches. The last matching pattern wins."""
+        for pattern in reversed(self.patterns):
+            if pattern.matches(path, is_dir):
+                return not pattern.negated
+        return None
+
+
+def _translate(pattern: str) -> str:
+    """Translate a glob pattern into a regular expression.
+
+    Args:
+        pattern (str): The glob pattern, without leading or trailing slashes.
+
+    Returns:
+        str: The equivalent regular expression, to be matched in full."""
+    parts: list[str] = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**", i):
+            at_start = i == 0 or pattern[i - 1] == "/"
+            at_end = i + 2 == len(pattern) or pattern[i + 2] == "/"
+            if at_start and at_end:
+                # A whole component of `**` matches any number of directories.
+                if i + 2 < len(pattern):
+                    parts.append("(?:.*/)?")
+                    i += 3
+                else:
+                    parts.append(".*")
+                    i += 2
+                continue
+            parts.append("[^/]*")
+            i += 2
+        elif char == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif char == "?":
+            parts.append("[^/]")
+            i += 1
+        elif char == "[" and (end := pattern.find("]", i + 2)) != -1:
+            body = pattern[i + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append("[" + body.replace("\\", "\\\\") + "]")
+            i = end + 1
+        elif char == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(char))
+            i += 1
+    return "".join(parts)
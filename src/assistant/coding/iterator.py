@@ -1,10 +1,17 @@
 import ast
 import collections.abc
+import concurrent.futures
+import functools
+import os
 import pathlib
 import typing
 
+from assistant import metrics
+from assistant.coding.ignore import GitIgnore
+from assistant.coding.ignore import GlobPattern
 from assistant.coding.model import DocstringNode
 from assistant.coding.model import InterestingNode
+from assistant.coding.parsed import ParsedFile
 
 
 class FileIterator:
@@ -21,15 +28,20 @@ class FileIterator:
         text (str):
             Content of the python script"""
 
-    def __init__(self, file_path: pathlib.Path):
+    def __init__(self, file_path: pathlib.Path, text: str | None = None):
         """Instantiates the FileIterator object for a single file.
 
         Args:
             file_path (pathlib.Path):
-                The file to be parsed."""
-        assert file_path.is_file()
+                The file to be parsed.
+            text (str | None):
+                Contents of the file. If None, the file is read from disk."""
+        if text is None:
+            assert file_path.is_file()
+            text = file_path.read_text()
+
         self.file_path = file_path
-        self.text = self.file_path.read_text()
+        self.text = text
 
     def _extract_ast(self, node: InterestingNode) -> typing.Iterable[DocstringNode]:
         """Extracts nodes from the AST.
@@ -56,54 +68,304 @@ class FileIterator:
                 if transformed_child:
                     child_nodes.append(transformed_child)
 
-        src = ast.get_source_segment(self.text, node)
-
-        if isinstance(node, ast.Module) and not src:
-            src = self.text
-
-        yield DocstringNode(
-            ast=node,
-            original_docstring=ast.get_docstring(node),
-            code_snippet=src,
-            children=child_nodes,
-        )
+        yield DocstringNode.from_ast(node, self.parsed.buffer, child_nodes)
 
-    def iterate(self) -> collections.abc.Iterable[DocstringNode]:
+    def iterate(self, keep_ast: bool = True) -> collections.abc.Iterable[DocstringNode]:
         """Iterates over the file to generate AST nodes.
 
+        Args:
+            keep_ast (bool): Whether the nodes keep their syntax trees. If
+                False, the trees are released, so that the nodes of many files
+                can be held without holding every tree.
+
         Returns:
             An iterable containing DocstringNode objects, which includes
             information about the node (AST), associated docstring,
             associated code snippet, and its child nodes"""
-        syntax_tree = ast.parse(self.text, filename=self.file_path.name)
-        yield from self._extract_ast(syntax_tree)
+        # Only the module node is yielded, so extract it in full up front to
+        # time it on its own.
+        with metrics.span("iterate"):
+            nodes = list(self._extract_ast(self.parsed.tree))
+        if not keep_ast:
+            for node in nodes:
+                node.release()
+        yield from nodes
+
+    @functools.cached_property
+    def parsed(self) -> ParsedFile:
+        """The parsed file, shared with anything applying docstrings to it."""
+        return ParsedFile(self.text, filename=self.file_path.name)
+
+
+# Ignore rules in effect in a directory: the rules, followed by how many
+# leading characters to strip from a path relative to the root, and what to
+# prefix it with, to make it relative to the directory of the rules.
+ActiveRules: typing.TypeAlias = tuple[GitIgnore, int, str]
 
 
 class RepositoryIterator:
     """Class to iterate over a repository of python script files.
 
     This class iterates over all Python files in the provided directory
-    and its subdirectories.
+    and its subdirectories, in sorted order. Files and directories ignored by
+    `.gitignore` files are skipped, as is `.git` itself, and ignored
+    directories are never entered. Rules from `.gitignore` files in parent
+    directories of the root, up to the top of the git repository, and from
+    `.git/info/exclude` are honored too.
 
     Attributes:
         root (pathlib.Path):
-            The root directory that needs to be parsed"""
+            The root directory that needs to be parsed
+        include (list[GlobPattern]): If not empty, only files matching one of
+            these patterns are yielded.
+        exclude (list[GlobPattern]): Files and directories matching any of
+            these patterns are skipped.
+        max_file_size (int | None): Files larger than this many bytes are
+            skipped, if given.
+        workers (int): The number of threads walking the subdirectories of the
+            root at once."""
 
-    def __init__(self, root: pathlib.Path):
+    def __init__(
+        self,
+        root: pathlib.Path,
+        include: collections.abc.Iterable[str] = (),
+        exclude: collections.abc.Iterable[str] = (),
+        max_file_size: int | None = None,
+        workers: int = 1,
+    ):
         """Instantiates the RepositoryIterator object with the given root directory.
 
         Args:
             root (pathlib.Path):
-                The root directory that needs to be parsed"""
+                The root directory that needs to be parsed
+            include (Iterable[str]): Glob patterns, in the syntax of
+                `.gitignore`, selecting the files to yield. All Python files
+                are yielded if there are none.
+            exclude (Iterable[str]): Glob patterns, in the syntax of
+                `.gitignore`, of files and directories to skip.
+            max_file_size (int | None): Files larger than this many bytes are
+                skipped, if given.
+            workers (int): The number of threads walking the subdirectories of
+                the root at once."""
         assert root.is_dir()
         self.root = root
+        self.include = _patterns(include)
+        self.exclude = _patterns(exclude)
+        self.max_file_size = max_file_size
+        self.workers = workers
 
     def iterate(self) -> collections.abc.Iterable[pathlib.Path]:
         """Iterates over the directory to generate paths to Python script files.
 
+        With more than one worker, each subdirectory of the root is walked as
+        a separate shard. Shards are walked ahead in parallel, but their files
+        are still yielded in order.
+
         Returns:
             An iterable containing pathlib.Path objects, which are paths to
             Python script files in the directory"""
-        for path in self.root.glob("**/*.py"):
-            if path.is_file():
-                yield path
+        rules = self._parent_rules()
+        if self.workers == 1:
+            yield from self._walk("", rules)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            rules = self._directory_rules("", rules)
+            shards: list[concurrent.futures.Future[list[pathlib.Path]]] = []
+            for entry, path, is_dir in self._entries("", rules):
+                if is_dir:
+                    walk = self._walk(path, rules)
+                    shards.append(executor.submit(list, walk))
+                else:
+                    shards.append(_done([pathlib.Path(entry.path)]))
+
+            for shard in shards:
+                yield from shard.result()
+
+    def select(
+        self, paths: collections.abc.Iterable[pathlib.Path]
+    ) -> collections.abc.Iterator[pathlib.Path]:
+        """Filter files found some other way, such as by git, instead of walking.
+
+        Files outside the root are left out, as are those that are excluded,
+        in an excluded directory, not included, or too large. Ignore rules are
+        not checked, as files tracked by git are never ignored.
+
+        Args:
+            paths (Iterable[pathlib.Path]): The files to filter.
+
+        Yields:
+            pathlib.Path: Each selected file, as a path within the root."""
+        root = self.root.resolve()
+        for path in paths:
+            try:
+                relative = path.resolve().relative_to(root).as_posix()
+            except ValueError:
+                continue
+
+            parts = relative.split("/")
+            directories = ["/".join(parts[:i]) for i in range(1, len(parts))]
+            if any(p.matches(d, True) for d in directories for p in self.exclude):
+                continue
+            if any(p.matches(relative, False) for p in self.exclude):
+                continue
+            if self._selected(path, relative):
+                yield self.root / relative
+
+    def _walk(
+        self, directory: str, rules: list[ActiveRules]
+    ) -> collections.abc.Iterator[pathlib.Path]:
+        """Walk a directory recursively.
+
+        Args:
+            directory (str): The directory, relative to the root.
+            rules (list[ActiveRules]): The ignore rules of its parents.
+
+        Yields:
+            pathlib.Path: Each Python file in the directory."""
+        rules = self._directory_rules(directory, rules)
+        for entry, path, is_dir in self._entries(directory, rules):
+            if is_dir:
+                yield from self._walk(path, rules)
+            else:
+                yield pathlib.Path(entry.path)
+
+    def _entries(
+        self, directory: str, rules: list[ActiveRules]
+    ) -> collections.abc.Iterator[tuple[os.DirEntry[str], str, bool]]:
+        """List the files to yield and the subdirectories to enter.
+
+        Args:
+            directory (str): The directory, relative to the root.
+            rules (list[ActiveRules]): The ignore rules in effect in it.
+
+        Yields:
+            tuple[os.DirEntry[str], str, bool]: Each entry, its path relative
+            to the root, and whether it is a directory."""
+        try:
+            with os.scandir(self.root / directory) as scanner:
+                entries = sorted(scanner, key=lambda e: e.name)
+        except OSError:
+            return
+
+        for entry in entries:
+            path = f"{directory}/{entry.name}" if directory else entry.name
+            try:
+                # Symbolic links to directories are not followed, to avoid cycles.
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not (entry.name.endswith(".py") and entry.is_file()):
+                    continue
+                if self._ignored(path, is_dir, rules):
+                    continue
+                if not is_dir and not self._selected(entry, path):
+                    continue
+            except OSError:
+                continue
+            yield entry, path, is_dir
+
+    def _ignored(self, path: str, is_dir: bool, rules: list[ActiveRules]) -> bool:
+        """Check whether a file or directory is excluded or ignored.
+
+        Args:
+            path (str): The path, relative to the root.
+            is_dir (bool): Whether the path is a directory.
+            rules (list[ActiveRules]): The ignore rules in effect.
+
+        Returns:
+            bool: True if the path should be skipped."""
+        if is_dir and path.rpartition("/")[2] == ".git":
+            return True
+        if any(pattern.matches(path, is_dir) for pattern in self.exclude):
+            return True
+
+        # Rules from deeper directories take precedence.
+        for ignore, strip, prefix in reversed(rules):
+            if (ignored := ignore.match(prefix + path[strip:], is_dir)) is not None:
+                return ignored
+        return False
+
+    def _selected(self, entry: os.DirEntry[str] | pathlib.Path, path: str) -> bool:
+        """Check whether a file is included and small enough.
+
+        Args:
+            entry (os.DirEntry[str] | pathlib.Path): The file.
+            path (str): The path of the file, relative to the root.
+
+        Returns:
+            bool: True if the file should be yielded."""
+        if self.include and not any(p.matches(path, False) for p in self.include):
+            return False
+        if self.max_file_size is not None:
+            return entry.stat().st_size <= self.max_file_size
+        return True
+
+    def _directory_rules(
+        self, directory: str, rules: list[ActiveRules]
+    ) -> list[ActiveRules]:
+        """Add the rules of a directory's `.gitignore` file, if it has one.
+
+        Args:
+            directory (str): The directory, relative to the root.
+            rules (list[ActiveRules]): The rules of its parents.
+
+        Returns:
+            list[ActiveRules]: The rules in effect in the directory."""
+        ignore_file = self.root / directory / ".gitignore"
+        if not ignore_file.is_file():
+            return rules
+        strip = len(directory) + 1 if directory else 0
+        return [*rules, (GitIgnore.from_file(ignore_file), strip, "")]
+
+    def _parent_rules(self) -> list[ActiveRules]:
+        """Collect the rules that apply to the root from its parents.
+
+        Returns:
+            list[ActiveRules]: The rules of `.git/info/exclude` and of the
+            `.gitignore` files above the root, outermost first."""
+        root = self.root.resolve()
+        for top in [root, *root.parents]:
+            if (top / ".git").exists():
+                break
+        else:
+            return []
+
+        def prefix(directory: pathlib.Path) -> str:
+            relative = root.relative_to(directory).as_posix()
+            return "" if relative == "." else relative + "/"
+
+        rules: list[ActiveRules] = []
+        exclude_file = top / ".git" / "info" / "exclude"
+        if exclude_file.is_file():
+            rules.append((GitIgnore.from_file(exclude_file), 0, prefix(top)))
+
+        # The root's own `.gitignore` is read while walking it.
+        for directory in reversed(root.parents):
+            ignore_file = directory / ".gitignore"
+            if directory.is_relative_to(top) and ignore_file.is_file():
+                rules.append((GitIgnore.from_file(ignore_file), 0, prefix(directory)))
+        return rules
+
+
+def _patterns(globs: collections.abc.Iterable[str]) -> list[GlobPattern]:
+    """Parse glob patterns, dropping blank ones.
+
+    Args:
+        globs (Iterable[str]): The patterns.
+
+    Returns:
+        list[GlobPattern]: The parsed patterns."""
+    patterns = (GlobPattern.parse(glob) for glob in globs)
+    return [p for p in patterns if p is not None]
+
+
+def _done(result: list[pathlib.Path]) -> concurrent.futures.Future[list[pathlib.Path]]:
+    """Wrap a result that is already known in a future.
+
+    Args:
+        result (list[pathlib.Path]): The result.
+
+    Returns:
+        Future[list[pathlib.Path]]: A finished future holding the result."""
+    future: concurrent.futures.Future[list[pathlib.Path]] = concurrent.futures.Future()
+    future.set_result(result)
+    return future
@@ -0,0 +1,201 @@
+"""Manifest of files processed by previous runs, used for incremental runs."""
+import collections.abc
+import dataclasses
+import hashlib
+import json
+import os
+import pathlib
+import typing
+
+from assistant.coding.iterator import FileIterator
+from assistant.coding.model import DocstringNode
+
+
+def content_hash(text: str) -> str:
+    """Hash a piece of source code.
+
+    Args:
+        text (str): The code to hash.
+
+    Returns:
+        str: Hex digest of the code."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ChangeSet(typing.Protocol):
+    """Selects the code that changed, so that only it is sent to the model."""
+
+    def subset(self, file_path: pathlib.Path) -> "ChangeSet":
+        """Copy the changes of a single file, to send to a worker process."""
+
+    def is_unchanged(self, file_path: pathlib.Path, text: str) -> bool:
+        """Check whether nothing in a file has changed."""
+
+    def changed_nodes(
+        self, file_path: pathlib.Path, module: DocstringNode
+    ) -> list[DocstringNode]:
+        """Select the top-level classes and functions of a file that changed."""
+
+
+@dataclasses.dataclass
+class FileRecord:
+    """What was known about a file after it was last processed.
+
+    Attributes:
+        content_hash (str): Hash of the whole file.
+        node_hashes (dict[str, str]): Hash of the code snippet of each class
+            and function, keyed by its dotted qualified name."""
+
+    content_hash: str
+    node_hashes: dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+class Manifest:
+    """Record of the files and nodes processed by previous runs.
+
+    Files whose content hash is unchanged since they were recorded can be
+    skipped without being parsed. For files that did change, only the
+    top-level classes and functions whose code changed need to be requested.
+
+    Attributes:
+        path (pathlib.Path): The JSON file in which the manifest is stored.
+        files (dict[str, FileRecord]): Records keyed by the path of each file,
+            relative to the directory containing the manifest."""
+
+    version = 1
+
+    def __init__(self, path: pathlib.Path, files: dict[str, FileRecord] | None = None):
+        """Initialize the manifest.
+
+        Args:
+            path (pathlib.Path): The JSON file in which the manifest is stored.
+            files (dict[str, FileRecord] | None): Existing file records."""
+        self.path = path
+        self.files = files if files is not None else {}
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "Manifest":
+        """Load a manifest, starting afresh if it is missing or unreadable.
+
+        Args:
+            path (pathlib.Path): The JSON file in which the manifest is stored.
+
+        Returns:
+            Manifest: The loaded manifest."""
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return cls(path)
+
+        if not isinstance(data, dict) or data.get("version") != cls.version:
+            return cls(path)
+
+        files = {
+            name: FileRecord(record["content_hash"], record["node_hashes"])
+            for name, record in data["files"].items()
+        }
+        return cls(path, files)
+
+    def save(self) -> None:
+        """Write the manifest to disk, replacing any previous version."""
+        data = {
+            "version": self.version,
+            "files": {
+                name: dataclasses.asdict(record)
+                for name, record in sorted(self.files.items())
+            },
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data, indent=1))
+        tmp_path.replace(self.path)
+
+    def _key(self, file_path: pathlib.Path) -> str:
+        return os.path.relpath(file_path.resolve(), self.path.parent.resolve())
+
+    def subset(self, file_path: pathlib.Path) -> "Manifest":
+        """Copy the manifest, keeping only the record of a single file.
+
+        Args:
+            file_path (pathlib.Path): The file to keep.
+
+        Returns:
+            Manifest: A manifest small enough to send to a worker process."""
+        key = self._key(file_path)
+        record = self.files.get(key)
+        return Manifest(self.path, {key: record} if record is not None else {})
+
+    def is_unchanged(self, file_path: pathlib.Path, text: str) -> bool:
+        """Check whether a file is identical to when it was last recorded.
+
+        Args:
+            file_path (pathlib.Path): The file to check.
+            text (str): The current contents of the file.
+
+        Returns:
+            bool: True if the file was recorded with exactly this content."""
+        record = self.files.get(self._key(file_path))
+        return record is not None and record.content_hash == content_hash(text)
+
+    def changed_nodes(
+        self, file_path: pathlib.Path, module: DocstringNode
+    ) -> list[DocstringNode]:
+        """Select the top-level classes and functions whose code has changed.
+
+        A node is unchanged if a node with identical code was recorded for the
+        same file, so moving a definition within a file does not count as a
+        change.
+
+        Args:
+            file_path (pathlib.Path): The file containing the module.
+            module (DocstringNode): The module node of the file.
+
+        Returns:
+            list[DocstringNode]: The changed children of the module."""
+        record = self.files.get(self._key(file_path))
+        if record is None:
+            return list(module.children)
+
+        known = set(record.node_hashes.values())
+        return [
+            child
+            for child in module.children
+            if not child.code_snippet or content_hash(child.code_snippet) not in known
+        ]
+
+    def record(self, file_path: pathlib.Path, text: str) -> None:
+        """Record the contents of a file after it has been processed.
+
+        Args:
+            file_path (pathlib.Path): The processed file.
+            text (str): The contents of the file, as written to disk."""
+        node_hashes: dict[str, str] = {}
+        for module in FileIterator(file_path, text).iterate(keep_ast=False):
+            for name, node in _walk(module.children, ()):
+                # Redefinitions (e.g. property setters) share a qualified name.
+                key = base_key = ".".join(name)
+                duplicates = 1
+                while key in node_hashes:
+                    duplicates += 1
+                    key = f"{base_key}#{duplicates}"
+                node_hashes[key] = content_hash(node.code_snippet)
+
+        self.files[self._key(file_path)] = FileRecord(content_hash(text), node_hashes)
+
+
+def _walk(
+    nodes: collections.abc.Iterable[DocstringNode], prefix: tuple[str, ...]
+) -> collections.abc.Iterable[tuple[tuple[str, ...], DocstringNode]]:
+    """Walk a tree of nodes, yielding each node with its qualified name.
+
+    Args:
+        nodes (Iterable[DocstringNode]): The nodes at the current level.
+        prefix (tuple[str, ...]): Qualified name of the parent of `nodes`.
+
+    Yields:
+        tuple[tuple[str, ...], DocstringNode]: Each node and its qualified name.
+    """
+    for node in nodes:
+        name = (*prefix, node.name)
+        yield name, node
+        yield from _walk(node.children, name)
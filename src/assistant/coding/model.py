@@ -1,33 +1,129 @@
 import ast
 import dataclasses
+import enum
+import hashlib
 import typing
 
 import libcst as cst
 
+from assistant.coding.parsed import SourceBuffer
+
 
 StmtNodes: typing.TypeAlias = cst.FunctionDef | cst.ClassDef | cst.Module
 
 InterestingNode: typing.TypeAlias = StmtNodes | ast.AST
 
+Definition: typing.TypeAlias = ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef
 
-@dataclasses.dataclass
+ScopeNode: typing.TypeAlias = Definition | ast.Module
+
+
+class NodeKind(enum.Enum):
+    """The kind of definition a node is."""
+
+    MODULE = enum.auto()
+    CLASS = enum.auto()
+    FUNCTION = enum.auto()
+
+
+@dataclasses.dataclass(slots=True)
 class DocstringNode:
     """A dataclass representing a node in a code syntax tree that has an associated docstring.
 
+    Nodes don't hold their own code, but its offsets into a buffer shared by
+    every node of the file, along with the positions that prompts are built
+    from. Their syntax trees can be released, so that the nodes of many files
+    can be held at once.
+
     Attributes:
         original_docstring (str | None): Original docstring associated with the node.
             None if the node had no docstring.
-        code_snippet (str | None): A Python code snippet associated with the node.
-            None if there's no associated code.
-        ast (ast.AST): The AST node associated with this DocstringNode.
+        source (SourceBuffer): The code of the file containing the node.
+        start (int): Offset of the start of the node's code in `source`.
+        end (int): Offset of the end of the node's code in `source`.
+        kind (NodeKind): Whether the node is a module, class or function.
+        ast (ast.AST | None): The AST node associated with this DocstringNode,
+            or None once it has been released.
+        name (str): The name of the class or function. Empty for modules.
+        lineno (int): The line of the node's `class` or `def` keyword.
+        end_lineno (int): The last line of the node.
+        first_lineno (int): The first line of the node, including decorators.
+        body_lineno (int): The first line of the node's body.
+        col_offset (int): The indentation of the node.
         children (list): A list of child nodes. These are also instances of DocstringNode.
+        context (bool): Whether the node and its descendants are only sent as
+            context for other nodes, without asking for their docstrings.
     """
 
     original_docstring: str | None
-    code_snippet: str | None
-    ast: ast.AST
+    source: SourceBuffer
+    start: int
+    end: int
+    kind: NodeKind
+    ast: ast.AST | None
+    name: str = ""
+    lineno: int = 1
+    end_lineno: int = 1
+    first_lineno: int = 1
+    body_lineno: int = 1
+    col_offset: int = 0
 
     children: list["DocstringNode"] = dataclasses.field(default_factory=list)
+    context: bool = False
+
+    @classmethod
+    def from_ast(
+        cls,
+        node: ScopeNode,
+        source: SourceBuffer,
+        children: list["DocstringNode"],
+    ) -> "DocstringNode":
+        """Describe a module, class or function.
+
+        Args:
+            node (ScopeNode): The syntax tree of the node.
+            source (SourceBuffer): The code the node was parsed from.
+            children (list[DocstringNode]): The nodes of the classes and
+                functions defined directly within it.
+
+        Returns:
+            DocstringNode: The node, holding on to its syntax tree."""
+        docstring = ast.get_docstring(node)
+        body_lineno = node.body[0].lineno if node.body else 1
+        if isinstance(node, ast.Module):
+            return cls(
+                docstring,
+                source,
+                0,
+                len(source),
+                NodeKind.MODULE,
+                node,
+                end_lineno=len(source.line_offsets),
+                body_lineno=body_lineno,
+                children=children,
+            )
+
+        start, end = source.span(node) or (0, 0)
+        return cls(
+            docstring,
+            source,
+            start,
+            end,
+            NodeKind.CLASS if isinstance(node, ast.ClassDef) else NodeKind.FUNCTION,
+            node,
+            name=node.name,
+            lineno=node.lineno,
+            end_lineno=node.end_lineno or node.lineno,
+            first_lineno=min([node.lineno, *(d.lineno for d in node.decorator_list)]),
+            body_lineno=body_lineno,
+            col_offset=node.col_offset,
+            children=children,
+        )
+
+    @property
+    def code_snippet(self) -> str:
+        """The code of the node, without the indentation of its first line."""
+        return self.source.slice(self.start, self.end)
 
     def combine_child_code(self) -> str:
         """Combine code snippets from all child nodes into a single string.
@@ -40,6 +136,49 @@ class DocstringNode:
             child.code_snippet for child in self.children if child.code_snippet
         )
 
+    def needs_docstrings(self) -> bool:
+        """Check whether this node or any of its descendants lacks a docstring.
+
+        Returns:
+            bool: True if any node in this subtree has no docstring. Always
+            False for context nodes."""
+        if self.context:
+            return False
+        return self.original_docstring is None or any(
+            child.needs_docstrings() for child in self.children
+        )
+
+    def fingerprint(self) -> str:
+        """Hash the syntax tree of this node, ignoring where it is.
+
+        Copies of a class or function share a fingerprint wherever they are
+        defined, however they are indented, formatted or commented.
+
+        Returns:
+            str: A hex digest of the node's AST, dumped without line numbers or
+            offsets, and of which of its descendants are only context.
+
+        Raises:
+            ValueError: If the syntax tree of the node was released."""
+        if self.ast is None:
+            raise ValueError(f"The syntax tree of {self.name} was released.")
+        digest = hashlib.sha256(ast.dump(self.ast).encode())
+        stack = list(self.children)
+        while stack:
+            node = stack.pop()
+            digest.update(b"c" if node.context else b"-")
+            stack.extend(node.children)
+        return digest.hexdigest()
+
+    def release(self) -> None:
+        """Drop the syntax trees of this node and its descendants.
+
+        The code and positions of the nodes are kept, but they can no longer
+        be fingerprinted or rendered as skeletons."""
+        self.ast = None
+        for child in self.children:
+            child.release()
+
 
 @dataclasses.dataclass
 class OtherNode:
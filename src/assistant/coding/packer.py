@@ -0,0 +1,443 @@
+"""Packs classes and functions from many files into shared requests."""
+import collections
+import dataclasses
+import hashlib
+import pathlib
+import re
+import textwrap
+
+import tiktoken
+
+from assistant import metrics
+from assistant.coding.iterator import FileIterator
+from assistant.coding.manifest import ChangeSet
+from assistant.coding.parsed import ParsedFile
+from assistant.coding.request import DIRECTIVES
+from assistant.coding.request import RESPONSE_DIRECTIVES
+from assistant.coding.request import SEPARATOR
+from assistant.coding.request import Piece
+from assistant.coding.request import Replacement
+from assistant.coding.request import ResponseFormat
+from assistant.coding.request import apply_docstrings
+from assistant.coding.request import load_json_object
+from assistant.coding.request import split_nodes
+from assistant.coding.request import undocumented_paths
+from assistant.coding.sanitizer import ResponseSanitizer
+from assistant.coding.skeleton import SkeletonBuilder
+from assistant.conversation.model import Message
+
+
+PACKED_DIRECTIVES = {
+    ResponseFormat.CODE: [
+        *DIRECTIVES,
+        *RESPONSE_DIRECTIVES[ResponseFormat.CODE],
+        "Each piece of code is preceded by an `# id:` comment.",
+        "Keep these comments, unchanged, before each piece in your response.",
+    ],
+    ResponseFormat.JSON: [
+        *DIRECTIVES,
+        "Do not return any code.",
+        "Each piece of code is preceded by an `# id:` comment.",
+        "Respond only with a JSON object mapping each id to an object, which "
+        "maps the dotted name of each class and function in that piece, such "
+        "as `Class.method`, to its docstring.",
+    ],
+}
+
+ID_LENGTH = 12
+
+ID_PATTERN = re.compile(rf"^\s*# id: ([0-9a-f]{{{ID_LENGTH}}})\s*$")
+
+
+def piece_id(file_path: pathlib.Path, qualname: tuple[str, ...], index: int) -> str:
+    """Compute the identifier of a piece of code.
+
+    Identifiers are stable across runs, so identical batches produce
+    identical prompts and can be answered from the response cache.
+
+    Args:
+        file_path (pathlib.Path): The file containing the piece.
+        qualname (tuple[str, ...]): The qualified name of the piece.
+        index (int): Distinguishes pieces of the same file with the same name.
+
+    Returns:
+        str: A short hex identifier."""
+    key = f"{file_path}:{'.'.join(qualname)}:{index}"
+    return hashlib.sha1(key.encode()).hexdigest()[:ID_LENGTH]
+
+
+def parse_sections(content: str) -> dict[str, str]:
+    """Split a response into the code following each `# id:` comment.
+
+    Args:
+        content (str): The sanitized response.
+
+    Returns:
+        dict[str, str]: The dedented code of each section, keyed by its id."""
+    sections: dict[str, str] = {}
+    ident: str | None = None
+    lines: list[str] = []
+
+    for line in content.split("\n"):
+        if match := ID_PATTERN.match(line):
+            if ident is not None:
+                sections[ident] = textwrap.dedent("\n".join(lines))
+            ident, lines = match.group(1), []
+        elif ident is not None:
+            lines.append(line)
+
+    if ident is not None:
+        sections[ident] = textwrap.dedent("\n".join(lines))
+
+    return sections
+
+
+def parse_mappings(content: str) -> dict[str, Replacement]:
+    """Parse a response mapping each id to the docstrings of its piece.
+
+    Args:
+        content (str): The sanitized response.
+
+    Returns:
+        dict[str, Replacement]: The docstrings of each piece, keyed by its id.
+        Sections that are not mappings of strings are left out."""
+    sections: dict[str, Replacement] = {}
+    for ident, docstrings in (load_json_object(content) or {}).items():
+        if isinstance(docstrings, dict):
+            sections[ident] = {
+                k: v for k, v in docstrings.items() if isinstance(v, str)
+            }
+    return sections
+
+
+@dataclasses.dataclass
+class PackedFile:
+    """A file whose classes and functions are spread over shared requests.
+
+    Attributes:
+        file_path (pathlib.Path): The file.
+        source (str): The code of the whole file.
+        pieces (list[Piece]): The undocumented classes and functions to send.
+        replacements (list[tuple[tuple[str, ...], Replacement]]): Code or
+            docstring mappings returned by the model so far, each paired with
+            the scope it describes.
+        outstanding (int): Number of pieces still awaiting a response.
+        error (Exception | None): Error that prevented the file from being
+            finished, if any.
+        parsed (ParsedFile | None): The parsed source, reused when applying
+            the responses.
+        targets (set[tuple[str, ...]] | None): Paths of the only nodes whose
+            docstrings are applied, if only changed code was sent."""
+
+    file_path: pathlib.Path
+    source: str
+    pieces: list[Piece]
+    replacements: list[tuple[tuple[str, ...], Replacement]] = dataclasses.field(
+        default_factory=list
+    )
+    outstanding: int = 0
+    error: Exception | None = None
+    parsed: ParsedFile | None = None
+    targets: set[tuple[str, ...]] | None = None
+
+    @classmethod
+    def from_file(
+        cls,
+        file_path: pathlib.Path,
+        tokenizer: tiktoken.Encoding,
+        budget: int,
+        changes: ChangeSet | None = None,
+        skeleton: SkeletonBuilder | None = None,
+        max_budget: int | None = None,
+    ) -> "PackedFile":
+        """Collect the undocumented classes and functions of a file.
+
+        Top-level definitions that are already fully documented are left out.
+
+        Args:
+            file_path (pathlib.Path): The file to process.
+            tokenizer (tiktoken.Encoding): The tokenizer used to count tokens.
+            budget (int): Maximum number of tokens in each piece of code.
+            changes (ChangeSet | None): The code that changed, since a previous
+                run or a git revision. If given, only changed classes and
+                functions are collected, and only they receive docstrings.
+            skeleton (SkeletonBuilder | None): If given, classes and functions
+                are sent as skeletons rather than as their full source.
+            max_budget (int | None): Maximum number of tokens in a piece that
+                can't be split, if larger than `budget`.
+
+        Returns:
+            PackedFile: The file and its pieces."""
+        file_iterator = FileIterator(file_path)
+        source = file_iterator.text
+
+        if changes is not None and changes.is_unchanged(file_path, source):
+            return cls(file_path=file_path, source=source, pieces=[])
+
+        pieces: list[Piece] = []
+        targets: set[tuple[str, ...]] | None = None
+        for module in file_iterator.iterate():
+            if changes is None:
+                nodes = module.children
+            else:
+                nodes = changes.changed_nodes(file_path, module)
+                targets = undocumented_paths(nodes)
+
+            undocumented = [node for node in nodes if node.needs_docstrings()]
+            pieces.extend(
+                split_nodes(undocumented, (), budget, tokenizer, skeleton, max_budget)
+            )
+
+        return cls(
+            file_path=file_path,
+            source=source,
+            pieces=pieces,
+            parsed=file_iterator.parsed,
+            targets=targets,
+        )
+
+    def apply(self) -> str:
+        """Apply every docstring returned for this file.
+
+        Returns:
+            str: The source code with docstrings added."""
+        return apply_docstrings(
+            self.source, self.replacements, self.parsed, self.targets
+        )
+
+
+@dataclasses.dataclass
+class Batch:
+    """A single request containing pieces of code from one or more files.
+
+    Attributes:
+        items (list[tuple[str, PackedFile, Piece]]): Each piece, with its id
+            and the file it belongs to.
+        tokens (int): Number of tokens used by the pieces and their ids.
+        response_format (ResponseFormat): The format the model is asked to
+            respond in.
+        copies (list[tuple[str, PackedFile, Piece]]): Copies of pieces in
+            `items` from other places, which are not sent but receive the
+            response to the piece with the same id.
+        answers (dict[str, Replacement] | None): The response to each piece,
+            once it has been routed.
+        error (Exception | None): Error that prevented the batch from being
+            answered, if any."""
+
+    items: list[tuple[str, PackedFile, Piece]] = dataclasses.field(default_factory=list)
+    tokens: int = 0
+    response_format: ResponseFormat = ResponseFormat.CODE
+    copies: list[tuple[str, PackedFile, Piece]] = dataclasses.field(
+        default_factory=list
+    )
+    answers: dict[str, Replacement] | None = None
+    error: Exception | None = None
+
+    @property
+    def message(self) -> Message:
+        """The prompt for this batch."""
+        code = "\n\n".join(
+            f"# id: {ident}\n{piece.code}" for ident, _, piece in self.items
+        )
+        directives = PACKED_DIRECTIVES[self.response_format]
+        return Message("user", " ".join(directives) + SEPARATOR + code)
+
+    @property
+    def files(self) -> list[PackedFile]:
+        """The distinct files with pieces in this batch, in order."""
+        return list({id(f): f for _, f, _ in self.items + self.copies}.values())
+
+    def route(self, content: str) -> list[PackedFile]:
+        """Hand each section of the response to the file it belongs to.
+
+        Args:
+            content (str): The content of the model's response.
+
+        Returns:
+            list[PackedFile]: Files that have now received every response.
+
+        Raises:
+            Exception: If the response is missing any of the pieces."""
+        sanitized = ResponseSanitizer().sanitize(content)
+        sections: dict[str, Replacement] = {}
+        if self.response_format == ResponseFormat.JSON:
+            sections = parse_mappings(sanitized)
+        # Fall back to parsing code if the model ignored the JSON format.
+        if not sections:
+            sections = dict(parse_sections(sanitized))
+
+        missing = [ident for ident, _, _ in self.items if ident not in sections]
+        if missing:
+            raise Exception(
+                f"Response is missing {len(missing)} of {len(self.items)} pieces."
+            )
+
+        finished = []
+        for ident, packed_file, piece in self.items + self.copies:
+            packed_file.replacements.append((piece.prefix, sections[ident]))
+            packed_file.outstanding -= 1
+            if packed_file.outstanding == 0:
+                finished.append(packed_file)
+
+        # Keep only the answers, for copies still to come, and let the files go.
+        self.answers = {ident: sections[ident] for ident, _, _ in self.items}
+        self.items, self.copies = [], []
+        return finished
+
+
+class RequestPacker:
+    """Bin-packs pieces of code from many files into requests.
+
+    Pieces are placed in the first open batch with room for them. When no
+    batch has room and too many batches are open, the fullest is closed.
+
+    Identical pieces are only requested once: vendored packages and
+    copy-pasted helpers put the same code in many files. A copy of a piece
+    that was already packed waits for the same response, or takes it at once
+    if it has already been answered.
+
+    Attributes:
+        budget (int): Maximum number of tokens of code in each batch.
+        max_budget (int): Maximum number of tokens of code in a batch holding
+            a single piece too large for `budget`, which is sent on its own to
+            a model with a larger context window.
+        max_open (int): Maximum number of batches being filled at once.
+        response_format (ResponseFormat): The format each batch asks for.
+        open_batches (list[Batch]): The batches being filled.
+        pieces (int): The number of pieces added.
+        duplicates (int): The number of pieces that were copies of others, and
+            were not requested again."""
+
+    def __init__(
+        self,
+        tokenizer: tiktoken.Encoding,
+        budget: int,
+        max_open: int = 4,
+        response_format: ResponseFormat = ResponseFormat.CODE,
+        max_budget: int | None = None,
+    ):
+        """Initialize the packer.
+
+        Args:
+            tokenizer (tiktoken.Encoding): The tokenizer used to count tokens.
+            budget (int): Maximum number of tokens of code in each batch.
+            max_open (int): Maximum number of batches being filled at once.
+            response_format (ResponseFormat): The format each batch asks for.
+            max_budget (int | None): Maximum number of tokens of code in a
+                batch holding a single piece, if larger than `budget`."""
+        self.budget = budget
+        self.max_budget = max(budget, max_budget or budget)
+        self.max_open = max_open
+        self.response_format = response_format
+        self.open_batches: list[Batch] = []
+        self.pieces = 0
+        self.duplicates = 0
+        self._id_tokens = len(tokenizer.encode(f"# id: {'0' * ID_LENGTH}\n\n\n"))
+        # The batch and id each distinct piece was requested with, by its key.
+        self._requested: dict[str, tuple[Batch, str]] = {}
+
+    @property
+    def piece_budget(self) -> int:
+        """Maximum number of tokens in a piece of code that shares a batch."""
+        return self.budget - self._id_tokens
+
+    @property
+    def max_piece_budget(self) -> int:
+        """Maximum number of tokens in a piece of code sent on its own."""
+        return self.max_budget - self._id_tokens
+
+    @property
+    def dedup_ratio(self) -> float:
+        """The fraction of pieces that were not requested, being copies."""
+        return self.duplicates / self.pieces if self.pieces else 0.0
+
+    def add(self, packed_file: PackedFile) -> list[Batch]:
+        """Add the pieces of a file to the open batches.
+
+        Args:
+            packed_file (PackedFile): The file to add.
+
+        Returns:
+            list[Batch]: Batches that were closed to make room."""
+        closed = []
+        occurrences: collections.Counter[tuple[str, ...]] = collections.Counter()
+        packed_file.outstanding += len(packed_file.pieces)
+        self.pieces += len(packed_file.pieces)
+        metrics.count("pieces", len(packed_file.pieces))
+
+        for piece in packed_file.pieces:
+            ident = piece_id(
+                packed_file.file_path, piece.qualname, occurrences[piece.qualname]
+            )
+            occurrences[piece.qualname] += 1
+            if self._copy(packed_file, piece):
+                continue
+            tokens = piece.tokens + self._id_tokens
+
+            if tokens > self.budget:
+                # Too large to share a batch, it is sent on its own.
+                batch = Batch(response_format=self.response_format)
+                closed.append(batch)
+            else:
+                batch = self._open_batch(tokens, closed)
+
+            batch.items.append((ident, packed_file, piece))
+            batch.tokens += tokens
+            if piece.key:
+                self._requested[piece.key] = (batch, ident)
+
+        return closed
+
+    def _open_batch(self, tokens: int, closed: list[Batch]) -> Batch:
+        """Find an open batch with room for a piece, opening one if needed.
+
+        Args:
+            tokens (int): The tokens of the piece, with its id.
+            closed (list[Batch]): Batches closed to make room are added to
+                this list.
+
+        Returns:
+            Batch: The batch to add the piece to."""
+        batch = next(
+            (b for b in self.open_batches if b.tokens + tokens <= self.budget),
+            None,
+        )
+        if batch is None:
+            if len(self.open_batches) >= self.max_open:
+                fullest = max(self.open_batches, key=lambda b: b.tokens)
+                self.open_batches.remove(fullest)
+                closed.append(fullest)
+            batch = Batch(response_format=self.response_format)
+            self.open_batches.append(batch)
+        return batch
+
+    def _copy(self, packed_file: PackedFile, piece: Piece) -> bool:
+        """Attach a piece to the request of an identical piece, if there is one.
+
+        Args:
+            packed_file (PackedFile): The file the piece belongs to.
+            piece (Piece): The piece.
+
+        Returns:
+            bool: True if the piece is a copy, and must not be packed. Copies
+            of pieces whose request failed are packed again."""
+        batch, ident = self._requested.get(piece.key, (None, ""))
+        if batch is None or batch.error is not None:
+            return False
+
+        if batch.answers is None:
+            batch.copies.append((ident, packed_file, piece))
+        else:
+            packed_file.replacements.append((piece.prefix, batch.answers[ident]))
+            packed_file.outstanding -= 1
+        self.duplicates += 1
+        metrics.count("pieces_deduplicated")
+        return True
+
+    def flush(self) -> list[Batch]:
+        """Close every open batch.
+
+        Returns:
+            list[Batch]: The batches that were open."""
+        closed, self.open_batches = self.open_batches, []
+        return closed
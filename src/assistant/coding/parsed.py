@@ -0,0 +1,114 @@
+"""Parses a Python file once, for use by every stage that needs its syntax tree."""
+import array
+import ast
+import functools
+import re
+
+import libcst as cst
+
+
+NEWLINE = re.compile(rb"\r\n|\r|\n")
+
+
+class SourceBuffer:
+    """The code of a file, encoded once and shared by everything slicing it.
+
+    Nodes refer to their code by its offsets in the buffer, so the text of a
+    file is held once, however deeply its definitions are nested. Slices are
+    only decoded when asked for.
+
+    Attributes:
+        data (memoryview): The code, encoded as UTF-8.
+        line_offsets (array.array): The offset of the start of each line."""
+
+    __slots__ = ("data", "line_offsets")
+
+    def __init__(self, text: str):
+        """Encode some code.
+
+        Args:
+            text (str): The code."""
+        encoded = text.encode()
+        self.data = memoryview(encoded)
+        self.line_offsets = array.array(
+            "Q", [0, *(m.end() for m in NEWLINE.finditer(encoded))]
+        )
+
+    def __len__(self) -> int:
+        """The size of the encoded code, in bytes."""
+        return len(self.data)
+
+    def span(self, node: ast.AST) -> tuple[int, int] | None:
+        """Find the offsets of the code of a node.
+
+        Column offsets in the tree count UTF-8 bytes, so they index the
+        encoded code directly.
+
+        Args:
+            node (ast.AST): A node parsed from the code.
+
+        Returns:
+            tuple[int, int] | None: The offsets of the start and end of the
+            node, or None if it is not a statement or expression with a known
+            position."""
+        if not isinstance(node, ast.stmt | ast.expr) or node.end_lineno is None:
+            return None
+
+        start = self.line_offsets[node.lineno - 1] + node.col_offset
+        end = self.line_offsets[node.end_lineno - 1] + (node.end_col_offset or 0)
+        return start, end
+
+    def slice(self, start: int, end: int) -> str:
+        """Decode part of the code.
+
+        Args:
+            start (int): The offset of the first byte.
+            end (int): The offset after the last byte.
+
+        Returns:
+            str: The decoded code."""
+        return str(self.data[start:end], "utf-8")
+
+
+class ParsedFile:
+    """The code of a file along with its syntax tree.
+
+    The `ast` tree is built once and shared between building prompts and
+    applying docstrings. Source segments are sliced from a shared buffer using
+    a precomputed index of line offsets, rather than by splitting the file for
+    every node, and the libcst tree is only parsed if it is needed.
+
+    Attributes:
+        text (str): The code of the file.
+        tree (ast.Module): The syntax tree of the code.
+        buffer (SourceBuffer): The encoded code, which nodes are sliced from."""
+
+    def __init__(self, text: str, filename: str = "<unknown>"):
+        """Parse some code.
+
+        Args:
+            text (str): The code to parse.
+            filename (str): The name of the file, used in syntax errors.
+
+        Raises:
+            SyntaxError: If the code can't be parsed."""
+        self.text = text
+        self.tree = ast.parse(text, filename=filename)
+        self.buffer = SourceBuffer(text)
+
+    def segment(self, node: ast.AST) -> str | None:
+        """Return the code of a node, like `ast.get_source_segment`.
+
+        Args:
+            node (ast.AST): A node of the tree.
+
+        Returns:
+            str | None: The code of the node, or None if it is not a statement
+            or expression with a known position."""
+        span = self.buffer.span(node)
+        return None if span is None else self.buffer.slice(*span)
+
+    @functools.cached_property
+    def cst_module(self) -> cst.Module:
+        """The libcst tree of the code, parsed on first use."""
+        return cst.parse_module(self.text)
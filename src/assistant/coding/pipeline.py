@@ -0,0 +1,207 @@
+"""Pipeline of stages connected by bounded queues, for processing many files."""
+import asyncio
+import collections.abc
+import dataclasses
+import pathlib
+import typing
+
+from assistant.coding.request import DocstringRequest
+from assistant.coding.request import Replacement
+
+
+DEFAULT_QUEUE_SIZE = 16
+
+T = typing.TypeVar("T")
+
+
+@dataclasses.dataclass
+class FileResult:
+    """The outcome of adding docstrings to a single file.
+
+    Attributes:
+        file_path (pathlib.Path): The file that was processed.
+        text (str | None): The code with docstrings added. None if processing
+            the file failed.
+        error (Exception | None): The error raised while processing the file,
+            if any.
+        skipped (bool): True if nothing in the file needed to be requested, in
+            which case `text` is the unmodified file."""
+
+    file_path: pathlib.Path
+    text: str | None = None
+    error: Exception | None = None
+    skipped: bool = False
+
+
+@dataclasses.dataclass
+class Job:
+    """A file making its way through the pipeline.
+
+    Each stage fills in the field needed by the next, and clears any it no
+    longer needs so that large intermediate values can be freed early.
+
+    Attributes:
+        file_path (pathlib.Path): The file being processed.
+        request (DocstringRequest | None): The prompts for the file.
+        contents (list[str] | None): The content of each response.
+        replacements (list[tuple[tuple[str, ...], Replacement]] | None): The
+            parsed responses, ready to apply.
+        result (FileResult | None): The outcome for the file. Once set, the
+            job skips any remaining stages."""
+
+    file_path: pathlib.Path
+    request: DocstringRequest | None = None
+    contents: list[str] | None = None
+    replacements: list[tuple[tuple[str, ...], Replacement]] | None = None
+    result: FileResult | None = None
+
+
+async def iterate_in_thread(
+    items: collections.abc.Iterable[T],
+) -> collections.abc.AsyncIterator[T]:
+    """Iterate over a blocking iterable without blocking the event loop.
+
+    Each item is pulled in a thread, so that a slow source, such as a walk of
+    a large directory tree, doesn't hold up responses, retries or requests.
+    Sequences, which never block, are iterated directly.
+
+    Args:
+        items (Iterable[T]): The items.
+
+    Yields:
+        T: Each item, in order."""
+    if isinstance(items, collections.abc.Sequence):
+        for item in items:
+            yield item
+        return
+
+    iterator = iter(items)
+    done = object()
+    while (item := await asyncio.to_thread(next, iterator, done)) is not done:
+        yield typing.cast(T, item)
+
+
+StageFunction: typing.TypeAlias = collections.abc.Callable[
+    [Job], collections.abc.Awaitable[None]
+]
+
+
+@dataclasses.dataclass
+class Stage:
+    """A step of the pipeline, run by several workers at once.
+
+    Attributes:
+        name (str): The name of the stage.
+        function (StageFunction): Processes a single job, updating it in place.
+        workers (int): The number of jobs processed at once."""
+
+    name: str
+    function: StageFunction
+    workers: int = 1
+
+
+class Pipeline:
+    """Passes jobs through a series of stages connected by bounded queues.
+
+    When a queue is full, the stage feeding it waits, so the slowest stage
+    sets the pace and no more than a fixed number of jobs are held between
+    stages, however many files there are. A stage that raises an exception
+    fails the job, which then skips the remaining stages.
+
+    Attributes:
+        stages (list[Stage]): The stages, in order.
+        queue_size (int): The maximum number of jobs waiting for each stage."""
+
+    def __init__(self, stages: list[Stage], queue_size: int = DEFAULT_QUEUE_SIZE):
+        """Initialize the pipeline.
+
+        Args:
+            stages (list[Stage]): The stages, in order.
+            queue_size (int): The maximum number of jobs waiting for each stage.
+
+        Raises:
+            ValueError: If a stage has fewer than one worker."""
+        for stage in stages:
+            if stage.workers < 1:
+                raise ValueError(f"Stage {stage.name} needs at least one worker")
+
+        self.stages = stages
+        self.queue_size = queue_size
+
+    async def run(
+        self,
+        jobs: collections.abc.Iterable[Job],
+        on_result: collections.abc.Callable[[FileResult], None],
+    ) -> None:
+        """Pass every job through the pipeline.
+
+        Args:
+            jobs (Iterable[Job]): The jobs, consumed lazily in a thread.
+            on_result (Callable[[FileResult], None]): Called with the result of
+                each job as soon as it leaves the last stage."""
+        queues: list[asyncio.Queue[Job | None]] = [
+            asyncio.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+
+        async def feed() -> None:
+            async for job in iterate_in_thread(jobs):
+                await queues[0].put(job)
+            await self._close(queues[0], self.stages[0].workers if self.stages else 1)
+
+        async def collect() -> None:
+            while (job := await queues[-1].get()) is not None:
+                assert job.result is not None, "Job left the pipeline unfinished"
+                on_result(job.result)
+
+        await asyncio.gather(
+            feed(),
+            *(self._run_stage(i, queues) for i in range(len(self.stages))),
+            collect(),
+        )
+
+    async def _run_stage(
+        self, index: int, queues: list[asyncio.Queue[Job | None]]
+    ) -> None:
+        """Run every worker of a stage, then close the queue of the next.
+
+        Args:
+            index (int): The index of the stage.
+            queues (list[asyncio.Queue[Job | None]]): The queue feeding each
+                stage, followed by the queue of finished jobs."""
+        stage = self.stages[index]
+        inbox, outbox = queues[index], queues[index + 1]
+        await asyncio.gather(
+            *(self._work(stage, inbox, outbox) for _ in range(stage.workers))
+        )
+
+        next_workers = 1
+        if index + 1 < len(self.stages):
+            next_workers = self.stages[index + 1].workers
+        await self._close(outbox, next_workers)
+
+    @staticmethod
+    async def _work(
+        stage: Stage,
+        inbox: asyncio.Queue[Job | None],
+        outbox: asyncio.Queue[Job | None],
+    ) -> None:
+        """Process jobs until the inbox is closed.
+
+        Args:
+            stage (Stage): The stage being run.
+            inbox (asyncio.Queue[Job | None]): The jobs waiting for the stage.
+            outbox (asyncio.Queue[Job | None]): The jobs waiting for the next.
+        """
+        while (job := await inbox.get()) is not None:
+            if job.result is None:
+                try:
+                    await stage.function(job)
+                except Exception as e:
+                    job.result = FileResult(file_path=job.file_path, error=e)
+            await outbox.put(job)
+
+    @staticmethod
+    async def _close(queue: asyncio.Queue[Job | None], readers: int) -> None:
+        # Each reader stops after taking one None from the queue.
+        for _ in range(readers):
+            await queue.put(None)
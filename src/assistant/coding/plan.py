@@ -0,0 +1,188 @@
+"""Estimates the requests and tokens of adding docstrings, without sending any."""
+import collections
+import dataclasses
+import pathlib
+
+import tiktoken
+
+from assistant.coding.manifest import ChangeSet
+from assistant.coding.request import DocstringRequest
+from assistant.coding.request import ResponseFormat
+from assistant.coding.skeleton import SkeletonBuilder
+from assistant.conversation.scheduler import MESSAGE_OVERHEAD_TOKENS
+from assistant.model import Router
+
+
+# Tokens generated for each docstring requested, including the signature that
+# code responses repeat, or the name that JSON responses map from.
+COMPLETION_TOKENS_PER_DOCSTRING = {
+    ResponseFormat.CODE: 90,
+    ResponseFormat.JSON: 60,
+}
+
+# Seconds before the model starts to respond to a request.
+REQUEST_LATENCY = 1.0
+
+# Tokens generated per second, by default.
+DEFAULT_GENERATION_RATE = 40.0
+
+
+@dataclasses.dataclass
+class FileEstimate:
+    """The requests and tokens needed to add docstrings to one file.
+
+    Attributes:
+        file_path (pathlib.Path): The file.
+        requests (int): The number of requests that would be sent.
+        prompt_tokens (int): The tokens of every prompt.
+        completion_tokens (int): An estimate of the tokens of every response.
+        error (str | None): Why the file could not be processed, such as a
+            function too large to send, if it couldn't.
+        models (collections.Counter[str]): The number of requests that would
+            be routed to each model, if a router was given."""
+
+    file_path: pathlib.Path
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    error: str | None = None
+    models: collections.Counter[str] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+
+    @classmethod
+    def from_file(
+        cls,
+        file_path: pathlib.Path,
+        tokenizer: tiktoken.Encoding,
+        max_tokens: int,
+        changes: ChangeSet | None = None,
+        skeleton: SkeletonBuilder | None = None,
+        response_format: ResponseFormat = ResponseFormat.CODE,
+        router: Router | None = None,
+    ) -> "FileEstimate":
+        """Build the requests of a file, and count their tokens.
+
+        Prompt tokens are those counted as the chunks were built, so no prompt
+        is tokenized twice. Completion tokens are estimated from the number
+        of docstrings requested.
+
+        Args:
+            file_path (pathlib.Path): The file to estimate.
+            tokenizer (tiktoken.Encoding): The tokenizer used to count tokens.
+            max_tokens (int): The context window of the model.
+            changes (ChangeSet | None): The code that changed, if only it would
+                be requested.
+            skeleton (SkeletonBuilder | None): If given, code would be sent as
+                skeletons rather than as its full source.
+            response_format (ResponseFormat): The format the model would be
+                asked to respond in.
+            router (Router | None): Chooses the model of each request, if
+                given.
+
+        Returns:
+            FileEstimate: The estimate, or the error the file would fail with."""
+        try:
+            request = DocstringRequest.from_file(
+                file_path,
+                tokenizer,
+                max_tokens,
+                changes,
+                skeleton,
+                response_format,
+                router,
+            )
+        except Exception as e:
+            return cls(file_path, error=str(e))
+
+        models = collections.Counter(
+            router.route(chunk.tokens).name
+            for chunk in request.chunks
+            if router is not None
+        )
+        return cls(
+            file_path,
+            requests=len(request.chunks),
+            prompt_tokens=sum(
+                chunk.tokens + MESSAGE_OVERHEAD_TOKENS for chunk in request.chunks
+            ),
+            completion_tokens=(
+                request.requested * COMPLETION_TOKENS_PER_DOCSTRING[response_format]
+            ),
+            models=models,
+        )
+
+
+@dataclasses.dataclass
+class Plan:
+    """The totals of the estimates of many files.
+
+    Attributes:
+        files (int): The number of files estimated.
+        unchanged (int): The number of files with nothing to request.
+        requests (int): The number of requests that would be sent.
+        prompt_tokens (int): The tokens of every prompt.
+        completion_tokens (int): An estimate of the tokens of every response.
+        failures (list[FileEstimate]): The files that could not be processed.
+        models (collections.Counter[str]): The number of requests that would
+            be routed to each model, if a router was given."""
+
+    files: int = 0
+    unchanged: int = 0
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    failures: list[FileEstimate] = dataclasses.field(default_factory=list)
+    models: collections.Counter[str] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+
+    def add(self, estimate: FileEstimate) -> None:
+        """Add the estimate of a file to the totals.
+
+        Args:
+            estimate (FileEstimate): The estimate."""
+        self.files += 1
+        if estimate.error is not None:
+            self.failures.append(estimate)
+        elif not estimate.requests:
+            self.unchanged += 1
+        self.requests += estimate.requests
+        self.prompt_tokens += estimate.prompt_tokens
+        self.completion_tokens += estimate.completion_tokens
+        self.models.update(estimate.models)
+
+    def wall_time(
+        self,
+        concurrency: int,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        generation_rate: float = DEFAULT_GENERATION_RATE,
+    ) -> float:
+        """Project how long sending every request would take.
+
+        Each request takes `REQUEST_LATENCY`, plus the time to generate its
+        response. The run takes as long as its requests do when `concurrency`
+        are in flight at once, or as long as the rate limits make it, whichever
+        is longer. Time spent parsing and applying docstrings is left out.
+
+        Args:
+            concurrency (int): The number of requests in flight at once.
+            requests_per_minute (float | None): The limit of requests per
+                minute, if any.
+            tokens_per_minute (float | None): The limit of tokens per minute,
+                if any.
+            generation_rate (float): The tokens the model generates per second.
+
+        Returns:
+            float: The projected time, in seconds."""
+        busy = (
+            self.requests * REQUEST_LATENCY + self.completion_tokens / generation_rate
+        )
+        bounds = [busy / concurrency]
+        if requests_per_minute:
+            bounds.append(60 * self.requests / requests_per_minute)
+        if tokens_per_minute:
+            tokens = self.prompt_tokens + self.completion_tokens
+            bounds.append(60 * tokens / tokens_per_minute)
+        return max(bounds)
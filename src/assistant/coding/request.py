@@ -0,0 +1,578 @@
+"""Builds docstring requests for the OpenAI model and applies the responses."""
+import collections.abc
+import dataclasses
+import enum
+import json
+import pathlib
+import textwrap
+import typing
+
+import tiktoken
+
+from assistant import metrics
+from assistant.coding.applier import ApplierMode
+from assistant.coding.applier import DocstringApplier
+from assistant.coding.applier import ReplacementDocstringExtractor
+from assistant.coding.iterator import FileIterator
+from assistant.coding.manifest import ChangeSet
+from assistant.coding.model import DocstringNode
+from assistant.coding.model import NodeKind
+from assistant.coding.parsed import ParsedFile
+from assistant.coding.sanitizer import ResponseSanitizer
+from assistant.coding.skeleton import SkeletonBuilder
+from assistant.conversation.model import Message
+from assistant.model import RESPONSE_TOKEN_FRACTION
+from assistant.model import Router
+
+
+DIRECTIVES = [
+    "Add docstrings to this code, where necessary.",
+    "Use the Google docstring convention.",
+]
+
+
+class ResponseFormat(enum.Enum):
+    """How the model is asked to return docstrings.
+
+    CODE responses repeat each signature with its docstring and are parsed as
+    Python. JSON responses map each dotted qualified name to its docstring,
+    which is shorter to generate and cheaper to parse."""
+
+    CODE = enum.auto()
+    JSON = enum.auto()
+
+
+RESPONSE_DIRECTIVES = {
+    ResponseFormat.CODE: [
+        "Elide the code itself. Only return function signatures and docstrings.",
+    ],
+    ResponseFormat.JSON: [
+        "Do not return any code.",
+        "Respond only with a JSON object mapping the dotted name of each class "
+        "and function, such as `Class.method`, to its docstring.",
+    ],
+}
+
+# A response to the docstrings of one scope: either code, or a mapping from
+# dotted names to docstrings.
+Replacement: typing.TypeAlias = str | dict[str, str]
+
+SEPARATOR = "\n\n✂✂✂✂✂✂✂✂✂✂✂\n\n"
+
+
+@dataclasses.dataclass
+class Chunk:
+    """Part of a file that is small enough to be sent in a single request.
+
+    Attributes:
+        prefix (tuple[str, ...]): Path to the scope containing the code in the
+            chunk. Empty for module-level code, `("A",)` for methods of `A`.
+        message (Message): The prompt sent to the model.
+        tokens (int): Number of tokens in the prompt, counted when the chunk
+            was built. For chunks of several pieces, the sum of the tokens of
+            the pieces and the preamble."""
+
+    prefix: tuple[str, ...]
+    message: Message
+    tokens: int = 0
+
+
+@dataclasses.dataclass
+class Piece:
+    """A class or function that is sent to the model as a unit.
+
+    Attributes:
+        qualname (tuple[str, ...]): Path to the node, e.g. `("A", "f")` for
+            method `f` of class `A`.
+        code (str): The dedented code of the node. Classes too large to send
+            whole are reduced to an outline.
+        tokens (int): Number of tokens in `code`.
+        key (str): Identifies the code sent, so that copies of the same node in
+            other places share it."""
+
+    qualname: tuple[str, ...]
+    code: str
+    tokens: int
+    key: str = ""
+
+    @property
+    def prefix(self) -> tuple[str, ...]:
+        """Path to the scope containing the node."""
+        return self.qualname[:-1]
+
+
+@dataclasses.dataclass
+class DocstringRequest:
+    """A request for docstrings covering a single file.
+
+    Large files are split into several chunks, each sent as an independent
+    request. The docstrings from all responses are applied in one pass.
+
+    Attributes:
+        file_path (pathlib.Path): The file the request was built from.
+        source (str): The code of the whole file. Docstrings from the responses
+            are applied to this code.
+        chunks (list[Chunk]): The requests to send. Empty if there is nothing
+            in the file to request.
+        response_format (ResponseFormat): The format the model was asked to
+            respond in.
+        parsed (ParsedFile | None): The parsed source, reused when applying
+            the responses.
+        targets (set[tuple[str, ...]] | None): Paths of the only nodes whose
+            docstrings are applied, if only changed code was sent.
+        requested (int): The number of classes and functions lacking a
+            docstring in the chunks."""
+
+    file_path: pathlib.Path
+    source: str
+    chunks: list[Chunk]
+    response_format: ResponseFormat = ResponseFormat.CODE
+    parsed: ParsedFile | None = None
+    targets: set[tuple[str, ...]] | None = None
+    requested: int = 0
+
+    @classmethod
+    def from_file(
+        cls,
+        file_path: pathlib.Path,
+        tokenizer: tiktoken.Encoding,
+        max_tokens: int,
+        changes: ChangeSet | None = None,
+        skeleton: SkeletonBuilder | None = None,
+        response_format: ResponseFormat = ResponseFormat.CODE,
+        router: Router | None = None,
+    ) -> "DocstringRequest":
+        """Build the request for a single file.
+
+        If the file fits within the prompt budget it is sent whole. Otherwise,
+        its classes and functions are packed into chunks, and classes that are
+        too large on their own are split into their methods.
+
+        With a router, the file and its chunks are sized for the preferred
+        model, and only pieces too large for it are sent on their own, up to
+        `max_tokens`, to be routed to a larger model.
+
+        Args:
+            file_path (pathlib.Path): The path of the file to be processed.
+            tokenizer (tiktoken.Encoding): The tokenizer used to count prompt tokens.
+            max_tokens (int): The context window of the model. Part of it is
+                reserved for the response.
+            changes (ChangeSet | None): The code that changed, since a previous
+                run or a git revision. If given, only changed classes and
+                functions are sent, and only they receive docstrings.
+            skeleton (SkeletonBuilder | None): If given, classes and functions
+                are sent as skeletons rather than as their full source.
+            response_format (ResponseFormat): The format the model is asked
+                to respond in.
+            router (Router | None): Chooses the model of each request, if
+                given.
+
+        Returns:
+            DocstringRequest: The request for the file.
+
+        Raises:
+            Exception: If no docstring nodes are found in the file or if a
+                       single function is too large to process."""
+        file_iterator = FileIterator(file_path)
+        source = file_iterator.text
+        budget = int(max_tokens * (1 - RESPONSE_TOKEN_FRACTION))
+        chunk_budget = budget
+        if router is not None:
+            chunk_budget = min(budget, router.models[0].prompt_budget)
+
+        if changes is not None and changes.is_unchanged(file_path, source):
+            return cls(file_path=file_path, source=source, chunks=[])
+
+        def message(code: str) -> Message:
+            return _message(code, response_format)
+
+        for node in file_iterator.iterate():
+            if changes is None:
+                nodes = node.children
+            else:
+                nodes = changes.changed_nodes(file_path, node)
+
+            # Docstrings for documented nodes would be discarded in KEEP mode.
+            nodes = [child for child in nodes if child.needs_docstrings()]
+            # Only whole modules are sent for their module docstring.
+            module_docstring = changes is None and node.original_docstring is None
+            if not nodes and not module_docstring:
+                return cls(file_path=file_path, source=source, chunks=[])
+
+            if not nodes or (skeleton is None and changes is None):
+                node_text = _pruned_module(node)
+            elif skeleton is not None:
+                node_text = "\n\n".join(skeleton.render(child) for child in nodes)
+            else:
+                node_text = "\n\n".join(_pruned_code(child) for child in nodes)
+
+            whole = message(node_text)
+            if (tokens := count_tokens(tokenizer, whole.content)) < chunk_budget:
+                chunks = [Chunk((), whole, tokens)]
+            else:
+                preamble = count_tokens(tokenizer, message("").content)
+                code_budget = chunk_budget - preamble
+                pieces = split_nodes(
+                    nodes, (), code_budget, tokenizer, skeleton, budget - preamble
+                )
+                chunks = list(_chunks(pieces, code_budget, message, preamble))
+
+            undocumented = undocumented_paths(nodes)
+            return cls(
+                file_path=file_path,
+                source=source,
+                chunks=chunks,
+                response_format=response_format,
+                parsed=file_iterator.parsed,
+                targets=None if changes is None else undocumented,
+                requested=len(undocumented) + module_docstring,
+            )
+
+        raise Exception("No docstring nodes found in file")
+
+    def apply_responses(self, contents: collections.abc.Sequence[str]) -> str:
+        """Apply the docstrings returned by the model to the source.
+
+        Args:
+            contents (Sequence[str]): The content of the model's response to
+                each chunk, in the same order as `chunks`.
+
+        Returns:
+            str: The source code with docstrings added."""
+        return apply_docstrings(
+            self.source, self.replacements(contents), self.parsed, self.targets
+        )
+
+    def replacements(
+        self, contents: collections.abc.Sequence[str]
+    ) -> list[tuple[tuple[str, ...], Replacement]]:
+        """Parse the responses of the model, ready to be applied.
+
+        Args:
+            contents (Sequence[str]): The content of the model's response to
+                each chunk, in the same order as `chunks`.
+
+        Returns:
+            list[tuple[tuple[str, ...], Replacement]]: The code or docstring
+            mapping of each response, paired with the scope it describes."""
+        sanitizer = ResponseSanitizer()
+        replacements: list[tuple[tuple[str, ...], Replacement]] = []
+
+        for chunk, content in zip(self.chunks, contents, strict=True):
+            sanitized = sanitizer.sanitize(content)
+            mapping = None
+            if self.response_format == ResponseFormat.JSON:
+                mapping = parse_mapping(sanitized)
+            # Fall back to parsing code if the model ignored the JSON format.
+            replacements.append(
+                (chunk.prefix, sanitized if mapping is None else mapping)
+            )
+
+        return replacements
+
+
+def load_json_object(content: str) -> dict[str, typing.Any] | None:
+    """Parse a JSON object from a sanitized response.
+
+    Args:
+        content (str): The sanitized response.
+
+    Returns:
+        dict[str, Any] | None: The object, or None if the content is not a
+        JSON object."""
+    try:
+        loaded = json.loads(content)
+    except ValueError:
+        return None
+
+    return loaded if isinstance(loaded, dict) else None
+
+
+def parse_mapping(content: str) -> dict[str, str] | None:
+    """Parse a response mapping dotted names to docstrings.
+
+    Args:
+        content (str): The sanitized response.
+
+    Returns:
+        dict[str, str] | None: The docstring of each name, or None if the
+        content is not a JSON object. Entries that are not strings are dropped.
+    """
+    if (loaded := load_json_object(content)) is None:
+        return None
+
+    return {k: v for k, v in loaded.items() if isinstance(v, str)}
+
+
+def apply_docstrings(
+    source: str,
+    replacements: collections.abc.Iterable[tuple[tuple[str, ...], Replacement]],
+    parsed: ParsedFile | None = None,
+    targets: collections.abc.Container[tuple[str, ...]] | None = None,
+) -> str:
+    """Apply the docstrings from several responses to a file in one pass.
+
+    Args:
+        source (str): The code of the whole file.
+        replacements (Iterable[tuple[tuple[str, ...], Replacement]]): Code or
+            docstring mappings returned by the model, each paired with the path
+            to the scope it describes.
+        parsed (ParsedFile | None): The source, already parsed.
+        targets (Container[tuple[str, ...]] | None): If given, only the
+            nodes with these paths receive docstrings.
+
+    Returns:
+        str: The source code with docstrings added."""
+    extractor = ReplacementDocstringExtractor()
+    for prefix, replacement in replacements:
+        if isinstance(replacement, str):
+            extractor.add(replacement, prefix)
+        else:
+            extractor.add_mapping(replacement, prefix)
+    if targets is not None:
+        extractor.retain(targets)
+
+    applier = DocstringApplier(source, ApplierMode.KEEP, parsed=parsed)
+    return applier.apply_extracted(extractor)
+
+
+def undocumented_paths(
+    nodes: collections.abc.Iterable[DocstringNode], prefix: tuple[str, ...] = ()
+) -> set[tuple[str, ...]]:
+    """Collect the paths of the nodes that lack docstrings, leaving out context.
+
+    Args:
+        nodes (Iterable[DocstringNode]): Nodes defined in the same scope.
+        prefix (tuple[str, ...]): Path to the scope containing the nodes.
+
+    Returns:
+        set[tuple[str, ...]]: The path of each undocumented node, and of each
+        of their undocumented descendants."""
+    paths: set[tuple[str, ...]] = set()
+    for node in nodes:
+        if node.context:
+            continue
+        qualname = (*prefix, _name(node))
+        if node.original_docstring is None:
+            paths.add(qualname)
+        paths |= undocumented_paths(node.children, qualname)
+    return paths
+
+
+def count_tokens(tokenizer: tiktoken.Encoding, text: str) -> int:
+    """Count the tokens of some text.
+
+    Args:
+        tokenizer (tiktoken.Encoding): The tokenizer of the model.
+        text (str): The text.
+
+    Returns:
+        int: The number of tokens."""
+    with metrics.span("tokenize"):
+        return len(tokenizer.encode(text))
+
+
+def _message(code: str, response_format: ResponseFormat) -> Message:
+    """Build the prompt asking for docstrings for a piece of code.
+
+    Args:
+        code (str): The code to document.
+        response_format (ResponseFormat): The format to ask the model for.
+
+    Returns:
+        Message: The prompt."""
+    directives = [*DIRECTIVES, *RESPONSE_DIRECTIVES[response_format]]
+    return Message("user", " ".join(directives) + SEPARATOR + code)
+
+
+def _name(node: DocstringNode) -> str:
+    assert node.kind is not NodeKind.MODULE
+    return node.name
+
+
+def _dedented_code(node: DocstringNode) -> str:
+    """Return the code of a node, dedented as if it were defined at module level.
+
+    Args:
+        node (DocstringNode): A class or function node.
+
+    Returns:
+        str: The dedented code."""
+    # The first line of a source segment does not include its indentation.
+    return textwrap.dedent(" " * node.col_offset + node.code_snippet)
+
+
+def _prune(
+    node: DocstringNode, lines: list[str], first_line: int, drop: bool = False
+) -> None:
+    """Reduce the documented descendants of a node to their signatures.
+
+    Children are processed last to first, so replacing the lines of one child
+    does not move the lines of the children before it.
+
+    Args:
+        node (DocstringNode): The node whose children are pruned.
+        lines (list[str]): Lines of code containing the node, edited in place.
+        first_line (int): The line number of the first of `lines`.
+        drop (bool): Whether to leave out documented children of this node
+            entirely, rather than keeping their signatures."""
+    for child in reversed(node.children):
+        end = child.end_lineno - first_line + 1
+
+        if child.needs_docstrings():
+            _prune(child, lines, first_line)
+        elif drop:
+            del lines[child.first_lineno - first_line : end]
+        elif child.body_lineno > child.lineno:
+            # A body sharing a line with the signature is left as it is.
+            indent = lines[child.lineno - first_line][: child.col_offset]
+            lines[child.body_lineno - first_line : end] = [indent + "    ..."]
+
+
+def _pruned_code(node: DocstringNode) -> str:
+    """Return the code of a node, with documented descendants reduced.
+
+    Args:
+        node (DocstringNode): A class or function node.
+
+    Returns:
+        str: The dedented code of the node. Classes and functions nested within
+        it that are fully documented are reduced to their signatures."""
+    lines = (" " * node.col_offset + node.code_snippet).split("\n")
+    _prune(node, lines, node.lineno)
+    return textwrap.dedent("\n".join(lines))
+
+
+def _pruned_module(module: DocstringNode) -> str:
+    """Return the code of a module, leaving out documented definitions.
+
+    Top-level classes and functions that are fully documented are left out,
+    and documented definitions nested in the rest are reduced to signatures.
+
+    Args:
+        module (DocstringNode): A module node.
+
+    Returns:
+        str: The pruned code of the module."""
+    lines = module.code_snippet.split("\n")
+    _prune(module, lines, 1, drop=True)
+    return "\n".join(lines)
+
+
+def _class_outline(node: DocstringNode) -> str:
+    """Return the code of a class, with its methods and nested classes elided.
+
+    Args:
+        node (DocstringNode): A class node.
+
+    Returns:
+        str: The dedented code of the class, with each child replaced by `...`.
+    """
+    assert node.kind is NodeKind.CLASS
+    lines = _dedented_code(node).split("\n")
+    first_line = node.lineno
+
+    for child in reversed(node.children):
+        start = child.first_lineno - first_line
+        end = child.end_lineno - first_line + 1
+        indent = child.col_offset - node.col_offset
+        lines[start:end] = [" " * indent + "..."]
+
+    return "\n".join(lines)
+
+
+def split_nodes(
+    nodes: collections.abc.Iterable[DocstringNode],
+    prefix: tuple[str, ...],
+    budget: int,
+    tokenizer: tiktoken.Encoding,
+    skeleton: SkeletonBuilder | None = None,
+    max_budget: int | None = None,
+) -> collections.abc.Iterable[Piece]:
+    """Split nodes into pieces of code that each fit within a token budget.
+
+    Nodes that are already fully documented are left out. A class that does
+    not fit on its own is replaced by its outline, and its children are split
+    separately within the scope of the class. Functions and outlines, which
+    can't be split, may use up to `max_budget`.
+
+    Args:
+        nodes (Iterable[DocstringNode]): Nodes defined in the same scope.
+        prefix (tuple[str, ...]): Path to the scope containing the nodes.
+        budget (int): Maximum number of tokens in each piece of code.
+        tokenizer (tiktoken.Encoding): The tokenizer used to count tokens.
+        skeleton (SkeletonBuilder | None): If given, nodes are rendered as
+            skeletons rather than as their full source.
+        max_budget (int | None): Maximum number of tokens in a piece that
+            can't be split, if larger than `budget`.
+
+    Yields:
+        Piece: A piece of code for each node, preceded by the pieces of the
+        children of any class that had to be split.
+
+    Raises:
+        Exception: If a function, or the outline of a class, is too large to
+            fit within the maximum budget."""
+    max_budget = max(budget, max_budget or budget)
+    for node in nodes:
+        if not node.needs_docstrings():
+            continue
+
+        qualname = (*prefix, _name(node))
+        code = skeleton.render(node) if skeleton else _pruned_code(node)
+        tokens = count_tokens(tokenizer, code)
+        key = node.fingerprint()
+
+        if tokens > budget and node.kind is NodeKind.CLASS and node.children:
+            yield from split_nodes(
+                node.children, qualname, budget, tokenizer, skeleton, max_budget
+            )
+            if skeleton is not None:
+                code = skeleton.render(node, children=False)
+            else:
+                code = _class_outline(node)
+            tokens = count_tokens(tokenizer, code)
+            key = f"outline:{key}"
+
+        if tokens > max_budget:
+            raise Exception(f"Node {'.'.join(qualname)} too large to process.")
+
+        yield Piece(qualname=qualname, code=code, tokens=tokens, key=key)
+
+
+def _chunks(
+    pieces: collections.abc.Iterable[Piece],
+    budget: int,
+    message: collections.abc.Callable[[str], Message],
+    preamble: int = 0,
+) -> collections.abc.Iterable[Chunk]:
+    """Greedily group consecutive pieces from the same scope into chunks.
+
+    Args:
+        pieces (Iterable[Piece]): The pieces to group.
+        budget (int): Maximum number of code tokens in each chunk.
+        message (Callable[[str], Message]): Builds the prompt for some code.
+        preamble (int): Number of tokens in the prompt around the code.
+
+    Yields:
+        Chunk: Chunks containing every piece, in order."""
+    group: list[Piece] = []
+    used = 0
+
+    def chunk() -> Chunk:
+        code = "\n\n".join(p.code for p in group)
+        # No blank line follows the last piece.
+        return Chunk(group[0].prefix, message(code), preamble + used - 1)
+
+    for piece in pieces:
+        # Allow one token for the blank lines separating pieces.
+        tokens = piece.tokens + 1
+        if group and (piece.prefix != group[0].prefix or used + tokens > budget):
+            yield chunk()
+            group, used = [], 0
+
+        group.append(piece)
+        used += tokens
+
+    if group:
+        yield chunk()
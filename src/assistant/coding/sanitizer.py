@@ -1,5 +1,20 @@
+import collections.abc
+
+from assistant import metrics
+
+
+CODE_FENCE = "```"
+
+DELIMITER = "✂"
+
+
 class ResponseSanitizer:
-    """Sanitize the response from the OpenAI."""
+    """Sanitize the response from the OpenAI.
+
+    A whole response can be sanitized with `sanitize`. A response that is
+    still streaming can instead be fed to `feed` a chunk at a time: code
+    between fences is passed on as soon as each line is complete, and only
+    text that may still be discarded is held back until `close`."""
 
     def __init__(self) -> None:
         """Initializes the ResponseSanitizer class."""
@@ -7,22 +22,35 @@ class ResponseSanitizer:
             self._extract_code,
             self._extract_delimited,
         ]
+        self._reset()
+
+    def _reset(self) -> None:
+        """Forget any response being fed incrementally."""
+        # The last, incomplete line of the chunks fed so far.
+        self._partial = ""
+        # Every line, kept until the first line of code shows whether the
+        # response has any.
+        self._held: list[str] | None = []
+        self._in_fence = False
+        # Whether code lines start with a delimiter, once the first is seen.
+        self._delimited: bool | None = None
+        self._started = False
 
     @staticmethod
-    def _extract_code(content: str) -> str:
-        """Extracts code from the content.
+    def _extract_code(lines: list[str]) -> list[str]:
+        """Extracts code from the lines of the content.
 
         Args:
-            content (str): The text content from which to extract the code.
+            lines (list[str]): The lines from which to extract the code.
 
         Returns:
-            str: Extracted code if present, else returns the content as is."""
-        lines = content.split("\n")
+            list[str]: Lines of extracted code if present, else the lines as
+            they are."""
         extracting = False
         code_lines: list[str] = []
 
         for line in lines:
-            if line.startswith("```"):
+            if line.startswith(CODE_FENCE):
                 extracting = not extracting
                 continue
 
@@ -30,22 +58,23 @@ class ResponseSanitizer:
                 code_lines.append(line)
 
         if code_lines:
-            return "\n".join(code_lines)
+            return code_lines
 
-        return content
+        return lines
 
     @staticmethod
-    def _extract_delimited(content: str) -> str:
-        """Extracts text between delimiters from the content.
+    def _extract_delimited(lines: list[str]) -> list[str]:
+        """Extracts text between delimiters from the lines of the content.
 
         Args:
-            content (str): The text content from which to extract the delimited text.
+            lines (list[str]): The lines from which to extract the delimited
+                text.
 
         Returns:
-            str: Extracted delimited text if present, else returns the content as is."""
-        lines = content.split("\n")
+            list[str]: Lines of extracted delimited text if present, else the
+            lines as they are."""
         extracting = False
-        delimiter = "✂"
+        delimiter = DELIMITER
 
         code_lines: list[str] = []
         for line in lines:
@@ -57,9 +86,9 @@ class ResponseSanitizer:
                 code_lines.append(line)
 
         if code_lines:
-            return "\n".join(code_lines)
+            return code_lines
 
-        return content
+        return lines
 
     def sanitize(self, content: str) -> str:
         """Runs content through all the extractors defined in the class.
@@ -69,7 +98,97 @@ class ResponseSanitizer:
 
         Returns:
             str: The sanitized content."""
-        for extractor in self._extractors:
-            content = extractor(content)
+        with metrics.span("sanitize"):
+            # Split once, and pass lines from one extractor to the next.
+            lines = content.split("\n")
+            for extractor in self._extractors:
+                lines = extractor(lines)
+
+        return "\n".join(lines)
+
+    def feed(self, chunk: str) -> str:
+        """Sanitize the next chunk of a streamed response.
+
+        Args:
+            chunk (str): The next piece of the response.
+
+        Returns:
+            str: The sanitized text that can be output so far. May be empty if
+            the chunk completed no line of code."""
+        *lines, self._partial = (self._partial + chunk).split("\n")
+        return self._join(self._delimit(self._fenced(lines)))
+
+    def close(self) -> str:
+        """Finish sanitizing a streamed response.
+
+        Together with the output of every call to `feed`, this gives the same
+        text as `sanitize` would for the whole response. The one exception is
+        a delimiter in the middle of fenced code, which only takes effect when
+        it is the first line of code.
+
+        Returns:
+            str: The rest of the sanitized text."""
+        lines = self._fenced([self._partial])
+        if self._held is not None:
+            # No code was fenced, so the whole response is delimited at once.
+            lines = self._extract_delimited(self._held)
+        else:
+            lines = self._delimit(lines)
+
+        text = self._join(lines)
+        self._reset()
+        return text
+
+    def _fenced(self, lines: list[str]) -> list[str]:
+        """Pick the lines of code out of complete lines of the response.
 
-        return content
+        Args:
+            lines (list[str]): Lines of the response.
+
+        Returns:
+            list[str]: The lines that are inside code fences."""
+        code_lines: list[str] = []
+        for line in lines:
+            if self._held is not None:
+                self._held.append(line)
+
+            if line.startswith(CODE_FENCE):
+                self._in_fence = not self._in_fence
+            elif self._in_fence:
+                code_lines.append(line)
+                self._held = None
+
+        return code_lines
+
+    def _delimit(self, lines: collections.abc.Iterable[str]) -> list[str]:
+        """Drop delimiters from lines of code, if the code starts with one.
+
+        Args:
+            lines (Iterable[str]): Lines of code.
+
+        Returns:
+            list[str]: The lines to output."""
+        kept: list[str] = []
+        for line in lines:
+            if self._delimited is None:
+                self._delimited = line.startswith(DELIMITER)
+            if not (self._delimited and line.startswith(DELIMITER)):
+                kept.append(line)
+        return kept
+
+    def _join(self, lines: list[str]) -> str:
+        """Join lines of output, continuing any output already returned.
+
+        Args:
+            lines (list[str]): Lines of output.
+
+        Returns:
+            str: The lines, separated by newlines."""
+        if not lines:
+            return ""
+
+        text = "\n".join(lines)
+        if self._started:
+            text = "\n" + text
+        self._started = True
+        return text
@@ -0,0 +1,173 @@
+"""Renders code as compact skeletons, to save prompt tokens."""
+import ast
+import collections.abc
+import copy
+import textwrap
+
+import tiktoken
+
+from assistant import metrics
+from assistant.coding.model import Definition
+from assistant.coding.model import DocstringNode
+
+
+DEFAULT_BODY_TOKENS = 48
+
+# Characters of a body encoded at first for each token of its summary. Code
+# averages three or four characters a token, so one pass is usually enough.
+CHARS_PER_TOKEN = 8
+
+
+def _header(node: Definition) -> list[str]:
+    """Return the `def` or `class` line(s) of a node, without decorators.
+
+    Args:
+        node (Definition): The node.
+
+    Returns:
+        list[str]: The unparsed header, which may span several lines."""
+    stub = copy.copy(node)
+    stub.decorator_list = []
+    stub.body = [ast.Pass()]
+    return ast.unparse(stub).split("\n")[:-1]
+
+
+def _documented(node: Definition) -> bool:
+    """Check whether a node and every definition nested in it has a docstring.
+
+    Args:
+        node (Definition): The node.
+
+    Returns:
+        bool: True if no docstring is missing."""
+    return ast.get_docstring(node) is not None and all(
+        _documented(child) for child in node.body if isinstance(child, Definition)
+    )
+
+
+def _descendants(node: DocstringNode) -> collections.abc.Iterator[DocstringNode]:
+    """Iterate over the nodes nested in a node, at any depth.
+
+    Args:
+        node (DocstringNode): The node.
+
+    Yields:
+        DocstringNode: Each descendant."""
+    for child in node.children:
+        yield child
+        yield from _descendants(child)
+
+
+class SkeletonBuilder:
+    """Renders classes and functions as skeletons for prompting.
+
+    Decorators, signatures, docstrings and class attributes are kept, and
+    nested classes and functions are rendered recursively, except that fully
+    documented ones, and those only sent as context, are reduced to their
+    signatures. Any other
+    statements in a body are summarized by their first `body_tokens` tokens.
+    The skeleton keeps the names and nesting of the original code, so the
+    docstrings in the response can be applied to the original by name.
+
+    Attributes:
+        tokenizer (tiktoken.Encoding): The tokenizer used to cap body summaries.
+        body_tokens (int): Maximum number of tokens in each body summary."""
+
+    def __init__(
+        self, tokenizer: tiktoken.Encoding, body_tokens: int = DEFAULT_BODY_TOKENS
+    ):
+        """Initialize the builder.
+
+        Args:
+            tokenizer (tiktoken.Encoding): The tokenizer used to cap body summaries.
+            body_tokens (int): Maximum number of tokens in each body summary."""
+        self.tokenizer = tokenizer
+        self.body_tokens = body_tokens
+
+    def render(self, node: DocstringNode, children: bool = True) -> str:
+        """Render the skeleton of a class or function.
+
+        Args:
+            node (DocstringNode): The node to render.
+            children (bool): Whether to render nested classes and functions.
+                If False, they are replaced by a single `...`.
+
+        Returns:
+            str: The skeleton, indented as if defined at module level."""
+        assert isinstance(node.ast, Definition)
+        context = {id(n.ast) for n in _descendants(node) if n.context}
+        return "\n".join(self._render(node.ast, "", children, context))
+
+    def _render(
+        self, node: Definition, indent: str, children: bool, context: set[int]
+    ) -> list[str]:
+        lines = self._signature(node, indent)
+        header_length = len(lines)
+        inner = indent + "    "
+
+        body = node.body
+        if (docstring := ast.get_docstring(node)) is not None:
+            lines.extend(textwrap.indent(f'"""{docstring}"""', inner).split("\n"))
+            body = body[1:]
+
+        definitions = [s for s in body if isinstance(s, Definition)]
+        attributes: list[ast.stmt] = []
+        if isinstance(node, ast.ClassDef):
+            attributes = [s for s in body if isinstance(s, ast.Assign | ast.AnnAssign)]
+        others = [s for s in body if s not in definitions and s not in attributes]
+
+        for attribute in attributes:
+            lines.extend(inner + line for line in ast.unparse(attribute).split("\n"))
+
+        if others:
+            lines.extend(self._summarize(others, inner))
+
+        if children:
+            for definition in definitions:
+                if id(definition) in context or _documented(definition):
+                    lines.extend(self._signature(definition, inner))
+                    lines.append(inner + "    ...")
+                else:
+                    lines.extend(self._render(definition, inner, children, context))
+
+        if len(lines) == header_length or (definitions and not children):
+            lines.append(inner + "...")
+
+        return lines
+
+    @staticmethod
+    def _signature(node: Definition, indent: str) -> list[str]:
+        lines = [f"{indent}@{ast.unparse(d)}" for d in node.decorator_list]
+        lines.extend(indent + line for line in _header(node))
+        return lines
+
+    def _summarize(self, statements: list[ast.stmt], indent: str) -> list[str]:
+        """Summarize statements by the first `body_tokens` tokens of their code.
+
+        Args:
+            statements (list[ast.stmt]): The statements to summarize.
+            indent (str): Indentation of the statements.
+
+        Returns:
+            list[str]: The summary, ending in `...` if it was truncated."""
+        # Only as much of a long body is unparsed and encoded as the summary
+        # could need, growing the slice if it holds too few tokens.
+        unparsed = (ast.unparse(s) for s in statements)
+        code = ""
+        limit = max(self.body_tokens, 1) * CHARS_PER_TOKEN
+        while True:
+            while len(code) <= limit and (part := next(unparsed, None)) is not None:
+                code = f"{code}\n{part}" if code else part
+            with metrics.span("tokenize"):
+                tokens = self.tokenizer.encode(code[:limit])
+            if len(code) <= limit or len(tokens) > self.body_tokens:
+                break
+            limit *= 2
+
+        if len(tokens) > self.body_tokens:
+            code = self.tokenizer.decode(tokens[: self.body_tokens])
+            # Prefer to cut at a line boundary, keeping the summary readable.
+            code = code[: code.rfind("\n")] if "\n" in code else code
+            code = f"{code}\n..." if code.strip() else "..."
+
+        return [indent + line for line in code.split("\n")]
@@ -0,0 +1,273 @@
+"""Runs the CPU-bound stages of adding docstrings in a pool of processes."""
+import asyncio
+import collections.abc
+import concurrent.futures
+import dataclasses
+import pathlib
+
+import tiktoken
+
+from assistant.coding.manifest import ChangeSet
+from assistant.coding.packer import PackedFile
+from assistant.coding.plan import FileEstimate
+from assistant.coding.request import DocstringRequest
+from assistant.coding.request import Replacement
+from assistant.coding.request import ResponseFormat
+from assistant.coding.request import apply_docstrings
+from assistant.coding.skeleton import SkeletonBuilder
+from assistant.model import Router
+
+
+@dataclasses.dataclass(frozen=True)
+class TokenizerSpec:
+    """Everything needed to rebuild a tokenizer in another process.
+
+    Encodings can't be pickled, so workers rebuild their own from this. The
+    encodings that tiktoken knows are described by name alone, and loaded by
+    each worker from the same on-disk cache as the main process. Only custom
+    encodings carry their tables.
+
+    Attributes:
+        name (str): The name of the encoding.
+        pat_str (str | None): The regular expression splitting text into
+            words, for custom encodings.
+        mergeable_ranks (dict[bytes, int] | None): The rank of each token,
+            for custom encodings.
+        special_tokens (dict[str, int] | None): The rank of each special
+            token, for custom encodings."""
+
+    name: str
+    pat_str: str | None = None
+    mergeable_ranks: dict[bytes, int] | None = None
+    special_tokens: dict[str, int] | None = None
+
+    @classmethod
+    def from_encoding(cls, encoding: tiktoken.Encoding) -> "TokenizerSpec":
+        """Describe an existing encoding.
+
+        Args:
+            encoding (tiktoken.Encoding): The encoding.
+
+        Returns:
+            TokenizerSpec: The description of the encoding."""
+        if encoding.name in tiktoken.list_encoding_names():
+            return cls(encoding.name)
+        # tiktoken has no public way to read the tables of an encoding.
+        return cls(
+            name=encoding.name,
+            pat_str=encoding._pat_str,
+            mergeable_ranks=encoding._mergeable_ranks,
+            special_tokens=encoding._special_tokens,
+        )
+
+    def build(self) -> tiktoken.Encoding:
+        """Build the encoding.
+
+        Returns:
+            tiktoken.Encoding: The encoding."""
+        if self.pat_str is None or self.mergeable_ranks is None:
+            return tiktoken.get_encoding(self.name)
+        return tiktoken.Encoding(
+            name=self.name,
+            pat_str=self.pat_str,
+            mergeable_ranks=self.mergeable_ranks,
+            special_tokens=self.special_tokens or {},
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class PrepareItem:
+    """Work item describing how to build the prompts for one file.
+
+    Attributes:
+        file_path (pathlib.Path): The file to process.
+        budget (int): The maximum number of tokens a prompt may use, or that
+            a piece of code may use when packing.
+        max_budget (int | None): The maximum number of tokens of a piece of
+            code that can't be split when packing, if larger than `budget`.
+        changes (ChangeSet | None): The code that changed, reduced to this
+            file.
+        body_tokens (int | None): If given, code is sent as skeletons with
+            bodies summarized in at most this many tokens.
+        response_format (ResponseFormat): The format the model is asked to
+            respond in.
+        router (Router | None): Chooses the model of each request, if given."""
+
+    file_path: pathlib.Path
+    budget: int
+    changes: ChangeSet | None
+    body_tokens: int | None
+    response_format: ResponseFormat
+    router: Router | None = None
+    max_budget: int | None = None
+
+
+# Files sent to a worker at once when estimating, which are quick to process.
+ESTIMATE_CHUNK_SIZE = 16
+
+# The tokenizer of each worker process, built once when the worker starts.
+_tokenizer: tiktoken.Encoding | None = None
+
+
+def _initialize(spec: TokenizerSpec) -> None:
+    global _tokenizer
+    _tokenizer = spec.build()
+
+
+def _worker_tokenizer() -> tiktoken.Encoding:
+    assert _tokenizer is not None, "Worker was not initialized"
+    return _tokenizer
+
+
+def _skeleton(item: PrepareItem) -> SkeletonBuilder | None:
+    if item.body_tokens is None:
+        return None
+    return SkeletonBuilder(_worker_tokenizer(), item.body_tokens)
+
+
+def prepare_request(item: PrepareItem) -> DocstringRequest:
+    """Build the request for a file in a worker process.
+
+    Args:
+        item (PrepareItem): The file and how to prompt for it.
+
+    Returns:
+        DocstringRequest: The request, without its syntax tree."""
+    request = DocstringRequest.from_file(
+        item.file_path,
+        _worker_tokenizer(),
+        item.budget,
+        item.changes,
+        _skeleton(item),
+        item.response_format,
+        item.router,
+    )
+    request.parsed = None
+    return request
+
+
+def prepare_packed(item: PrepareItem) -> PackedFile:
+    """Collect the pieces of a file to pack, in a worker process.
+
+    Args:
+        item (PrepareItem): The file and how to prompt for it.
+
+    Returns:
+        PackedFile: The file and its pieces, without its syntax tree."""
+    packed_file = PackedFile.from_file(
+        item.file_path,
+        _worker_tokenizer(),
+        item.budget,
+        item.changes,
+        _skeleton(item),
+        item.max_budget,
+    )
+    packed_file.parsed = None
+    return packed_file
+
+
+def estimate(item: PrepareItem) -> FileEstimate:
+    """Estimate the requests and tokens of a file, in a worker process.
+
+    Args:
+        item (PrepareItem): The file and how to prompt for it.
+
+    Returns:
+        FileEstimate: The estimate."""
+    return FileEstimate.from_file(
+        item.file_path,
+        _worker_tokenizer(),
+        item.budget,
+        item.changes,
+        _skeleton(item),
+        item.response_format,
+        item.router,
+    )
+
+
+class WorkerPool:
+    """A pool of processes for parsing, tokenizing and applying docstrings.
+
+    Work items and results are plain data, so no syntax trees or tokenizers
+    are sent between processes. Use as a context manager to shut the pool
+    down when finished.
+
+    Attributes:
+        jobs (int): The number of worker processes.
+        executor (concurrent.futures.ProcessPoolExecutor): The pool."""
+
+    def __init__(self, jobs: int, tokenizer: tiktoken.Encoding):
+        """Start the pool.
+
+        Args:
+            jobs (int): The number of worker processes.
+            tokenizer (tiktoken.Encoding): The tokenizer each worker rebuilds."""
+        self.jobs = jobs
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_initialize,
+            initargs=(TokenizerSpec.from_encoding(tokenizer),),
+        )
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.executor.shutdown(cancel_futures=True)
+
+    async def prepare_request(self, item: PrepareItem) -> DocstringRequest:
+        """Build the request for a file in a worker.
+
+        Args:
+            item (PrepareItem): The file and how to prompt for it.
+
+        Returns:
+            DocstringRequest: The request, without its syntax tree."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, prepare_request, item)
+
+    async def prepare_packed(self, item: PrepareItem) -> PackedFile:
+        """Collect the pieces of a file to pack, in a worker.
+
+        Args:
+            item (PrepareItem): The file and how to prompt for it.
+
+        Returns:
+            PackedFile: The file and its pieces, without its syntax tree."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, prepare_packed, item)
+
+    def estimate(
+        self, items: collections.abc.Iterable[PrepareItem]
+    ) -> collections.abc.Iterator[FileEstimate]:
+        """Estimate the requests and tokens of many files in the workers.
+
+        Args:
+            items (Iterable[PrepareItem]): The files and how to prompt for them.
+
+        Yields:
+            FileEstimate: The estimate of each file, in order."""
+        yield from self.executor.map(estimate, items, chunksize=ESTIMATE_CHUNK_SIZE)
+
+    async def apply(
+        self,
+        source: str,
+        replacements: list[tuple[tuple[str, ...], Replacement]],
+        targets: set[tuple[str, ...]] | None = None,
+    ) -> str:
+        """Apply docstrings to a file in a worker.
+
+        Args:
+            source (str): The code of the whole file.
+            replacements (list[tuple[tuple[str, ...], Replacement]]): Code or
+                docstring mappings returned by the model, each paired with the
+                path to the scope it describes.
+            targets (set[tuple[str, ...]] | None): If given, only the nodes
+                with these paths receive docstrings.
+
+        Returns:
+            str: The source code with docstrings added."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, apply_docstrings, source, replacements, None, targets
+        )
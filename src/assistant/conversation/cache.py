@@ -0,0 +1,191 @@
+"""Persistent, content-addressed cache of chat completion responses."""
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+import typing
+
+from assistant import metrics
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def default_cache_dir() -> pathlib.Path:
+    """Return the directory in which the cache is stored by default.
+
+    Returns:
+        pathlib.Path: `$XDG_CACHE_HOME/assistant`, falling back to
+        `~/.cache/assistant`."""
+    cache_home = os.getenv("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(cache_home) / "assistant"
+
+
+class ResponseCache:
+    """SQLite-backed cache of responses from the chat completions API.
+
+    Responses are keyed by a hash of everything that determines the request:
+    the model, the messages and any extra model arguments such as the
+    temperature. Entries older than `max_age` seconds are discarded, and the
+    least recently used entries are evicted once the stored responses exceed
+    `max_bytes`.
+
+    Attributes:
+        path (pathlib.Path): The SQLite database holding the cache.
+        max_bytes (int): Maximum total size of the stored responses.
+        max_age (float): Maximum age of an entry, in seconds.
+        hits (int): Number of lookups that found a cached response.
+        misses (int): Number of lookups that did not."""
+
+    def __init__(
+        self,
+        cache_dir: pathlib.Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        """Initialize the cache. The database is only opened when first used.
+
+        Args:
+            cache_dir (pathlib.Path): Directory in which to store the cache.
+            max_bytes (int): Maximum total size of the stored responses.
+            max_age (float): Maximum age of an entry, in seconds."""
+        self.path = cache_dir / "responses.sqlite3"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._connection: sqlite3.Connection | None = None
+        self._size = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection to the cache database, created on first access."""
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, isolation_level=None)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed"
+                " ON responses (accessed)"
+            )
+            self.evict()
+        return self._connection
+
+    @staticmethod
+    def key(
+        model: str,
+        messages: list[dict[str, str]],
+        model_args: dict[str, typing.Any],
+    ) -> str:
+        """Compute the cache key for a request.
+
+        Args:
+            model (str): The model the request is sent to.
+            messages (list[dict[str, str]]): The serialized conversation.
+            model_args (dict[str, Any]): Extra arguments to the model.
+
+        Returns:
+            str: Hex digest identifying the request."""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "model_args": model_args},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> dict[str, typing.Any] | None:
+        """Look up a cached response.
+
+        Args:
+            key (str): The cache key of the request.
+
+        Returns:
+            dict[str, Any] | None: The cached response, or None if there is no
+            fresh entry for the key."""
+        now = time.time()
+        row = self.connection.execute(
+            "SELECT response FROM responses WHERE key = ? AND created >= ?",
+            (key, now - self.max_age),
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            metrics.count("cache_misses")
+            return None
+
+        self.hits += 1
+        metrics.count("cache_hits")
+        self.connection.execute(
+            "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+        )
+        return typing.cast(dict[str, typing.Any], json.loads(row[0]))
+
+    def put(self, key: str, response: dict[str, typing.Any]) -> None:
+        """Store a response, evicting entries if the cache grows past
+        `max_bytes`.
+
+        The total size of the cache is tracked as entries are stored, so the
+        table is only scanned when eviction is needed.
+
+        Args:
+            key (str): The cache key of the request.
+            response (dict[str, Any]): The response to store."""
+        now = time.time()
+        serialized = json.dumps(response, ensure_ascii=False)
+        connection = self.connection
+        replaced = connection.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (key, serialized, len(serialized), now, now),
+        )
+        self._size += len(serialized) - (replaced[0] if replaced else 0)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove expired entries, then the least recently used entries until
+        the cache fits within `max_bytes`.
+
+        This runs when the database is opened and whenever a stored response
+        takes the cache past `max_bytes`."""
+        connection = self.connection
+        connection.execute(
+            "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+        )
+
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        self._size = total
+        if total <= self.max_bytes:
+            return
+
+        rows = connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._size = total
+
+    def close(self) -> None:
+        """Close the connection to the database, if it was opened."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
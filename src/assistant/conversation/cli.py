@@ -1,10 +1,13 @@
 import dataclasses
+import typing
 
 import click
 
 from assistant.cli import AppContext
-from assistant.conversation.model import Conversation
-from assistant.conversation.model import Message
+
+
+if typing.TYPE_CHECKING:
+    from assistant.conversation.model import Conversation
 
 
 @dataclasses.dataclass
@@ -17,7 +20,7 @@ class ConversationContext:
             operates the interaction."""
 
     app: AppContext
-    conversation: Conversation
+    conversation: "Conversation"
 
 
 @click.command()
@@ -28,8 +31,20 @@ class ConversationContext:
     multiple=True,
     help="Prompt to include in this",
 )
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Print the response as it arrives, instead of once it is complete.",
+)
+@click.option(
+    "--extract-code",
+    is_flag=True,
+    help="Print only the code in the response.",
+)
 @click.pass_context
-def converse(ctx: click.Context, prompt: list[tuple[str, str]]) -> None:
+def converse(
+    ctx: click.Context, prompt: list[tuple[str, str]], stream: bool, extract_code: bool
+) -> None:
     """Converse with ChatGPT.
 
     The Chat completions API is stateless, so every request must include the
@@ -51,7 +66,15 @@ def converse(ctx: click.Context, prompt: list[tuple[str, str]]) -> None:
         user: How are you?
         assistant: I'm doing well, thanks!
 
+    With `--stream`, the response is printed as it is generated, so the first
+    words appear without waiting for the rest. `--extract-code` still works
+    while streaming: code is printed a line at a time as its fence fills.
+
     """
+    from assistant.coding.sanitizer import ResponseSanitizer
+    from assistant.conversation.model import Conversation
+    from assistant.conversation.model import Message
+
     messages: list[Message] = []
 
     for message_type, content in prompt:
@@ -65,6 +88,8 @@ def converse(ctx: click.Context, prompt: list[tuple[str, str]]) -> None:
     conversation = Conversation(
         model=app_ctx.model,
         messages=messages,
+        cache=app_ctx.cache,
+        scheduler=app_ctx.scheduler,
         temperature=app_ctx.temperature,
     )
 
@@ -73,5 +98,13 @@ def converse(ctx: click.Context, prompt: list[tuple[str, str]]) -> None:
         conversation=conversation,
     )
 
-    response = conversation.request()
-    print(response.choices[0].message.content)
+    sanitizer = ResponseSanitizer() if extract_code else None
+
+    if not stream:
+        content = conversation.request().choices[0].message.content
+        print(sanitizer.sanitize(content) if sanitizer else content)
+        return
+
+    for delta in conversation.stream():
+        print(sanitizer.feed(delta) if sanitizer else delta, end="", flush=True)
+    print(sanitizer.close() if sanitizer else "")
@@ -1,8 +1,34 @@
+import collections.abc
+import contextlib
 import dataclasses
 import typing
 
+import aiohttp
 import openai
 import openai.openai_object
+import openai.util
+
+from assistant import metrics
+from assistant.conversation.cache import ResponseCache
+from assistant.conversation.scheduler import RequestScheduler
+
+
+@contextlib.asynccontextmanager
+async def shared_session() -> collections.abc.AsyncIterator[None]:
+    """Send every asynchronous request made within the context over one session.
+
+    Otherwise, the openai library opens a new HTTP session, and so a new
+    connection, for every asynchronous request."""
+    if openai.aiosession.get() is not None:
+        yield
+        return
+
+    async with aiohttp.ClientSession() as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield
+        finally:
+            openai.aiosession.reset(token)
 
 
 @dataclasses.dataclass
@@ -23,12 +49,17 @@ class Conversation:
     Attributes:
         model (str): The openai model to be used for conversation.
         messages (list[Message]): List of `Message` instances to start conversation with.
-        model_args (dict): Extra arguments to the model."""
+        model_args (dict): Extra arguments to the model.
+        cache (ResponseCache | None): Cache of previous responses, if any.
+        scheduler (RequestScheduler | None): Paces and retries requests, if
+            given."""
 
     def __init__(
         self,
         model: str,
         messages: list[Message],
+        cache: ResponseCache | None = None,
+        scheduler: RequestScheduler | None = None,
         **kwargs: typing.Any,
     ):
         """Initialize conversation with provided model, messages, and extra args.
@@ -36,27 +67,209 @@ class Conversation:
         Args:
             model (str): The openai model to be used for the conversation.
             messages (list[Message]): List of `Message` instances to start the conversation with.
+            cache (ResponseCache | None): Cache of previous responses. Identical
+                requests are answered from the cache instead of the API.
+            scheduler (RequestScheduler | None): Paces requests to stay within
+                rate limits, and retries them when they are limited.
             **kwargs: Extra arguments to the model"""
         self.model = model
         self.messages = messages
+        self.cache = cache
+        self.scheduler = scheduler
         self.model_args = kwargs
 
-    def request(self) -> openai.openai_object.OpenAIObject:
+    def request(self, tokens: int | None = None) -> openai.openai_object.OpenAIObject:
         """Send a request to the openai API for the conversation and return the response.
 
+        Args:
+            tokens (int | None): The tokens of the content of the messages, if
+                they were already counted. The scheduler counts them otherwise.
+
+        Returns:
+            openai.openai_object.OpenAIObject: The response from the openai API after providing the conversation.
+        """
+        message_dicts = self._message_dicts()
+        if (cached := self._cached(message_dicts)) is not None:
+            return cached
+
+        def create() -> openai.openai_object.OpenAIObject:
+            return typing.cast(
+                openai.openai_object.OpenAIObject,
+                openai.ChatCompletion.create(  # type: ignore
+                    model=self.model,
+                    messages=message_dicts,
+                    **self.model_args,
+                ),
+            )
+
+        with metrics.span("request"):
+            if self.scheduler is None:
+                estimated = 0
+                response = create()
+            else:
+                estimated = self.scheduler.estimate(message_dicts, tokens)
+                response = self.scheduler.call(create, estimated)
+        self._record_usage(estimated, response)
+
+        self._store(message_dicts, response)
+        return response
+
+    async def arequest(
+        self, tokens: int | None = None
+    ) -> openai.openai_object.OpenAIObject:
+        """Asynchronous counterpart of `request`.
+
+        Args:
+            tokens (int | None): The tokens of the content of the messages, if
+                they were already counted. The scheduler counts them otherwise.
+
         Returns:
             openai.openai_object.OpenAIObject: The response from the openai API after providing the conversation.
         """
-        message_dicts = [dataclasses.asdict(m) for m in self.messages]
+        message_dicts = self._message_dicts()
+        if (cached := self._cached(message_dicts)) is not None:
+            return cached
+
+        async def create() -> openai.openai_object.OpenAIObject:
+            return typing.cast(
+                openai.openai_object.OpenAIObject,
+                await openai.ChatCompletion.acreate(  # type: ignore
+                    model=self.model,
+                    messages=message_dicts,
+                    **self.model_args,
+                ),
+            )
+
+        with metrics.span("request"):
+            if self.scheduler is None:
+                estimated = 0
+                response = await create()
+            else:
+                estimated = self.scheduler.estimate(message_dicts, tokens)
+                response = await self.scheduler.acall(create, estimated)
+        self._record_usage(estimated, response)
+
+        self._store(message_dicts, response)
+        return response
+
+    def stream(self) -> collections.abc.Iterator[str]:
+        """Send a request for the conversation, yielding the response as it arrives.
+
+        The assembled response is cached once the stream finishes, and a cached
+        response is yielded as a single piece.
+
+        Yields:
+            str: Each piece of the content of the response, in order."""
+        message_dicts = self._message_dicts()
+        if (cached := self._cached(message_dicts)) is not None:
+            yield cached.choices[0].message.content
+            return
+
+        def create() -> collections.abc.Iterator[openai.openai_object.OpenAIObject]:
+            return typing.cast(
+                collections.abc.Iterator[openai.openai_object.OpenAIObject],
+                openai.ChatCompletion.create(  # type: ignore
+                    model=self.model,
+                    messages=message_dicts,
+                    stream=True,
+                    **self.model_args,
+                ),
+            )
+
+        if self.scheduler is None:
+            chunks = create()
+        else:
+            # Streamed responses report no usage, so the estimate stands.
+            chunks = self.scheduler.call(create, self.scheduler.estimate(message_dicts))
+
+        content: list[str] = []
+        finish_reason = None
+        for chunk in chunks:
+            choice = chunk.choices[0]
+            if delta := choice.delta.get("content"):
+                content.append(delta)
+                yield delta
+            finish_reason = choice.get("finish_reason") or finish_reason
+
+        response = openai.util.convert_to_openai_object(  # type: ignore
+            {
+                "object": "chat.completion",
+                "model": self.model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(content)},
+                        "finish_reason": finish_reason,
+                    }
+                ],
+            }
+        )
+        self._store(message_dicts, response)
+
+    def _record_usage(
+        self, estimated: int, response: openai.openai_object.OpenAIObject
+    ) -> None:
+        """Record how many tokens a request really used.
+
+        Args:
+            estimated (int): The tokens reserved for the request.
+            response (openai.openai_object.OpenAIObject): The response, whose
+                usage includes the tokens of the completion."""
+        if (usage := response.get("usage")) is None:
+            return
+
+        metrics.count("prompt_tokens", usage["prompt_tokens"])
+        metrics.count("completion_tokens", usage["completion_tokens"])
+        if self.scheduler is not None:
+            self.scheduler.record_usage(estimated, usage["total_tokens"])
+
+    def _message_dicts(self) -> list[dict[str, str]]:
+        """Serialize the messages into the format expected by the openai API.
+
+        Returns:
+            list[dict[str, str]]: One dictionary per message."""
+        return [dataclasses.asdict(m) for m in self.messages]
+
+    def _cached(
+        self, message_dicts: list[dict[str, str]]
+    ) -> openai.openai_object.OpenAIObject | None:
+        """Look up the response to this conversation in the cache.
+
+        Args:
+            message_dicts (list[dict[str, str]]): The serialized messages.
+
+        Returns:
+            openai.openai_object.OpenAIObject | None: The cached response, or
+            None if there is no cache or no entry for this conversation."""
+        if self.cache is None:
+            return None
+
+        key = self.cache.key(self.model, message_dicts, self.model_args)
+        if (cached := self.cache.get(key)) is None:
+            return None
+
         return typing.cast(
             openai.openai_object.OpenAIObject,
-            openai.ChatCompletion.create(  # type: ignore
-                model=self.model,
-                messages=message_dicts,
-                **self.model_args,
-            ),
+            openai.util.convert_to_openai_object(cached),  # type: ignore
         )
 
+    def _store(
+        self,
+        message_dicts: list[dict[str, str]],
+        response: openai.openai_object.OpenAIObject,
+    ) -> None:
+        """Store a response to this conversation in the cache, if there is one.
+
+        Args:
+            message_dicts (list[dict[str, str]]): The serialized messages.
+            response (openai.openai_object.OpenAIObject): The response to store.
+        """
+        if self.cache is None:
+            return
+
+        key = self.cache.key(self.model, message_dicts, self.model_args)
+        self.cache.put(key, response.to_dict_recursive())  # type: ignore
+
     def add_message(self, message: Message) -> None:
         """Append a new message to the list of messages in the conversation.
 
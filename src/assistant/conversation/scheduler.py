@@ -0,0 +1,332 @@
+"""Paces requests to stay within the API's rate limits, retrying when limited."""
+import asyncio
+import collections.abc
+import random
+import time
+import typing
+
+import openai.error
+import tiktoken
+
+from assistant import metrics
+
+
+T = typing.TypeVar("T")
+
+DEFAULT_MAX_RETRIES = 6
+
+DEFAULT_BASE_DELAY = 1.0
+
+DEFAULT_MAX_DELAY = 60.0
+
+# Tokens added by the API for each message, on top of its content.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Errors that are worth retrying, because they say nothing about the request.
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+class Budget:
+    """Allowance of some quantity per minute, refilled continuously.
+
+    Reservations may overdraw the budget. The overdraft is repaid by waiting,
+    so that on average usage stays at the limit.
+
+    Attributes:
+        per_minute (float): The limit per minute."""
+
+    def __init__(
+        self,
+        per_minute: float,
+        clock: collections.abc.Callable[[], float] = time.monotonic,
+    ):
+        """Initialize a full budget.
+
+        Args:
+            per_minute (float): The limit per minute.
+            clock (Callable[[], float]): Returns the current time in seconds."""
+        self.per_minute = per_minute
+        self._clock = clock
+        self._available = per_minute
+        self._updated = clock()
+
+    def reserve(self, amount: float) -> float:
+        """Take an amount from the budget.
+
+        Args:
+            amount (float): The amount to take.
+
+        Returns:
+            float: Seconds to wait before using the amount, to stay within the
+            limit."""
+        now = self._clock()
+        rate = self.per_minute / 60
+        self._available = min(
+            self.per_minute, self._available + (now - self._updated) * rate
+        )
+        self._updated = now
+        self._available -= amount
+        return max(0.0, -self._available / rate)
+
+    def adjust(self, amount: float) -> None:
+        """Take an extra amount from the budget, without waiting for it.
+
+        Args:
+            amount (float): The amount to take. Negative amounts are returned
+                to the budget."""
+        self._available = min(self.per_minute, self._available - amount)
+
+
+class RequestScheduler:
+    """Schedules requests to run at, but not above, the API's rate limits.
+
+    Each request reserves one request and its estimated tokens from the
+    per-minute budgets, waiting if they are overdrawn. Requests that fail with
+    a rate limit or transient error are retried with jittered exponential
+    backoff, or after the delay given by the `Retry-After` header.
+
+    The number of concurrent requests adapts to the API: it is halved
+    whenever a request is rate limited, and grows by one after a full round of
+    successful requests, as long as latency has not risen well above its best.
+
+    Attributes:
+        requests (Budget | None): Budget of requests per minute, if limited.
+        tokens (Budget | None): Budget of tokens per minute, if limited.
+        max_concurrency (int): The most requests ever run at once.
+        max_retries (int): The number of times a request is retried.
+        base_delay (float): The backoff before the first retry, in seconds.
+        max_delay (float): The longest backoff between retries, in seconds.
+        tokenizer (tiktoken.Encoding | None): Used to estimate the tokens of a
+            request. If None, four characters are counted as one token.
+        rate_limited (int): The number of requests that were rate limited.
+        retries (int): The number of retries made."""
+
+    def __init__(
+        self,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        max_concurrency: int = 8,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        tokenizer: tiktoken.Encoding | None = None,
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            requests_per_minute (int | None): The limit of requests per
+                minute, or None if requests are not limited.
+            tokens_per_minute (int | None): The limit of tokens per minute, or
+                None if tokens are not limited.
+            max_concurrency (int): The most requests ever run at once.
+            max_retries (int): The number of times a request is retried.
+            base_delay (float): The backoff before the first retry, in seconds.
+            max_delay (float): The longest backoff between retries, in seconds.
+            tokenizer (tiktoken.Encoding | None): Used to estimate the tokens
+                of a request."""
+        self.requests = Budget(requests_per_minute) if requests_per_minute else None
+        self.tokens = Budget(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.tokenizer = tokenizer
+        self.rate_limited = 0
+        self.retries = 0
+
+        self._limit = float(max_concurrency)
+        self._in_flight = 0
+        self._best_latency: float | None = None
+        self._paused_until = 0.0
+        self._condition: asyncio.Condition | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def concurrency(self) -> int:
+        """The number of requests currently allowed to run at once."""
+        return max(1, min(self.max_concurrency, int(self._limit)))
+
+    def estimate(
+        self,
+        messages: collections.abc.Collection[dict[str, str]],
+        content_tokens: int | None = None,
+    ) -> int:
+        """Estimate the number of prompt tokens in a request.
+
+        Args:
+            messages (Collection[dict[str, str]]): The serialized messages.
+            content_tokens (int | None): The tokens of the content of the
+                messages, if they were already counted. Otherwise they are
+                counted here.
+
+        Returns:
+            int: The estimated number of tokens."""
+        if content_tokens is not None:
+            return content_tokens + MESSAGE_OVERHEAD_TOKENS * len(messages)
+
+        tokens = 0
+        for message in messages:
+            content = message["content"]
+            if self.tokenizer is not None:
+                tokens += len(self.tokenizer.encode(content))
+            else:
+                tokens += len(content) // 4
+            tokens += MESSAGE_OVERHEAD_TOKENS
+        return tokens
+
+    def record_usage(self, estimated: int, used: int) -> None:
+        """Correct the token budget once the actual usage of a request is known.
+
+        Args:
+            estimated (int): The tokens reserved for the request.
+            used (int): The tokens the request actually used, including those
+                of the response."""
+        if self.tokens is not None:
+            self.tokens.adjust(used - estimated)
+
+    def call(self, func: collections.abc.Callable[[], T], tokens: int) -> T:
+        """Make a request, waiting for the budget and retrying on failure.
+
+        Args:
+            func (Callable[[], T]): Makes the request.
+            tokens (int): The estimated tokens of the request.
+
+        Returns:
+            T: The result of `func`."""
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self._reserve(tokens))
+            started = time.monotonic()
+            try:
+                result = func()
+            except RETRYABLE_ERRORS as e:
+                time.sleep(self._failed(e, attempt))
+            else:
+                self._succeeded(time.monotonic() - started)
+                return result
+
+        raise AssertionError("Unreachable: the last attempt raises")
+
+    async def acall(
+        self,
+        func: collections.abc.Callable[[], collections.abc.Awaitable[T]],
+        tokens: int,
+    ) -> T:
+        """Asynchronous counterpart of `call`, also limiting concurrency.
+
+        Args:
+            func (Callable[[], Awaitable[T]]): Makes the request.
+            tokens (int): The estimated tokens of the request.
+
+        Returns:
+            T: The result of `func`."""
+        condition = self._get_condition()
+
+        for attempt in range(self.max_retries + 1):
+            async with condition:
+                await condition.wait_for(lambda: self._in_flight < self.concurrency)
+                self._in_flight += 1
+
+            try:
+                await asyncio.sleep(self._reserve(tokens))
+                started = time.monotonic()
+                result = await func()
+            except RETRYABLE_ERRORS as e:
+                delay = self._failed(e, attempt)
+            else:
+                self._succeeded(time.monotonic() - started)
+                return result
+            finally:
+                async with condition:
+                    self._in_flight -= 1
+                    condition.notify_all()
+
+            await asyncio.sleep(delay)
+
+        raise AssertionError("Unreachable: the last attempt raises")
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Conditions belong to an event loop, and a scheduler may outlive one.
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    def _reserve(self, tokens: int) -> float:
+        """Reserve a request from the budgets.
+
+        Args:
+            tokens (int): The estimated tokens of the request.
+
+        Returns:
+            float: Seconds to wait before sending the request."""
+        delay = self._paused_until - time.monotonic()
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return max(0.0, delay)
+
+    def _failed(self, error: Exception, attempt: int) -> float:
+        """Record a failed attempt, and work out how long to wait before retrying.
+
+        Args:
+            error (Exception): The error raised by the attempt.
+            attempt (int): The number of attempts made before this one.
+
+        Returns:
+            float: Seconds to wait before retrying.
+
+        Raises:
+            Exception: The error, if no retries are left."""
+        if attempt >= self.max_retries:
+            raise error
+
+        self.retries += 1
+        metrics.count("retries")
+        backoff = min(self.max_delay, self.base_delay * 2**attempt)
+        delay = random.uniform(backoff / 2, backoff)
+
+        if isinstance(error, openai.error.RateLimitError):
+            self.rate_limited += 1
+            metrics.count("rate_limited")
+            self._limit = max(1.0, min(self._limit, self.max_concurrency) / 2)
+            if (retry_after := _retry_after(error)) is not None:
+                delay = retry_after + random.uniform(0, self.base_delay)
+            # Hold back every request, not just this one, until the limit resets.
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+        return delay
+
+    def _succeeded(self, latency: float) -> None:
+        """Record a successful request, growing concurrency if the API keeps up.
+
+        Args:
+            latency (float): How long the request took, in seconds."""
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+
+        if latency <= 2 * self._best_latency:
+            self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+
+
+def _retry_after(error: openai.error.OpenAIError) -> float | None:
+    """Read the delay requested by the `Retry-After` header of an error.
+
+    Args:
+        error (openai.error.OpenAIError): The error.
+
+    Returns:
+        float | None: The delay in seconds, or None if there isn't one."""
+    headers = error.headers or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
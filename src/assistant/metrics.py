@@ -0,0 +1,188 @@
+"""Records where a run spends its time and tokens, for the --metrics option.
+
+Instrumented code calls `span` and `count`, which do nothing unless metrics
+were started with `start`. Work done in worker processes is not recorded,
+other than as the time the main process spends waiting for it."""
+import collections
+import collections.abc
+import contextlib
+import dataclasses
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+import typing
+
+
+@dataclasses.dataclass
+class SpanStats:
+    """Totals of every span of one name.
+
+    Attributes:
+        count (int): The number of spans.
+        wall (float): Total wall-clock time, in seconds.
+        cpu (float): Total CPU time of the thread, in seconds. Includes any
+            other task the thread ran while the span was open.
+        max_wall (float): The longest wall-clock time of a single span."""
+
+    count: int = 0
+    wall: float = 0.0
+    cpu: float = 0.0
+    max_wall: float = 0.0
+
+
+class Metrics:
+    """Timings of named spans and totals of named counters.
+
+    Attributes:
+        started (float): When recording started, from `time.perf_counter`.
+        spans (dict[str, SpanStats]): The totals of each span.
+        counters (dict[str, int]): The total of each counter.
+        events (list[dict[str, typing.Any]] | None): Every span, as events in
+            the Trace Event Format, if tracing."""
+
+    def __init__(self, trace: bool = False):
+        """Start recording.
+
+        Args:
+            trace (bool): Whether to keep every span, rather than just totals."""
+        self.started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self.spans: dict[str, SpanStats] = collections.defaultdict(SpanStats)
+        self.counters: dict[str, int] = collections.defaultdict(int)
+        self.events: list[dict[str, typing.Any]] | None = [] if trace else None
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> collections.abc.Iterator[None]:
+        """Time a span of work.
+
+        Args:
+            name (str): The name of the span. Spans of the same name are added
+                up."""
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - wall
+            stats = self.spans[name]
+            stats.count += 1
+            stats.wall += elapsed
+            stats.cpu += time.thread_time() - cpu
+            stats.max_wall = max(stats.max_wall, elapsed)
+
+            if self.events is not None:
+                self.events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": (wall - self.started) * 1e6,
+                        "dur": elapsed * 1e6,
+                        "pid": os.getpid(),
+                        "tid": _track(),
+                    }
+                )
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (int): The amount to add."""
+        self.counters[name] += value
+
+    def summary(self) -> dict[str, typing.Any]:
+        """Summarize the metrics.
+
+        Returns:
+            dict[str, Any]: The total wall-clock and CPU time, the totals of
+            each span, and the counters."""
+        return {
+            "wall": time.perf_counter() - self.started,
+            "cpu": time.process_time() - self._cpu_started,
+            "spans": {
+                name: dataclasses.asdict(stats)
+                for name, stats in sorted(self.spans.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def write(self, path: pathlib.Path) -> None:
+        """Write the metrics to a JSON file.
+
+        If tracing, the file is in the Trace Event Format, which can be opened
+        by Perfetto or `chrome://tracing`, with the summary under `summary`.
+
+        Args:
+            path (pathlib.Path): The file to write."""
+        data: dict[str, typing.Any] = self.summary()
+        if self.events is not None:
+            data = {"traceEvents": self.events, "summary": data}
+        path.write_text(json.dumps(data, indent=1))
+
+
+def _track() -> int:
+    """Identify the track a span is drawn on in a trace.
+
+    Spans of concurrent asyncio tasks overlap, so each task gets its own
+    track. Otherwise, spans are drawn on the track of their thread.
+
+    Returns:
+        int: The identifier of the track."""
+    # Only look for a task if asyncio is in use, as it is slow to import.
+    if (asyncio := sys.modules.get("asyncio")) is not None:
+        try:
+            if (task := asyncio.current_task()) is not None:
+                return id(task)
+        except RuntimeError:
+            pass
+    return threading.get_ident()
+
+
+_metrics: Metrics | None = None
+
+# Returned by `span` when not recording. It can be entered any number of times.
+_DISABLED = contextlib.nullcontext()
+
+
+def start(trace: bool = False) -> Metrics:
+    """Start recording metrics in this process.
+
+    Args:
+        trace (bool): Whether to keep every span, rather than just totals.
+
+    Returns:
+        Metrics: The metrics being recorded."""
+    global _metrics
+    _metrics = Metrics(trace)
+    return _metrics
+
+
+def stop() -> None:
+    """Stop recording metrics in this process."""
+    global _metrics
+    _metrics = None
+
+
+def span(name: str) -> contextlib.AbstractContextManager[None]:
+    """Time a span of work, if recording.
+
+    Args:
+        name (str): The name of the span.
+
+    Returns:
+        AbstractContextManager[None]: Context manager timing the span."""
+    if _metrics is None:
+        return _DISABLED
+    return _metrics.span(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add to a counter, if recording.
+
+    Args:
+        name (str): The name of the counter.
+        value (int): The amount to add."""
+    if _metrics is not None:
+        _metrics.count(name, value)
@@ -1,16 +1,168 @@
-MAX_TOKENS = {
-    "gpt-4": 8192,
-    "gpt-4-0613": 8192,
-    "gpt-4-32k": 32768,
-    "gpt-4-32k-0613": 32768,
-    "gpt-4-0314": 8192,
-    "gpt-4-32k-0314": 32768,
-    "gpt-3.5-turbo": 4096,
-    "gpt-3.5-turbo-16k": 16384,
-    "gpt-3.5-turbo-0613": 4096,
-    "gpt-3.5-turbo-16k-0613": 16384,
-    "gpt-3.5-turbo-0301": 4096,
-    "text-davinci-003": 4097,
-    "text-davinci-002": 4097,
-    "code-davinci-002": 8001,
+"""What each model can do, and which model each request is sent to."""
+import collections.abc
+import dataclasses
+import enum
+
+
+# Fraction of the context window left free for the model's response.
+RESPONSE_TOKEN_FRACTION = 0.5
+
+
+@dataclasses.dataclass(frozen=True)
+class ModelInfo:
+    """The capabilities and costs of a model.
+
+    Attributes:
+        name (str): The name of the model in the API.
+        context_window (int): The tokens of prompt and response together that
+            the model can handle.
+        latency (float): Time taken by a request, relative to gpt-3.5-turbo.
+        cost (float): Price of a token, relative to gpt-3.5-turbo.
+        requests_per_minute (int | None): The usual limit of requests per
+            minute, if known. Requests are paced to it with
+            `--model-rate-limits`.
+        tokens_per_minute (int | None): The usual limit of tokens per minute,
+            if known. Requests are paced to it with `--model-rate-limits`.
+        larger (str | None): The model of the same family with a larger
+            context window, if any. Requests too large for this model are
+            routed to it."""
+
+    name: str
+    context_window: int
+    latency: float = 1.0
+    cost: float = 1.0
+    requests_per_minute: int | None = None
+    tokens_per_minute: int | None = None
+    larger: str | None = None
+
+    @property
+    def prompt_budget(self) -> int:
+        """The most tokens a prompt may use, leaving room for the response."""
+        return int(self.context_window * (1 - RESPONSE_TOKEN_FRACTION))
+
+
+MODELS = {
+    info.name: info
+    for info in [
+        ModelInfo("gpt-4", 8192, 3.0, 20.0, 200, 40_000, "gpt-4-32k"),
+        ModelInfo("gpt-4-0613", 8192, 3.0, 20.0, 200, 40_000, "gpt-4-32k-0613"),
+        ModelInfo("gpt-4-0314", 8192, 3.0, 20.0, 200, 40_000, "gpt-4-32k-0314"),
+        ModelInfo("gpt-4-32k", 32768, 3.5, 40.0, 200, 80_000),
+        ModelInfo("gpt-4-32k-0613", 32768, 3.5, 40.0, 200, 80_000),
+        ModelInfo("gpt-4-32k-0314", 32768, 3.5, 40.0, 200, 80_000),
+        ModelInfo("gpt-3.5-turbo", 4096, 1.0, 1.0, 3500, 90_000, "gpt-3.5-turbo-16k"),
+        ModelInfo("gpt-3.5-turbo-16k", 16384, 1.2, 2.0, 3500, 180_000),
+        ModelInfo(
+            "gpt-3.5-turbo-0613",
+            4096,
+            1.0,
+            1.0,
+            3500,
+            90_000,
+            "gpt-3.5-turbo-16k-0613",
+        ),
+        ModelInfo("gpt-3.5-turbo-16k-0613", 16384, 1.2, 2.0, 3500, 180_000),
+        ModelInfo("gpt-3.5-turbo-0301", 4096, 1.0, 1.0, 3500, 90_000),
+        ModelInfo("text-davinci-003", 4097, 2.0, 13.3, 3000, 250_000),
+        ModelInfo("text-davinci-002", 4097, 2.0, 13.3, 3000, 250_000),
+        ModelInfo("code-davinci-002", 8001, 2.0, 13.3, 3000, 250_000),
+    ]
 }
+
+
+def model_info(name: str) -> ModelInfo:
+    """Look up a model in the registry.
+
+    Args:
+        name (str): The name of the model.
+
+    Returns:
+        ModelInfo: The capabilities of the model.
+
+    Raises:
+        ValueError: If the model is not in the registry."""
+    try:
+        return MODELS[name]
+    except KeyError:
+        raise ValueError(f"Unknown model {name}.") from None
+
+
+class RoutingPolicy(enum.Enum):
+    """How the models that a request fits are chosen between.
+
+    COST prefers the cheapest model, and LATENCY the fastest. OFF sends every
+    request to the one model asked for."""
+
+    COST = enum.auto()
+    LATENCY = enum.auto()
+    OFF = enum.auto()
+
+
+@dataclasses.dataclass(frozen=True)
+class Router:
+    """Sends each request to the first model, in order of preference, it fits.
+
+    Small requests go to a fast, cheap model, and only those too large for it
+    go to a model with a larger context window. Requests too large for every
+    model go to the largest, and fail there.
+
+    Attributes:
+        models (tuple[ModelInfo, ...]): The models to choose between, in order
+            of preference."""
+
+    models: tuple[ModelInfo, ...]
+
+    @classmethod
+    def for_model(
+        cls,
+        name: str,
+        routes: collections.abc.Sequence[str] = (),
+        policy: RoutingPolicy = RoutingPolicy.COST,
+    ) -> "Router":
+        """Build the router for a model.
+
+        Args:
+            name (str): The model asked for.
+            routes (Sequence[str]): The models to route between. By default,
+                the model asked for and the larger models of its family.
+            policy (RoutingPolicy): How to order the models.
+
+        Returns:
+            Router: The router.
+
+        Raises:
+            ValueError: If any of the models is not in the registry."""
+        if policy is RoutingPolicy.OFF:
+            return cls((model_info(name),))
+
+        names = list(routes)
+        if not names:
+            names = [name]
+            while (larger := model_info(names[-1]).larger) and larger not in names:
+                names.append(larger)
+
+        models = [model_info(n) for n in dict.fromkeys(names)]
+        if policy is RoutingPolicy.COST:
+            models.sort(key=lambda m: (m.cost, m.latency, m.context_window))
+        else:
+            models.sort(key=lambda m: (m.latency, m.cost, m.context_window))
+        return cls(tuple(models))
+
+    @property
+    def max_tokens(self) -> int:
+        """The largest context window of any of the models."""
+        return max(model.context_window for model in self.models)
+
+    def route(self, prompt_tokens: int) -> ModelInfo:
+        """Choose the model for a prompt.
+
+        Args:
+            prompt_tokens (int): The number of tokens in the prompt.
+
+        Returns:
+            ModelInfo: The first model whose prompt budget fits the prompt, or
+            the model with the largest budget if none does."""
+        for model in self.models:
+            if prompt_tokens <= model.prompt_budget:
+                return model
+        return max(self.models, key=lambda m: m.prompt_budget)
@@ -0,0 +1,223 @@
+"""Server that keeps the CLI loaded, so that each command skips starting up."""
+import collections.abc
+import contextlib
+import io
+import json
+import os
+import pathlib
+import socketserver
+import traceback
+
+import click
+
+from assistant.cli import RESOURCES_KEY
+from assistant.cli import Resources
+from assistant.client import connect
+from assistant.client import default_socket_path
+from assistant.client import is_forwarded
+
+
+class OutputStream(io.TextIOBase):
+    """Text stream sending everything written to it to a client.
+
+    Attributes:
+        name (str): The stream of the client to write to, `stdout` or
+            `stderr`."""
+
+    def __init__(self, name: str, connection: io.BufferedIOBase):
+        """Initialize the stream.
+
+        Args:
+            name (str): The stream of the client to write to.
+            connection (io.BufferedIOBase): The connection to the client."""
+        self.name = name
+        self._connection = connection
+
+    encoding = "utf-8"
+
+    def writable(self) -> bool:
+        """Report that the stream can be written to."""
+        return True
+
+    def write(self, text: str) -> int:
+        """Send some text to the client straight away.
+
+        Args:
+            text (str): The text to write.
+
+        Returns:
+            int: The number of characters written.
+
+        Raises:
+            TypeError: If given bytes rather than text."""
+        # Click probes whether a stream is binary by writing empty bytes to it.
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        if text:
+            self._connection.write(json.dumps({self.name: text}).encode() + b"\n")
+            self._connection.flush()
+        return len(text)
+
+
+class CommandServer(socketserver.UnixStreamServer):
+    """Runs commands sent by clients, one at a time, in this process.
+
+    Commands are handled one at a time because they change the working
+    directory and the standard streams of the process.
+
+    Attributes:
+        command (click.Command): The command line to run.
+        resources (Resources): Shared by every command that is run."""
+
+    def __init__(
+        self, socket_path: pathlib.Path, command: click.Command, resources: Resources
+    ):
+        """Start listening.
+
+        Args:
+            socket_path (pathlib.Path): The socket on which to listen.
+            command (click.Command): The command line to run.
+            resources (Resources): Shared by every command that is run."""
+        super().__init__(str(socket_path), CommandHandler)
+        self.command = command
+        self.resources = resources
+
+    def server_bind(self) -> None:
+        """Bind the socket so that only the current user can connect to it."""
+        umask = os.umask(0o077)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def run(
+        self,
+        argv: list[str],
+        stdout: OutputStream,
+        stderr: OutputStream,
+        env: dict[str, str] | None = None,
+    ) -> int:
+        """Run one command, as if from the command line.
+
+        Args:
+            argv (list[str]): The arguments of the command.
+            stdout (OutputStream): Receives the standard output.
+            stderr (OutputStream): Receives the standard error.
+            env (dict[str, str] | None): The forwarded variables of the
+                environment of the client, used while the command runs.
+
+        Returns:
+            int: The exit code of the command."""
+        with (
+            contextlib.redirect_stdout(stdout),
+            contextlib.redirect_stderr(stderr),
+            _environment(env),
+        ):
+            try:
+                ctx = self.command.make_context("assistant", argv)
+                ctx.meta[RESOURCES_KEY] = self.resources
+                with ctx.scope():
+                    self.command.invoke(ctx)
+            except click.exceptions.Exit as e:
+                return e.exit_code
+            except click.ClickException as e:
+                e.show()
+                return e.exit_code
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+            except click.Abort:
+                click.echo("Aborted!", err=True)
+                return 1
+            except Exception:
+                traceback.print_exc()
+                return 1
+
+        return 0
+
+
+@contextlib.contextmanager
+def _environment(env: dict[str, str] | None) -> collections.abc.Iterator[None]:
+    """Use the forwarded variables of a client, restoring the environment
+    afterwards.
+
+    Forwarded variables that the client doesn't set are unset, so that the
+    command doesn't pick up the server's credentials or settings.
+
+    Args:
+        env (dict[str, str] | None): The forwarded variables, or None to leave
+            the environment as it is."""
+    if env is None:
+        yield
+        return
+    saved = dict(os.environ)
+    for name in saved:
+        if is_forwarded(name):
+            del os.environ[name]
+    os.environ.update({name: v for name, v in env.items() if is_forwarded(name)})
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """Handles the connection of one client, which sends a single command."""
+
+    server: CommandServer
+
+    def handle(self) -> None:
+        """Run the command of the client, relaying its output and exit code."""
+        request = json.loads(self.rfile.readline())
+        os.chdir(request["cwd"])
+
+        stdout = OutputStream("stdout", self.wfile)
+        stderr = OutputStream("stderr", self.wfile)
+        exit_code = self.server.run(request["argv"], stdout, stderr, request.get("env"))
+
+        self.wfile.write(json.dumps({"exit": exit_code}).encode() + b"\n")
+
+
+@click.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),  # type: ignore
+    help="Socket on which to listen for commands.",
+    default=default_socket_path,
+    show_default="$ASSISTANT_SOCKET or $XDG_RUNTIME_DIR/assistant.sock",
+)
+@click.pass_context
+def serve(ctx: click.Context, socket_path: pathlib.Path) -> None:
+    """Keep the assistant loaded, to run commands without starting up.
+
+    While the server is running, other invocations of `assistant` send their
+    command to it over a Unix socket and print its output. They skip loading
+    libraries and tokenizers, and reuse the server's open caches, rate limit
+    schedulers and connections to the API, so each command takes little more
+    than its requests to the model. Set `ASSISTANT_NO_SERVER` to run a command
+    without the server.
+
+    """
+    # Only the current user may be able to replace the socket or connect to it.
+    socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    try:
+        connection = connect(socket_path)
+    except PermissionError as e:
+        raise click.ClickException(str(e)) from e
+    if connection is not None:
+        connection.close()
+        raise click.ClickException(f"A server is already listening on {socket_path}.")
+    # Left behind by a server that didn't shut down cleanly.
+    socket_path.unlink(missing_ok=True)
+
+    root = ctx.find_root()
+    server = CommandServer(socket_path, root.command, root.meta[RESOURCES_KEY])
+    click.echo(f"Listening on {socket_path}.", err=True)
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        socket_path.unlink(missing_ok=True)
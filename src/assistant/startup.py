@@ -0,0 +1,142 @@
+"""Measures where the time goes while the command line starts up."""
+import builtins
+import collections
+import collections.abc
+import contextlib
+import importlib.util
+import sys
+import time
+import types
+import typing
+
+
+# The option of the command line asking for a report.
+PROFILE_OPTION = "--startup-profile"
+
+# The number of imports listed in the report.
+REPORTED_IMPORTS = 10
+
+
+class StartupProfile:
+    """Times imports and named phases from the moment it is created.
+
+    Only imports through `import` statements are timed, and only those that
+    load a module for the first time. Each import is timed including the
+    imports it triggers, so the times of nested imports overlap.
+
+    Attributes:
+        started (float): When profiling started, from `time.perf_counter`.
+        imports (dict[str, float]): The time taken by each import, in seconds.
+        phases (dict[str, float]): The time taken by each phase, in seconds."""
+
+    def __init__(self) -> None:
+        """Start profiling."""
+        self.started = time.perf_counter()
+        self.imports: dict[str, float] = {}
+        self.phases: dict[str, float] = collections.defaultdict(float)
+        self._import = builtins.__import__
+        self._depth = 0
+        self._outermost = 0.0
+        builtins.__import__ = self._timed_import
+
+    def stop(self) -> None:
+        """Stop timing imports."""
+        builtins.__import__ = self._import
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> collections.abc.Iterator[None]:
+        """Time a phase of starting up.
+
+        Args:
+            name (str): The name of the phase. Time spent in phases of the same
+                name is added up."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - started
+
+    def report(self) -> str:
+        """Summarize the profile.
+
+        Returns:
+            str: The total time, the time spent in imports and in each phase,
+            and the slowest imports."""
+        total = time.perf_counter() - self.started
+        slowest = sorted(self.imports.items(), key=lambda i: i[1], reverse=True)
+
+        lines = ["Startup profile:", _row("total", total)]
+        lines.append(_row("imports", self._outermost))
+        lines.extend(_row(f"  {name}", t) for name, t in slowest[:REPORTED_IMPORTS])
+        lines.extend(_row(name, t) for name, t in self.phases.items())
+        return "\n".join(lines)
+
+    def _timed_import(
+        self,
+        name: str,
+        globals: collections.abc.Mapping[str, object] | None = None,
+        locals: collections.abc.Mapping[str, object] | None = None,
+        fromlist: collections.abc.Sequence[str] | None = (),
+        level: int = 0,
+    ) -> types.ModuleType:
+        """Import a module like `__import__`, timing it if it is not loaded yet.
+
+        Args:
+            name (str): The name of the module.
+            globals (Mapping[str, object] | None): The globals of the
+                importer.
+            locals (Mapping[str, object] | None): The locals of the importer.
+            fromlist (Sequence[str] | None): The names imported from the
+                module.
+            level (int): The number of parent packages of a relative import.
+
+        Returns:
+            types.ModuleType: The imported module."""
+        module = name
+        if level:
+            package = typing.cast(str, (globals or {}).get("__package__"))
+            module = importlib.util.resolve_name("." * level + name, package)
+        if module in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        started = time.perf_counter()
+        self._depth += 1
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            elapsed = time.perf_counter() - started
+            self.imports[module] = self.imports.get(module, 0.0) + elapsed
+            if self._depth == 0:
+                self._outermost += elapsed
+
+
+_profile: StartupProfile | None = None
+
+
+def start() -> StartupProfile:
+    """Start profiling this process, unless it already is.
+
+    Returns:
+        StartupProfile: The profile of this process."""
+    global _profile
+    if _profile is None:
+        _profile = StartupProfile()
+    return _profile
+
+
+def phase(name: str) -> contextlib.AbstractContextManager[None]:
+    """Time a phase of starting up, if this process is being profiled.
+
+    Args:
+        name (str): The name of the phase.
+
+    Returns:
+        AbstractContextManager[None]: Context manager timing the phase."""
+    if _profile is None:
+        return contextlib.nullcontext()
+    return _profile.phase(name)
+
+
+def _row(name: str, seconds: float) -> str:
+    return f"  {name:<40} {seconds * 1000:8.1f} ms"
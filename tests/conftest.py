@@ -0,0 +1,14 @@
+"""Shared fixtures for the test suite."""
+import pytest
+import tiktoken
+
+
+@pytest.fixture
+def tokenizer() -> tiktoken.Encoding:
+    """Byte-level tokenizer that can be built without downloading a vocabulary."""
+    return tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={"<|endoftext|>": 256},
+    )
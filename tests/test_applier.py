@@ -1,8 +1,12 @@
 import pathlib
 import textwrap
 
+import pytest
+
 from assistant.coding.applier import ApplierMode
 from assistant.coding.applier import DocstringApplier
+from assistant.coding.applier import DocstringSplicer
+from assistant.coding.applier import ReplacementDocstringExtractor
 
 
 data_path = pathlib.Path(__file__).parent / "data"
@@ -50,3 +54,123 @@ def test_docstrings_are_replaced_in_replace_mode() -> None:
     result = applier.apply(patched_text)
 
     assert result.strip() == patched_text.strip()
+
+
+splice_cases = {
+    "plain": """\
+def foo(x):
+    return x
+""",
+    "documented": '''\
+def foo(x):
+    """original"""
+    return x
+''',
+    "multiline_signature": """\
+@decorator(
+    arg=1,
+)
+async def foo(
+    x: int,  # comment
+) -> int:  # trailing
+    # leading comment
+
+    return x
+""",
+    "commented_docstring": '''\
+class Foo:
+    # comment
+
+    """original"""  # trailing
+
+    attribute = 1
+
+    def foo(self):
+        def inner():
+            pass
+
+        return inner
+''',
+    "decorated_first_statement": """\
+class Foo:
+    @property
+    def foo(self):
+        return 1
+""",
+    "nested_blocks": """\
+if True:
+\tclass Foo:
+\t\tdef foo(self):
+\t\t\treturn "ünïcödé"
+""",
+    "one_line_body": """\
+class Foo: pass
+def foo(): return 1
+""",
+    "semicolon": '''\
+def foo():
+    """original"""; return 1
+''',
+}
+
+splice_response = '''\
+"""Module docstring."""
+class Foo:
+    """Patched Foo.
+
+    Attributes:
+        attribute (int): An attribute."""
+    def foo(self):
+        """Patched foo."""
+        def inner():
+            """Patched inner."""
+def foo(x):
+    """Patched foo.
+
+    Args:
+        x: The argument."""
+async def foo(x):
+    """Patched async foo."""
+'''
+
+
+@pytest.mark.parametrize("mode", list(ApplierMode))
+@pytest.mark.parametrize("case", list(splice_cases))
+def test_splicing_matches_transformer(case: str, mode: ApplierMode) -> None:
+    source = splice_cases[case]
+
+    spliced = DocstringApplier(source, mode).apply(splice_response)
+    transformed = DocstringApplier(source, mode, splice=False).apply(splice_response)
+
+    assert spliced == transformed
+
+
+def test_splicing_falls_back_for_tricky_code() -> None:
+    extractor = ReplacementDocstringExtractor()
+    extractor.add(splice_response.split("\n", 1)[1])
+    splicer = DocstringSplicer(
+        extractor.async_function_defs,
+        extractor.function_defs,
+        extractor.classes,
+        None,
+        ApplierMode.REPLACE,
+    )
+
+    for case in (
+        "plain",
+        "documented",
+        "multiline_signature",
+        "decorated_first_statement",
+        "nested_blocks",
+    ):
+        assert splicer.splice(splice_cases[case]) is not None
+    for case in ("one_line_body", "semicolon"):
+        assert splicer.splice(splice_cases[case]) is None
+
+
+def test_splicing_matches_transformer_on_data() -> None:
+    req, res = load_request_and_response("update_inject_class")
+
+    for mode in ApplierMode:
+        spliced = DocstringApplier(req, mode).apply(res)
+        assert spliced == DocstringApplier(req, mode, splice=False).apply(res)
@@ -0,0 +1,66 @@
+import ast
+import pathlib
+
+import openai
+
+from benchmarks.mock_api import DOCSTRING
+from benchmarks.mock_api import MockSettings
+from benchmarks.mock_api import respond
+from benchmarks.mock_api import running
+from benchmarks.synthetic import SHAPES
+from benchmarks.synthetic import generate
+
+
+def test_synthetic_repositories_parse(tmp_path: pathlib.Path) -> None:
+    paths = generate(tmp_path, SHAPES["deep-nesting"].scaled(0.1))
+
+    assert len(paths) == 2
+    tree = ast.parse(paths[0].read_text())
+    classes = {n.name for n in ast.walk(tree) if isinstance(n, ast.ClassDef)}
+    assert "Class0" + "Inner" * 6 in classes
+
+
+def test_mock_response_documents_every_function() -> None:
+    content = respond(
+        "Add docstrings.\n\n✂✂✂✂✂✂✂✂✂✂✂\n\nclass A:\n    def f(self):\n        pass\n"
+    )
+
+    tree = ast.parse(content.strip().strip("`").removeprefix("python"))
+    assert all(
+        ast.get_docstring(node)
+        for node in ast.walk(tree)
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef))
+    )
+
+
+def test_mock_api_answers_and_streams() -> None:
+    with running(MockSettings(stream_chunk=5)) as server:
+        kwargs = {
+            "api_base": server.url,
+            "api_key": "benchmark",
+            "model": "gpt-3.5-turbo",
+            "messages": [{"role": "user", "content": "def f():\n    pass\n"}],
+        }
+        response = openai.ChatCompletion.create(**kwargs)  # type: ignore
+        chunks = list(openai.ChatCompletion.create(stream=True, **kwargs))  # type: ignore
+
+    content = response.choices[0].message.content
+    assert DOCSTRING in content
+    assert response.usage.completion_tokens > 0
+    assert "".join(c.choices[0].delta.get("content", "") for c in chunks) == content
+    assert server.requests == 2
+
+
+def test_mock_api_fails_on_request() -> None:
+    with running(MockSettings(rate_limit_rate=1.0, retry_after=3)) as server:
+        try:
+            openai.ChatCompletion.create(  # type: ignore
+                api_base=server.url,
+                api_key="benchmark",
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": "hi"}],
+            )
+        except openai.error.RateLimitError as e:
+            assert e.headers["Retry-After"] == "3"
+        else:
+            raise AssertionError("Expected a rate limit error.")
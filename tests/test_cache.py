@@ -0,0 +1,112 @@
+import pathlib
+import typing
+
+import openai
+import pytest
+from openai.util import convert_to_openai_object
+
+from assistant.conversation.cache import ResponseCache
+from assistant.conversation.model import Conversation
+from assistant.conversation.model import Message
+
+
+def test_cache_counts_hits_and_misses(tmp_path: pathlib.Path) -> None:
+    cache = ResponseCache(tmp_path)
+    key = cache.key("gpt-4", [{"role": "user", "content": "hi"}], {})
+
+    assert cache.get(key) is None
+    cache.put(key, {"answer": 42})
+    assert cache.get(key) == {"answer": 42}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_key_depends_on_model_args() -> None:
+    messages = [{"role": "user", "content": "hi"}]
+
+    assert ResponseCache.key("gpt-4", messages, {"temperature": 0.0}) != (
+        ResponseCache.key("gpt-4", messages, {"temperature": 1.0})
+    )
+
+
+def test_cache_evicts_least_recently_used(tmp_path: pathlib.Path) -> None:
+    cache = ResponseCache(tmp_path, max_bytes=50)
+    cache.put("a", {"value": "a" * 20})
+    cache.put("b", {"value": "b" * 20})
+    cache.put("c", {"value": "c" * 20})
+
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+
+
+def test_cache_only_evicts_when_full(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    ResponseCache(tmp_path).put("a", {"value": "a" * 20})
+    cache = ResponseCache(tmp_path, max_bytes=80)
+    evictions = 0
+    evict = cache.evict
+
+    def counting_evict() -> None:
+        nonlocal evictions
+        evictions += 1
+        evict()
+
+    monkeypatch.setattr(cache, "evict", counting_evict)
+    # Replacing an entry does not count its old size twice.
+    for _ in range(5):
+        cache.put("b", {"value": "b" * 20})
+    assert evictions == 1  # When the database is opened.
+
+    cache.put("c", {"value": "c" * 20})
+    assert evictions == 2
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+
+
+def test_cache_ignores_expired_entries(tmp_path: pathlib.Path) -> None:
+    cache = ResponseCache(tmp_path, max_age=-1)
+    cache.put("a", {"value": "a"})
+
+    assert cache.get("a") is None
+
+
+def test_conversation_uses_cache(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    calls = 0
+
+    def fake_create(**kwargs: typing.Any) -> typing.Any:
+        nonlocal calls
+        calls += 1
+        return convert_to_openai_object(  # type: ignore
+            {"choices": [{"message": {"content": "hello"}}]}
+        )
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", fake_create)
+
+    cache = ResponseCache(tmp_path)
+    for _ in range(3):
+        conversation = Conversation("gpt-4", [Message("user", "hi")], cache=cache)
+        response = conversation.request()
+        assert response.choices[0].message.content == "hello"
+
+    assert calls == 1
+    assert cache.hits == 2
+
+
+def test_streamed_conversation_is_cached(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fake_create(**kwargs: typing.Any) -> typing.Any:
+        assert kwargs["stream"]
+        for delta in [{"role": "assistant"}, {"content": "hel"}, {"content": "lo"}]:
+            yield convert_to_openai_object({"choices": [{"delta": delta}]})  # type: ignore
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", fake_create)
+
+    cache = ResponseCache(tmp_path)
+    conversation = Conversation("gpt-4", [Message("user", "hi")], cache=cache)
+    assert list(conversation.stream()) == ["hel", "lo"]
+
+    assert conversation.request().choices[0].message.content == "hello"
+    assert cache.hits == 1
@@ -1,5 +1,7 @@
 import pathlib
 
+import pytest
+
 from assistant.coding.iterator import FileIterator
 from assistant.coding.iterator import RepositoryIterator
 
@@ -23,3 +25,32 @@ def test_file_iterator() -> None:
     for clazz in iterator.iterate():
         print(clazz)
         return
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_repository_iterator_skips_ignored_files(
+    tmp_path: pathlib.Path, workers: int
+) -> None:
+    for name in [
+        "main.py",
+        "src/app.py",
+        "src/app_pb2.py",
+        "build/lib/app.py",
+        ".git/hooks/hook.py",
+        "vendor/big.py",
+        "sub/gen/code.py",
+        "sub/keep_pb2.py",
+        "notes.txt",
+    ]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("x = 1\n")
+    (tmp_path / ".gitignore").write_text("build/\n*_pb2.py\n")
+    (tmp_path / "sub" / ".gitignore").write_text("gen/\n!keep_pb2.py\n")
+    (tmp_path / "vendor" / "big.py").write_text("x = 1\n" * 100)
+
+    iterator = RepositoryIterator(
+        tmp_path, exclude=["main.py"], max_file_size=50, workers=workers
+    )
+
+    paths = [p.relative_to(tmp_path).as_posix() for p in iterator.iterate()]
+    assert paths == ["src/app.py", "sub/keep_pb2.py"]
@@ -0,0 +1,125 @@
+import pathlib
+import subprocess
+import textwrap
+
+import tiktoken
+
+from assistant.coding.diff import GitDiff
+from assistant.coding.diff import parse_diff
+from assistant.coding.iterator import RepositoryIterator
+from assistant.coding.request import DocstringRequest
+from assistant.coding.skeleton import SkeletonBuilder
+
+
+original_text = textwrap.dedent(
+    """\
+    def foo():
+        return 1
+
+
+    class Bar:
+        def baz(self):
+            return 2
+
+        def qux(self):
+            return 3
+    """
+)
+
+
+def git(repo: pathlib.Path, *args: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=a", "-c", "user.email=a@b", *args],
+        cwd=repo,
+        check=True,
+        capture_output=True,
+    )
+
+
+def test_hunks_map_to_new_line_numbers(tmp_path: pathlib.Path) -> None:
+    diff = textwrap.dedent(
+        """\
+        diff --git a/a.py b/a.py
+        --- a/a.py
+        +++ b/a.py
+        @@ -3 +3 @@ def f():
+        @@ -10,2 +9,0 @@
+        @@ -20,0 +18,3 @@
+        diff --git a/gone.py b/gone.py
+        --- a/gone.py
+        +++ /dev/null
+        @@ -1,2 +0,0 @@
+        """
+    )
+
+    assert parse_diff(diff, tmp_path) == {
+        tmp_path / "a.py": [(3, 4), (9, 11), (18, 21)]
+    }
+
+
+def test_unusual_file_names_are_read(tmp_path: pathlib.Path) -> None:
+    names = ["a b.py", 'say "hi".py', "tab\there.py"]
+    for name in names:
+        (tmp_path / name).write_text("x = 1\n")
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "Initial")
+
+    for name in names:
+        (tmp_path / name).write_text("x = 2\n")
+    diff = GitDiff.since("HEAD", tmp_path)
+
+    assert diff.files == {tmp_path / name: [(1, 2)] for name in names}
+    assert diff.paths() == sorted(tmp_path / name for name in names)
+
+
+def test_only_changed_methods_are_requested(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text(original_text)
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "Initial")
+
+    file_path.write_text(original_text.replace("return 2", "return 20"))
+    (tmp_path / "new.py").write_text("def new():\n    pass\n")
+    diff = GitDiff.since("HEAD", tmp_path)
+
+    assert list(RepositoryIterator(tmp_path).select(diff.paths())) == [
+        tmp_path / "module.py",
+        tmp_path / "new.py",
+    ]
+
+    request = DocstringRequest.from_file(file_path, tokenizer, 4096, diff)
+    (chunk,) = request.chunks
+    assert "return 20" in chunk.message.content
+    assert "def qux(self):\n        ..." in chunk.message.content
+    assert "def foo" not in chunk.message.content
+    assert request.targets == {("Bar",), ("Bar", "baz")}
+
+    response = textwrap.dedent(
+        '''\
+        ```python
+        class Bar:
+            """Bar."""
+            def baz(self):
+                """Baz."""
+            def qux(self):
+                """Qux."""
+        ```'''
+    )
+    text = request.apply_responses([response])
+    assert '"""Baz."""' in text
+    assert '"""Qux."""' not in text
+
+    new_request = DocstringRequest.from_file(tmp_path / "new.py", tokenizer, 4096, diff)
+    assert new_request.targets == {("new",)}
+
+    # Skeletons, too, reduce unchanged definitions to their signatures.
+    skeleton = SkeletonBuilder(tokenizer)
+    request = DocstringRequest.from_file(file_path, tokenizer, 4096, diff, skeleton)
+    (chunk,) = request.chunks
+    assert "return 20" in chunk.message.content
+    assert "def qux(self):\n        ..." in chunk.message.content
+    assert "return 3" not in chunk.message.content
@@ -0,0 +1,126 @@
+import asyncio
+import pathlib
+import textwrap
+
+import openai.openai_object
+import pytest
+import tiktoken
+from openai.util import convert_to_openai_object
+
+from assistant.coding.engine import DocstringEngine
+from assistant.coding.pipeline import FileResult
+from assistant.coding.request import count_tokens
+from assistant.coding.workers import TokenizerSpec
+from assistant.conversation.model import Conversation
+
+
+response_text = textwrap.dedent(
+    '''\
+    ```python
+    def foo():
+        """patched"""
+    ```
+    '''
+)
+
+
+def test_engine_limits_requests_in_flight(
+    tmp_path: pathlib.Path,
+    tokenizer: tiktoken.Encoding,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_request(
+        self: Conversation, tokens: int | None = None
+    ) -> openai.openai_object.OpenAIObject:
+        nonlocal in_flight, max_in_flight
+        # Prompts are counted once, when their chunks are built.
+        assert tokens == count_tokens(tokenizer, self.messages[0].content)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return convert_to_openai_object(  # type: ignore
+            {"choices": [{"message": {"content": response_text}}]}
+        )
+
+    monkeypatch.setattr(Conversation, "arequest", fake_request)
+
+    paths = []
+    for i in range(10):
+        path = tmp_path / f"module_{i}.py"
+        path.write_text("def foo():\n    pass\n")
+        paths.append(path)
+
+    broken = tmp_path / "broken.py"
+    broken.write_text("def foo(:\n")
+    paths.append(broken)
+
+    results: list[FileResult] = []
+    engine = DocstringEngine("gpt-3.5-turbo", tokenizer, 4096, concurrency=3)
+    failures = asyncio.run(engine.run(paths, results.append))
+
+    assert max_in_flight == 3
+    assert len(results) == len(paths)
+    assert [f.file_path for f in failures] == [broken]
+    assert all(
+        '"""patched"""' in (r.text or "") for r in results if r.file_path != broken
+    )
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_jobs_match_single_process(
+    tmp_path: pathlib.Path,
+    tokenizer: tiktoken.Encoding,
+    monkeypatch: pytest.MonkeyPatch,
+    packed: bool,
+) -> None:
+    async def fake_request(
+        self: Conversation, tokens: int | None = None
+    ) -> openai.openai_object.OpenAIObject:
+        code = self.messages[0].content.split("✂")[-1]
+        content = code.replace("pass", '"""patched"""')
+        return convert_to_openai_object(  # type: ignore
+            {"choices": [{"message": {"content": content}}]}
+        )
+
+    monkeypatch.setattr(Conversation, "arequest", fake_request)
+
+    paths = []
+    for i, text in enumerate(["def foo():\n    pass\n", "def foo(:\n", ""] * 2):
+        path = tmp_path / f"module_{i}.py"
+        path.write_text(text)
+        paths.append(path)
+
+    def run(jobs: int) -> dict[pathlib.Path, FileResult]:
+        results: list[FileResult] = []
+        engine = DocstringEngine(
+            "gpt-3.5-turbo", tokenizer, 4096, concurrency=2, jobs=jobs
+        )
+        run = engine.run_packed if packed else engine.run
+        asyncio.run(run(paths, results.append))
+        return {r.file_path: r for r in results}
+
+    single, pooled = run(1), run(2)
+
+    assert single.keys() == pooled.keys() == set(paths)
+    for path in paths:
+        assert pooled[path].text == single[path].text
+        assert pooled[path].skipped == single[path].skipped
+        assert (pooled[path].error is None) == (single[path].error is None)
+    assert sum('"""patched"""' in (r.text or "") for r in pooled.values()) == 2
+
+
+def test_workers_load_known_encodings_by_name(tokenizer: tiktoken.Encoding) -> None:
+    custom = TokenizerSpec.from_encoding(tokenizer)
+    assert custom.build().encode("def f(): pass") == tokenizer.encode("def f(): pass")
+
+    known = tiktoken.Encoding(
+        name="cl100k_base",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    assert TokenizerSpec.from_encoding(known) == TokenizerSpec("cl100k_base")
@@ -0,0 +1,40 @@
+import pytest
+
+from assistant.coding.ignore import GitIgnore
+from assistant.coding.ignore import GlobPattern
+
+
+@pytest.mark.parametrize(
+    "pattern, path, is_dir, expected",
+    [
+        ("*.py", "a/b/c.py", False, True),
+        ("*.py", "a/b/c.pyc", False, False),
+        ("build/", "src/build", True, True),
+        ("build/", "src/build", False, False),
+        ("/build", "build", True, True),
+        ("/build", "src/build", True, False),
+        ("docs/*.py", "docs/conf.py", False, True),
+        ("docs/*.py", "docs/api/conf.py", False, False),
+        ("**/gen", "a/b/gen", True, True),
+        ("a/**/b.py", "a/b.py", False, True),
+        ("a/**/b.py", "a/x/y/b.py", False, True),
+        ("vendor/**", "vendor/lib/x.py", False, True),
+        ("test_?.py", "test_1.py", False, True),
+        ("[!a]*.py", "a.py", False, False),
+        ("[!a]*.py", "b.py", False, True),
+    ],
+)
+def test_pattern_matches(pattern: str, path: str, is_dir: bool, expected: bool) -> None:
+    parsed = GlobPattern.parse(pattern)
+    assert parsed is not None
+    assert parsed.matches(path, is_dir) == expected
+
+
+def test_last_matching_pattern_wins() -> None:
+    lines = ["# Generated code", "", "*_pb2.py", "!keep_pb2.py"]
+    patterns = [p for p in map(GlobPattern.parse, lines) if p is not None]
+    ignore = GitIgnore(patterns)
+
+    assert ignore.match("api_pb2.py", False) is True
+    assert ignore.match("keep_pb2.py", False) is False
+    assert ignore.match("api.py", False) is None
@@ -1,5 +1,8 @@
 """Test cases for the __main__ module."""
+import typing
+
 import pytest
+import tiktoken
 from click.testing import CliRunner
 
 import assistant.cli
@@ -15,3 +18,45 @@ def test_main_succeeds(runner: CliRunner) -> None:
     """It exits with a status code of zero."""
     result = runner.invoke(assistant.cli.main)
     assert result.exit_code == 0
+
+
+def _app_context(args: list[str]) -> assistant.cli.AppContext:
+    """Run the options of the group, without a command."""
+    callback = assistant.cli.main.callback
+    assert callback is not None
+    ctx = assistant.cli.main.make_context("assistant", [*args, "list-models"])
+    try:
+        with ctx.scope():
+            ctx.invoke(callback, **ctx.params)
+    finally:
+        ctx.close()
+    return typing.cast(assistant.cli.AppContext, ctx.obj)
+
+
+def test_requests_are_not_paced_by_default(
+    monkeypatch: pytest.MonkeyPatch, tokenizer: tiktoken.Encoding
+) -> None:
+    """Only limits that are asked for are kept to."""
+    monkeypatch.setattr(assistant.cli, "load_tokenizer", lambda model: tokenizer)
+    scheduler = _app_context([]).scheduler
+    assert scheduler is not None
+    assert (scheduler.requests, scheduler.tokens) == (None, None)
+
+    scheduler = _app_context(["--model-rate-limits"]).scheduler
+    assert scheduler is not None and scheduler.requests is not None
+    assert scheduler.requests.per_minute == 3500
+    assert scheduler.tokens is not None
+
+    scheduler = _app_context(
+        ["--model-rate-limits", "--requests-per-minute", "0"]
+    ).scheduler
+    assert scheduler is not None and scheduler.tokens is not None
+    assert scheduler.requests is None
+
+
+def test_requests_are_not_routed_by_default() -> None:
+    """Every request goes to --model unless routing is asked for."""
+    assert _app_context([]).router is None
+    router = _app_context(["--routing", "cost"]).router
+    assert router is not None
+    assert [m.name for m in router.models] == ["gpt-3.5-turbo", "gpt-3.5-turbo-16k"]
@@ -0,0 +1,59 @@
+import pathlib
+import textwrap
+
+import tiktoken
+
+from assistant.coding.iterator import FileIterator
+from assistant.coding.manifest import Manifest
+from assistant.coding.request import DocstringRequest
+
+
+original_text = textwrap.dedent(
+    """\
+    def foo():
+        return 1
+
+
+    class Bar:
+        def baz(self):
+            return 2
+    """
+)
+
+
+def test_unchanged_files_are_skipped(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text(original_text)
+
+    manifest = Manifest(tmp_path / "manifest.json")
+    manifest.record(file_path, original_text)
+    manifest.save()
+
+    manifest = Manifest.load(tmp_path / "manifest.json")
+    request = DocstringRequest.from_file(file_path, tokenizer, 4096, manifest)
+
+    assert request.chunks == []
+    assert request.source == original_text
+
+
+def test_only_changed_nodes_are_requested(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    manifest = Manifest(tmp_path / "manifest.json")
+    manifest.record(file_path, original_text)
+
+    changed_text = original_text.replace("return 2", "return 3")
+    file_path.write_text(changed_text)
+
+    (module,) = FileIterator(file_path).iterate()
+    changed = manifest.changed_nodes(file_path, module)
+    assert [node.code_snippet for node in changed] == [module.children[1].code_snippet]
+
+    request = DocstringRequest.from_file(file_path, tokenizer, 4096, manifest)
+    (chunk,) = request.chunks
+    assert "return 3" in chunk.message.content
+    assert "def foo" not in chunk.message.content
+    assert request.source == changed_text
@@ -0,0 +1,36 @@
+import json
+import pathlib
+
+from assistant import metrics
+from assistant.coding.sanitizer import ResponseSanitizer
+
+
+def test_spans_and_counters_are_totalled(tmp_path: pathlib.Path) -> None:
+    recorded = metrics.start(trace=True)
+    try:
+        for _ in range(3):
+            with metrics.span("work"):
+                metrics.count("items", 2)
+        ResponseSanitizer().sanitize("```python\npass\n```")
+    finally:
+        metrics.stop()
+
+    summary = recorded.summary()
+    assert summary["spans"]["work"]["count"] == 3
+    assert summary["spans"]["sanitize"]["count"] == 1
+    assert summary["counters"] == {"items": 6}
+
+    recorded.write(tmp_path / "trace.json")
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    assert [e["name"] for e in trace["traceEvents"]] == ["work"] * 3 + ["sanitize"]
+    assert trace["summary"]["counters"] == {"items": 6}
+
+
+def test_nothing_is_recorded_when_stopped() -> None:
+    recorded = metrics.start()
+    metrics.stop()
+    with metrics.span("work"):
+        metrics.count("items")
+
+    assert recorded.summary()["spans"] == {}
+    assert recorded.summary()["counters"] == {}
@@ -0,0 +1,85 @@
+import pathlib
+
+import pytest
+import tiktoken
+
+from assistant.coding.request import DocstringRequest
+from assistant.coding.request import count_tokens
+from assistant.model import MODELS
+from assistant.model import Router
+from assistant.model import RoutingPolicy
+from assistant.model import model_info
+
+
+def test_router_follows_larger_models() -> None:
+    router = Router.for_model("gpt-3.5-turbo")
+
+    assert [m.name for m in router.models] == ["gpt-3.5-turbo", "gpt-3.5-turbo-16k"]
+    assert router.max_tokens == 16384
+
+
+def test_router_orders_by_policy() -> None:
+    routes = ["gpt-4", "code-davinci-002", "gpt-3.5-turbo"]
+
+    by_cost = Router.for_model("gpt-4", routes, RoutingPolicy.COST)
+    by_latency = Router.for_model("gpt-4", routes, RoutingPolicy.LATENCY)
+    off = Router.for_model("gpt-4", routes, RoutingPolicy.OFF)
+
+    assert [m.name for m in by_cost.models] == [
+        "gpt-3.5-turbo",
+        "code-davinci-002",
+        "gpt-4",
+    ]
+    assert by_latency.models[0].name == "gpt-3.5-turbo"
+    assert by_latency.models[1].latency <= by_latency.models[2].latency
+    assert [m.name for m in off.models] == ["gpt-4"]
+
+
+def test_route_escalates_by_size() -> None:
+    router = Router.for_model("gpt-3.5-turbo")
+    small, large = router.models
+
+    assert router.route(10) is small
+    assert router.route(small.prompt_budget) is small
+    assert router.route(small.prompt_budget + 1) is large
+    # Requests too large for every model go to the largest.
+    assert router.route(10**6) is large
+
+
+def test_unknown_model() -> None:
+    with pytest.raises(ValueError, match="Unknown model"):
+        model_info("gpt-5")
+    with pytest.raises(ValueError, match="Unknown model"):
+        Router.for_model("gpt-4", ["gpt-4", "gpt-5"])
+
+
+def test_larger_models_are_registered() -> None:
+    for info in MODELS.values():
+        if info.larger is not None:
+            assert MODELS[info.larger].context_window > info.context_window
+
+
+def test_only_oversized_pieces_are_routed_to_larger_model(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    path = tmp_path / "module.py"
+    small = "".join(f"def f{i}(x):\n    return x + {i}\n\n\n" for i in range(100))
+    path.write_text(small + "def big():\n" + "    x = 1\n" * 400)
+    router = Router.for_model("gpt-3.5-turbo")
+
+    request = DocstringRequest.from_file(
+        path, tokenizer, router.max_tokens, router=router
+    )
+    (large,) = [c for c in request.chunks if "def big" in c.message.content]
+    small_chunks = [c for c in request.chunks if c is not large]
+
+    # The small functions are chunked for the small model, not sent whole.
+    assert len(small_chunks) > 1
+    assert router.route(count_tokens(tokenizer, large.message.content)).name == (
+        "gpt-3.5-turbo-16k"
+    )
+    for chunk in small_chunks:
+        # Blank lines between pieces are one token for real tokenizers.
+        blank_lines = chunk.message.content.count("\n\n")
+        tokens = count_tokens(tokenizer, chunk.message.content) - blank_lines
+        assert router.route(tokens).name == "gpt-3.5-turbo"
@@ -0,0 +1,283 @@
+import ast
+import asyncio
+import json
+import pathlib
+import textwrap
+
+import openai.openai_object
+import pytest
+import tiktoken
+from openai.util import convert_to_openai_object
+
+from assistant.coding.engine import DocstringEngine
+from assistant.coding.iterator import FileIterator
+from assistant.coding.packer import PackedFile
+from assistant.coding.packer import RequestPacker
+from assistant.coding.packer import parse_sections
+from assistant.coding.pipeline import FileResult
+from assistant.coding.request import ResponseFormat
+from assistant.conversation.model import Conversation
+from assistant.conversation.scheduler import RequestScheduler
+from assistant.model import Router
+
+
+def document(code: str) -> str:
+    """Pretend to be the model: add a docstring to every definition."""
+    tree = ast.parse(code)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef):
+            node.body.insert(0, ast.Expr(ast.Constant(f"Docs for {node.name}.")))
+    return ast.unparse(tree)
+
+
+def test_pieces_from_many_files_share_requests(
+    tmp_path: pathlib.Path,
+    tokenizer: tiktoken.Encoding,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    prompts: list[str] = []
+
+    async def fake_request(
+        self: Conversation, tokens: int | None = None
+    ) -> openai.openai_object.OpenAIObject:
+        prompt = self.messages[0].content
+        prompts.append(prompt)
+        sections = parse_sections(prompt.split("✂")[-1])
+        content = "\n\n".join(
+            f"# id: {ident}\n{document(code)}" for ident, code in sections.items()
+        )
+        return convert_to_openai_object(  # type: ignore
+            {"choices": [{"message": {"content": f"```\n{content}\n```"}}]}
+        )
+
+    monkeypatch.setattr(Conversation, "arequest", fake_request)
+
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"module_{i}.py"
+        path.write_text(
+            textwrap.dedent(
+                f'''\
+                def documented_{i}():
+                    """Already documented."""
+
+
+                def func_{i}(x):
+                    return x + {i}
+
+
+                class Class_{i}:
+                    def method(self):
+                        return {i}
+                '''
+            )
+        )
+        paths.append(path)
+
+    results: list[FileResult] = []
+    engine = DocstringEngine("gpt-3.5-turbo", tokenizer, 4096, concurrency=2)
+    failures = asyncio.run(engine.run_packed(paths, results.append))
+
+    assert failures == []
+    assert len(results) == len(paths)
+    assert len(prompts) < len(paths) / 4
+    assert not any("documented_" in prompt for prompt in prompts)
+
+    for result in results:
+        assert result.text is not None
+        tree = ast.parse(result.text)
+        docstrings = [
+            ast.get_docstring(node)
+            for node in ast.walk(tree)
+            if isinstance(node, ast.FunctionDef | ast.ClassDef)
+        ]
+        assert docstrings == [
+            "Already documented.",
+            f"Docs for func_{paths.index(result.file_path)}.",
+            f"Docs for Class_{paths.index(result.file_path)}.",
+            "Docs for method.",
+        ]
+
+
+def test_json_responses_are_routed_by_id(
+    tmp_path: pathlib.Path,
+    tokenizer: tiktoken.Encoding,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    async def fake_request(
+        self: Conversation, tokens: int | None = None
+    ) -> openai.openai_object.OpenAIObject:
+        sections = parse_sections(self.messages[0].content.split("✂")[-1])
+        content = {
+            ident: {
+                node.name: f"Docs for {node.name}."
+                for node in ast.walk(ast.parse(code))
+                if isinstance(node, ast.FunctionDef | ast.ClassDef)
+            }
+            for ident, code in sections.items()
+        }
+        return convert_to_openai_object(  # type: ignore
+            {"choices": [{"message": {"content": json.dumps(content)}}]}
+        )
+
+    monkeypatch.setattr(Conversation, "arequest", fake_request)
+
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"module_{i}.py"
+        path.write_text(f"def func_{i}(x):\n    return x + {i}\n")
+        paths.append(path)
+
+    results: list[FileResult] = []
+    engine = DocstringEngine(
+        "gpt-3.5-turbo",
+        tokenizer,
+        4096,
+        concurrency=2,
+        response_format=ResponseFormat.JSON,
+    )
+    failures = asyncio.run(engine.run_packed(paths, results.append))
+
+    assert failures == []
+    for result in results:
+        i = paths.index(result.file_path)
+        assert result.text == (
+            f'def func_{i}(x):\n    """Docs for func_{i}."""\n    return x + {i}\n'
+        )
+
+
+def test_identical_pieces_are_requested_once(
+    tmp_path: pathlib.Path,
+    tokenizer: tiktoken.Encoding,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    prompts: list[str] = []
+
+    async def fake_request(
+        self: Conversation, tokens: int | None = None
+    ) -> openai.openai_object.OpenAIObject:
+        prompt = self.messages[0].content
+        prompts.append(prompt)
+        sections = parse_sections(prompt.split("✂")[-1])
+        content = "\n\n".join(
+            f"# id: {ident}\n{document(code)}" for ident, code in sections.items()
+        )
+        return convert_to_openai_object(  # type: ignore
+            {"choices": [{"message": {"content": f"```\n{content}\n```"}}]}
+        )
+
+    monkeypatch.setattr(Conversation, "arequest", fake_request)
+
+    paths = []
+    for i in range(10):
+        path = tmp_path / f"module_{i}.py"
+        # The same helper, commented and placed differently in each copy.
+        path.write_text(
+            f"def func_{i}(x):\n    return x + {i}\n{chr(10) * i}\n"
+            f"class Vendored:\n    def helper(self, x):  # copy {i}\n"
+            "        return x * 2\n"
+        )
+        paths.append(path)
+
+    results: list[FileResult] = []
+    engine = DocstringEngine("gpt-3.5-turbo", tokenizer, 4096, concurrency=2)
+    failures = asyncio.run(engine.run_packed(paths, results.append))
+
+    assert failures == []
+    assert sum(prompt.count("class Vendored") for prompt in prompts) == 1
+    assert engine.packer is not None
+    assert (engine.packer.duplicates, engine.packer.pieces) == (9, 20)
+
+    for result in results:
+        assert result.text is not None
+        docstrings = {
+            node.name: ast.get_docstring(node)
+            for node in ast.walk(ast.parse(result.text))
+            if isinstance(node, ast.FunctionDef | ast.ClassDef)
+        }
+        assert docstrings["Vendored"] == "Docs for Vendored."
+        assert docstrings["helper"] == "Docs for helper."
+
+
+def test_copies_of_answered_pieces_finish_at_once(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    paths = [tmp_path / "a.py", tmp_path / "b.py"]
+    paths[0].write_text("def f(x):\n    return x\n")
+    paths[1].write_text("import os\n\n\ndef f(x):\n    # A copy.\n    return x\n")
+
+    packer = RequestPacker(tokenizer, 1000)
+    first, copy = (PackedFile.from_file(p, tokenizer, 1000) for p in paths)
+
+    (batch,) = packer.add(first) + packer.flush()
+    (ident,) = parse_sections(batch.message.content.split("✂")[-1])
+    response = f'# id: {ident}\ndef f(x):\n    """Docs."""\n    return x\n'
+    assert batch.route(f"```\n{response}```") == [first]
+
+    assert packer.add(copy) + packer.flush() == []
+    assert copy.outstanding == 0
+    assert copy.apply() == (
+        'import os\n\n\ndef f(x):\n    """Docs."""\n    # A copy.\n    return x\n'
+    )
+    assert packer.dedup_ratio == 0.5
+
+
+def test_fingerprints_ignore_position_and_comments() -> None:
+    def fingerprints(code: str) -> list[str]:
+        (module,) = FileIterator(pathlib.Path("module.py"), code).iterate()
+        return [child.fingerprint() for child in module.children]
+
+    same = fingerprints("def f(x):\n    return x\n\n\ndef g():\n    pass\n")
+    moved = fingerprints("\n\nif True:\n    pass\n\ndef f(x):  # f\n    return (x)\n")
+    changed = fingerprints("def f(y):\n    return y\n")
+
+    assert same[0] == moved[0]
+    assert same[0] != same[1]
+    assert same[0] != changed[0]
+
+
+def test_oversized_pieces_are_routed_to_larger_model(
+    tmp_path: pathlib.Path,
+    tokenizer: tiktoken.Encoding,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    router = Router.for_model("gpt-3.5-turbo")
+    models: dict[str, str] = {}
+    schedulers = {m.name: RequestScheduler() for m in router.models}
+
+    async def fake_request(
+        self: Conversation, tokens: int | None = None
+    ) -> openai.openai_object.OpenAIObject:
+        assert self.scheduler is schedulers[self.model]
+        sections = parse_sections(self.messages[0].content.split("✂")[-1])
+        for code in sections.values():
+            models[code.split("(")[0]] = self.model
+        content = "\n\n".join(
+            f"# id: {ident}\n{document(code)}" for ident, code in sections.items()
+        )
+        return convert_to_openai_object(  # type: ignore
+            {"choices": [{"message": {"content": f"```\n{content}\n```"}}]}
+        )
+
+    monkeypatch.setattr(Conversation, "arequest", fake_request)
+    path = tmp_path / "module.py"
+    small = "".join(f"def f{i}(x):\n    return x + {i}\n\n\n" for i in range(100))
+    path.write_text(small + "def big():\n" + "    x = 1\n" * 400)
+
+    engine = DocstringEngine(
+        "gpt-3.5-turbo",
+        tokenizer,
+        router.max_tokens,
+        concurrency=2,
+        router=router,
+        schedulers=schedulers,
+    )
+    results: list[FileResult] = []
+    failures = asyncio.run(engine.run_packed([path], results.append))
+
+    assert failures == []
+    assert models.pop("def big") == "gpt-3.5-turbo-16k"
+    assert set(models.values()) == {"gpt-3.5-turbo"}
+    assert engine.routed["gpt-3.5-turbo-16k"] == 1
+    assert engine.routed["gpt-3.5-turbo"] > 1
+    assert '"""Docs for big."""' in (results[0].text or "")
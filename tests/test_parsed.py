@@ -0,0 +1,55 @@
+import ast
+import pathlib
+
+import pytest
+
+from assistant.coding.iterator import FileIterator
+from assistant.coding.parsed import ParsedFile
+
+
+source = (
+    'def ünïcödé(x="ö"):\r\n'
+    '    return {"ä": x,\r\n'
+    '            "b": [1, 2]}\n'
+    "\n"
+    "class A:\r"
+    "    y = 'é'; z = 2\n"
+)
+
+
+def test_segments_match_ast() -> None:
+    parsed = ParsedFile(source)
+
+    for node in ast.walk(parsed.tree):
+        if isinstance(node, ast.stmt | ast.expr):
+            assert parsed.segment(node) == ast.get_source_segment(source, node)
+
+
+def test_iterator_shares_parsed_file(tmp_path: pathlib.Path) -> None:
+    text = source.replace("\r\n", "\n").replace("\r", "\n")
+    file_iterator = FileIterator(tmp_path / "module.py", text)
+
+    (module,) = file_iterator.iterate()
+
+    assert module.ast is file_iterator.parsed.tree
+    assert file_iterator.parsed.cst_module is file_iterator.parsed.cst_module
+
+
+def test_nodes_share_one_buffer(tmp_path: pathlib.Path) -> None:
+    text = "class A:\n    @property\n    def f(self):\n        return 'é'\n"
+    file_iterator = FileIterator(tmp_path / "module.py", text)
+
+    (module,) = file_iterator.iterate(keep_ast=False)
+    (cls,) = module.children
+    (method,) = cls.children
+
+    assert module.source is cls.source is method.source
+    assert module.code_snippet == text
+    assert method.code_snippet == "def f(self):\n        return 'é'"
+    assert (method.name, method.first_lineno, method.lineno) == ("f", 2, 3)
+    assert (method.body_lineno, method.end_lineno, method.col_offset) == (4, 4, 4)
+    assert not hasattr(method, "__dict__")
+
+    assert module.ast is cls.ast is method.ast is None
+    with pytest.raises(ValueError):
+        method.fingerprint()
@@ -0,0 +1,77 @@
+import asyncio
+import collections.abc
+import pathlib
+import threading
+import time
+
+import pytest
+
+from assistant.coding.pipeline import FileResult
+from assistant.coding.pipeline import Job
+from assistant.coding.pipeline import Pipeline
+from assistant.coding.pipeline import Stage
+
+
+def test_slowest_stage_sets_the_pace() -> None:
+    created = 0
+    max_outstanding = 0
+    results: list[FileResult] = []
+
+    def jobs() -> collections.abc.Iterator[Job]:
+        nonlocal created
+        for i in range(100):
+            created += 1
+            yield Job(pathlib.Path(f"{i}.py"))
+
+    async def fast(job: Job) -> None:
+        nonlocal max_outstanding
+        max_outstanding = max(max_outstanding, created - len(results))
+
+    async def slow(job: Job) -> None:
+        await asyncio.sleep(0.001)
+        if job.file_path.name == "13.py":
+            raise ValueError("Broken")
+        job.result = FileResult(job.file_path, text="done")
+
+    pipeline = Pipeline(
+        [Stage("fast", fast, workers=4), Stage("slow", slow, workers=2)],
+        queue_size=3,
+    )
+    asyncio.run(pipeline.run(jobs(), results.append))
+
+    assert len(results) == 100
+    assert [r.file_path.name for r in results if r.error] == ["13.py"]
+    # Jobs in each queue, plus those held by the workers of each stage.
+    assert max_outstanding <= 3 * 3 + 4 + 2
+
+
+def test_jobs_progress_while_the_source_blocks() -> None:
+    walked = threading.Event()
+    walked_before_result: list[bool] = []
+
+    def jobs() -> collections.abc.Iterator[Job]:
+        yield Job(pathlib.Path("first.py"))
+        # A slow directory walk, which must not block the event loop.
+        time.sleep(0.2)
+        yield Job(pathlib.Path("second.py"))
+        walked.set()
+
+    async def request(job: Job) -> None:
+        await asyncio.sleep(0.001)
+        job.result = FileResult(job.file_path, text="done")
+
+    def on_result(result: FileResult) -> None:
+        walked_before_result.append(walked.is_set())
+
+    pipeline = Pipeline([Stage("request", request)])
+    asyncio.run(pipeline.run(jobs(), on_result))
+
+    assert walked_before_result == [False, True]
+
+
+def test_stages_need_workers() -> None:
+    async def stage(job: Job) -> None:
+        pass
+
+    with pytest.raises(ValueError):
+        Pipeline([Stage("none", stage, workers=0)])
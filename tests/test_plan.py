@@ -0,0 +1,75 @@
+import pathlib
+
+import pytest
+import tiktoken
+
+from assistant.coding.plan import COMPLETION_TOKENS_PER_DOCSTRING
+from assistant.coding.plan import REQUEST_LATENCY
+from assistant.coding.plan import FileEstimate
+from assistant.coding.plan import Plan
+from assistant.coding.request import DocstringRequest
+from assistant.coding.request import ResponseFormat
+from assistant.coding.workers import PrepareItem
+from assistant.coding.workers import WorkerPool
+from assistant.conversation.scheduler import MESSAGE_OVERHEAD_TOKENS
+
+
+def write_modules(tmp_path: pathlib.Path) -> list[pathlib.Path]:
+    paths = [tmp_path / "small.py", tmp_path / "large.py", tmp_path / "done.py"]
+    paths[0].write_text(
+        "def f(x):\n    return x\n\n\nclass A:\n    def g(self):\n        pass\n"
+    )
+    paths[1].write_text("def big():\n" + "    x = 1\n" * 500)
+    paths[2].write_text('"""Documented."""\n\n\ndef f():\n    """Documented."""\n')
+    return paths
+
+
+def test_estimates_match_requests(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    small, large, done = write_modules(tmp_path)
+
+    estimate = FileEstimate.from_file(small, tokenizer, 4096)
+    request = DocstringRequest.from_file(small, tokenizer, 4096)
+    (chunk,) = request.chunks
+
+    assert estimate.requests == 1
+    assert estimate.prompt_tokens == (
+        len(tokenizer.encode(chunk.message.content)) + MESSAGE_OVERHEAD_TOKENS
+    )
+    per_docstring = COMPLETION_TOKENS_PER_DOCSTRING[ResponseFormat.CODE]
+    # Two functions, a class and the module.
+    assert estimate.completion_tokens == 4 * per_docstring
+
+    failed = FileEstimate.from_file(large, tokenizer, 1024)
+    assert failed.error == "Node big too large to process."
+    assert FileEstimate.from_file(done, tokenizer, 4096).requests == 0
+
+
+def test_pooled_estimates_match_single_process(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    paths = write_modules(tmp_path)
+    items = [PrepareItem(p, 1024, None, None, ResponseFormat.JSON) for p in paths]
+
+    with WorkerPool(2, tokenizer) as pool:
+        pooled = list(pool.estimate(items))
+
+    assert pooled == [
+        FileEstimate.from_file(p, tokenizer, 1024, response_format=ResponseFormat.JSON)
+        for p in paths
+    ]
+
+
+def test_wall_time_is_bound_by_concurrency_and_rate_limits() -> None:
+    plan = Plan()
+    plan.add(FileEstimate(pathlib.Path("a.py"), 60, 60_000, 6_000))
+    plan.add(FileEstimate(pathlib.Path("b.py")))
+    plan.add(FileEstimate(pathlib.Path("c.py"), error="Too large."))
+
+    assert (plan.files, plan.unchanged, len(plan.failures)) == (3, 1, 1)
+
+    busy = 60 * REQUEST_LATENCY + 6_000 / 40
+    assert plan.wall_time(10, generation_rate=40) == pytest.approx(busy / 10)
+    assert plan.wall_time(10, requests_per_minute=30) == pytest.approx(120)
+    assert plan.wall_time(10, tokens_per_minute=6_600) == pytest.approx(600)
@@ -0,0 +1,179 @@
+import ast
+import json
+import pathlib
+import textwrap
+
+import tiktoken
+
+from assistant.coding.request import DocstringRequest
+from assistant.coding.request import ResponseFormat
+
+
+large_module = textwrap.dedent(
+    """\
+    import os
+
+
+    def helper():
+        return os.getcwd()
+
+
+    class Large:
+        attribute = 1
+
+        def first(self):
+            return "{first}"
+
+        @property
+        def second(self):
+            return "{second}"
+
+        async def third(self):
+            return "{third}"
+    """
+).format(first="a" * 150, second="b" * 150, third="c" * 150)
+
+
+def fake_response(content: str) -> str:
+    """Pretend to be the model: add a docstring to every definition."""
+    code = content.split("✂")[-1]
+    tree = ast.parse(textwrap.dedent(code))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef):
+            node.body.insert(0, ast.Expr(ast.Constant(f"Docs for {node.name}.")))
+    return f"```python\n{ast.unparse(tree)}\n```"
+
+
+def test_small_files_are_sent_whole(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text(large_module)
+
+    request = DocstringRequest.from_file(file_path, tokenizer, 4096)
+
+    (chunk,) = request.chunks
+    assert chunk.prefix == ()
+    assert chunk.message.content.endswith(large_module)
+
+
+def test_large_classes_are_split_into_methods(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text(large_module)
+
+    request = DocstringRequest.from_file(file_path, tokenizer, 800)
+
+    assert len(request.chunks) > 1
+    assert {chunk.prefix for chunk in request.chunks} == {(), ("Large",)}
+    for chunk in request.chunks:
+        ast.parse(chunk.message.content.split("✂")[-1])
+        # Counted from the pieces, allowing one token per blank line between.
+        blank_lines = chunk.message.content.count("\n\n")
+        actual = len(tokenizer.encode(chunk.message.content))
+        assert 0 <= actual - chunk.tokens <= blank_lines
+
+    result = request.apply_responses(
+        [fake_response(chunk.message.content) for chunk in request.chunks]
+    )
+
+    for name in ("helper", "Large", "first", "second", "third"):
+        assert f'"""Docs for {name}."""' in result
+    assert ast.dump(ast.parse(result)).count("Docs for") == 5
+
+
+def test_json_responses_map_names_to_docstrings(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text(large_module)
+
+    request = DocstringRequest.from_file(
+        file_path, tokenizer, 1000, response_format=ResponseFormat.JSON
+    )
+    assert len(request.chunks) > 1
+
+    contents = []
+    for chunk in request.chunks:
+        assert "JSON" in chunk.message.content
+        tree = ast.parse(chunk.message.content.split("✂")[-1])
+        names = [
+            node.name
+            for node in ast.walk(tree)
+            if isinstance(node, ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef)
+        ]
+        contents.append(json.dumps({name: f"Docs for {name}." for name in names}))
+
+    # Models may still answer with code, which is parsed as before.
+    contents[0] = fake_response(request.chunks[0].message.content)
+    result = request.apply_responses(contents)
+
+    for name in ("helper", "Large", "first", "second", "third"):
+        assert f'"""Docs for {name}."""' in result
+    assert ast.dump(ast.parse(result)).count("Docs for") == 5
+
+
+def test_documented_nodes_are_pruned(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text(
+        textwrap.dedent(
+            '''\
+            import os
+
+
+            @staticmethod
+            def documented():
+                """Already documented."""
+                return os.getcwd()
+
+
+            class Partial:
+                """Already documented."""
+
+                def documented(self):
+                    """Already documented."""
+                    return "documented body"
+
+                def undocumented(self):
+                    return "undocumented body"
+            '''
+        )
+    )
+
+    request = DocstringRequest.from_file(file_path, tokenizer, 4096)
+
+    (chunk,) = request.chunks
+    code = chunk.message.content.split("✂")[-1]
+    assert "import os" in code
+    assert "getcwd" not in code
+    assert '"documented body"' not in code
+    assert "def documented(self):\n        ..." in code
+    assert "undocumented body" in code
+
+    result = request.apply_responses([fake_response(chunk.message.content)])
+    assert '"""Docs for undocumented."""' in result
+    assert ast.dump(ast.parse(result)).count("Already documented.") == 3
+
+    file_path.write_text('"""Module."""\n\n\ndef f():\n    """Already documented."""\n')
+    assert DocstringRequest.from_file(file_path, tokenizer, 4096).chunks == []
+
+
+def test_modules_missing_only_their_docstring_are_sent(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text('import os\n\n\ndef f():\n    """Already documented."""\n')
+
+    request = DocstringRequest.from_file(file_path, tokenizer, 4096)
+
+    (chunk,) = request.chunks
+    code = chunk.message.content.split("✂")[-1]
+    assert "import os" in code
+    assert "def f" not in code
+    response = '```python\n"""Docs for module."""\nimport os\n```'
+    result = request.apply_responses([response])
+    assert result.startswith('"""Docs for module."""')
+    assert '"""Already documented."""' in result
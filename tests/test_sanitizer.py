@@ -0,0 +1,32 @@
+import pytest
+
+from assistant.coding.sanitizer import ResponseSanitizer
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "No code here.",
+        "Here it is:\n```python\ndef f():\n    pass\n```\nDone.",
+        "✂✂✂\ndef f():\n    pass\n",
+        "```\n✂✂✂\nx = 1\n```",
+        "```\n```\nEmpty fence.",
+        "One:\n```\na\n```\nTwo:\n```\nb\n```\n",
+    ],
+)
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_incremental_sanitizing_matches_whole(content: str, chunk_size: int) -> None:
+    sanitizer = ResponseSanitizer()
+    chunks = [content[i : i + chunk_size] for i in range(0, len(content), chunk_size)]
+
+    streamed = "".join(sanitizer.feed(chunk) for chunk in chunks) + sanitizer.close()
+
+    assert streamed == sanitizer.sanitize(content)
+
+
+def test_fenced_code_is_output_before_the_response_ends() -> None:
+    sanitizer = ResponseSanitizer()
+
+    assert sanitizer.feed("Sure:\n```python\nx = 1\ny") == "x = 1"
+    assert sanitizer.feed(" = 2\n```\nHope that helps.") == "\ny = 2"
+    assert sanitizer.close() == ""
@@ -0,0 +1,25 @@
+import pytest
+
+from benchmarks.micro import CASES
+from benchmarks.micro import exponent
+from benchmarks.micro import measure
+from benchmarks.micro import sized_module
+
+
+# Small enough to keep the suite quick, and far enough apart that quadratic
+# growth, an exponent of 2, stands out from noise and garbage collection.
+SMALL = 2**14
+LARGE = 2**17
+MAX_EXPONENT = 1.4
+
+
+@pytest.fixture(scope="module")
+def modules() -> dict[int, str]:
+    return {size: sized_module(size) for size in (SMALL, LARGE)}
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_runtime_grows_linearly(name: str, modules: dict[int, str]) -> None:
+    timings = {size: measure(CASES[name], code, 5) for size, code in modules.items()}
+
+    assert exponent(timings) < MAX_EXPONENT, timings
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import openai.error
+import pytest
+
+from assistant.conversation.scheduler import MESSAGE_OVERHEAD_TOKENS
+from assistant.conversation.scheduler import Budget
+from assistant.conversation.scheduler import RequestScheduler
+
+
+def test_budget_waits_to_repay_overdraft() -> None:
+    now = 0.0
+    budget = Budget(60, clock=lambda: now)
+
+    assert budget.reserve(60) == 0
+    assert budget.reserve(3) == pytest.approx(3)
+
+    now = 10.0
+    assert budget.reserve(1) == 0
+    budget.adjust(20)
+    assert budget.reserve(1) == pytest.approx(15)
+
+
+def test_rate_limited_requests_are_retried_after_delay() -> None:
+    scheduler = RequestScheduler(max_concurrency=8, base_delay=0.001)
+    attempts: list[float] = []
+
+    async def request() -> str:
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise openai.error.RateLimitError(  # type: ignore
+                "Slow down", headers={"retry-after": "0.05"}
+            )
+        return "done"
+
+    assert asyncio.run(scheduler.acall(request, tokens=10)) == "done"
+    assert scheduler.rate_limited == scheduler.retries == 2
+    assert scheduler.concurrency == 2
+    assert attempts[1] - attempts[0] >= 0.05
+
+
+def test_other_errors_are_not_retried() -> None:
+    scheduler = RequestScheduler(max_retries=1, base_delay=0.001)
+    calls = 0
+
+    def request() -> str:
+        nonlocal calls
+        calls += 1
+        raise openai.error.InvalidRequestError("Bad request", param=None)  # type: ignore
+
+    with pytest.raises(openai.error.InvalidRequestError):
+        scheduler.call(request, tokens=10)
+    assert calls == 1
+
+    def unavailable() -> str:
+        nonlocal calls
+        calls += 1
+        raise openai.error.ServiceUnavailableError("Try later")  # type: ignore
+
+    with pytest.raises(openai.error.ServiceUnavailableError):
+        scheduler.call(unavailable, tokens=10)
+    assert calls == 3
+
+
+def test_concurrency_is_limited() -> None:
+    scheduler = RequestScheduler(max_concurrency=2)
+    in_flight = max_in_flight = 0
+
+    async def request() -> None:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    async def main() -> None:
+        await asyncio.gather(*(scheduler.acall(request, 1) for _ in range(6)))
+
+    asyncio.run(main())
+    assert max_in_flight == 2
+
+
+def test_counted_tokens_are_not_counted_again() -> None:
+    scheduler = RequestScheduler()
+    messages = [{"role": "user", "content": "x" * 40}]
+
+    assert scheduler.estimate(messages) == 10 + MESSAGE_OVERHEAD_TOKENS
+    assert scheduler.estimate(messages, 3) == 3 + MESSAGE_OVERHEAD_TOKENS
@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+import pathlib
+import stat
+import time
+
+import aiohttp
+import click
+import openai
+import pytest
+
+from assistant.cli import RESOURCES_KEY
+from assistant.cli import Resources
+from assistant.cli import main
+from assistant.client import GROUP_VALUE_OPTIONS
+from assistant.client import check_private
+from assistant.client import connect
+from assistant.client import run_remote
+from assistant.client import subcommand
+from assistant.server import CommandServer
+
+
+@click.group()
+def group() -> None:
+    pass
+
+
+@group.command()
+@click.argument("name")
+@click.pass_context
+def greet(ctx: click.Context, name: str) -> None:
+    assert isinstance(ctx.meta[RESOURCES_KEY], Resources)
+    print(f"{os.getenv('ASSISTANT_GREETING', 'Hello')}, {name}!")
+    # Only the variables the assistant uses are forwarded.
+    assert "UNRELATED_SECRET" not in os.environ
+    click.echo("Done.", err=True)
+
+
+def serve(socket_path: pathlib.Path) -> None:
+    with CommandServer(socket_path, group, Resources()) as server:
+        server.serve_forever()
+
+
+def test_client_runs_commands_on_server(
+    tmp_path: pathlib.Path,
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    socket_path = tmp_path / "assistant.sock"
+    assert connect(socket_path) is None
+
+    # The server redirects the standard streams, so it runs in its own process.
+    server = multiprocessing.get_context("fork").Process(
+        target=serve, args=(socket_path,)
+    )
+    server.start()
+    try:
+        while (connection := connect(socket_path)) is None:
+            time.sleep(0.01)
+        assert run_remote(connection, ["greet", "world"]) == 0
+
+        assert not socket_path.stat().st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+
+        # Commands run in the environment of the client.
+        monkeypatch.setenv("ASSISTANT_GREETING", "Hi")
+        monkeypatch.setenv("UNRELATED_SECRET", "key")
+        connection = connect(socket_path)
+        assert connection is not None
+        assert run_remote(connection, ["greet", "there"]) == 0
+
+        connection = connect(socket_path)
+        assert connection is not None
+        assert run_remote(connection, ["greet"]) == 2
+    finally:
+        server.terminate()
+        server.join()
+
+    captured = capsys.readouterr()
+    assert captured.out == "Hello, world!\nHi, there!\n"
+    assert captured.err.startswith("Done.\n")
+    assert "Missing argument 'NAME'" in captured.err
+
+
+def test_client_refuses_sockets_other_users_can_replace(
+    tmp_path: pathlib.Path,
+) -> None:
+    directory = tmp_path / "shared"
+    directory.mkdir()
+    socket_path = directory / "assistant.sock"
+
+    directory.chmod(0o700)
+    check_private(socket_path)
+
+    directory.chmod(0o777)
+    with pytest.raises(PermissionError, match="not private"):
+        connect(socket_path)
+
+    assert connect(tmp_path / "missing" / "assistant.sock") is None
+
+
+def test_subcommand_is_found_by_position() -> None:
+    assert subcommand(["serve"]) == "serve"
+    assert subcommand(["--model", "serve", "plan", "serve"]) == "plan"
+    assert subcommand(["--no-cache", "-t", "0.5", "add-docstrings", "serve"]) == (
+        "add-docstrings"
+    )
+    assert subcommand(["--model=gpt-4", "--", "serve"]) == "serve"
+    assert subcommand(["--version"]) is None
+
+
+def test_group_value_options_match_command_line() -> None:
+    options = {
+        opt
+        for param in main.params
+        if isinstance(param, click.Option) and not param.is_flag
+        for opt in param.opts
+    }
+
+    assert options == GROUP_VALUE_OPTIONS
+
+
+def test_http_session_outlives_commands() -> None:
+    async def session() -> aiohttp.ClientSession | None:
+        return openai.aiosession.get()
+
+    resources = Resources()
+    first = resources.run(session())
+    second = resources.run(session())
+    resources.close()
+
+    assert first is not None and first is second
+    assert first.closed
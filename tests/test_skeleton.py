@@ -0,0 +1,96 @@
+import pathlib
+import textwrap
+
+import pytest
+import tiktoken
+
+from assistant.coding.iterator import FileIterator
+from assistant.coding.request import DocstringRequest
+from assistant.coding.skeleton import SkeletonBuilder
+
+
+source = textwrap.dedent(
+    '''\
+    import functools
+
+
+    class Cache:
+        """A cache."""
+
+        size: int = 10
+
+        @functools.lru_cache
+        def lookup(self, key: str, *, default: int = 0) -> int:
+            values = [len(key) * i for i in range(1000)]
+            total = sum(values)
+            average = total / len(values)
+            return int(average) or default
+    '''
+)
+
+
+def test_skeleton_keeps_signatures_and_truncates_bodies(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text(source)
+    (module,) = FileIterator(file_path).iterate()
+
+    skeleton = SkeletonBuilder(tokenizer, body_tokens=60).render(module.children[0])
+
+    expected = textwrap.dedent(
+        '''\
+        class Cache:
+            """A cache."""
+            size: int = 10
+            @functools.lru_cache
+            def lookup(self, key: str, *, default: int=0) -> int:
+                values = [len(key) * i for i in range(1000)]
+                ...'''
+    )
+    assert skeleton == expected
+
+
+def test_long_bodies_are_not_encoded_whole(
+    tmp_path: pathlib.Path,
+    tokenizer: tiktoken.Encoding,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text("def long():\n" + "    x = 1\n" * 10_000)
+    (module,) = FileIterator(file_path).iterate()
+    encoded: list[str] = []
+    encode = tokenizer.encode
+
+    def counting_encode(text: str) -> list[int]:
+        encoded.append(text)
+        return encode(text)
+
+    monkeypatch.setattr(tokenizer, "encode", counting_encode)
+    skeleton = SkeletonBuilder(tokenizer, body_tokens=20).render(module.children[0])
+
+    assert skeleton == "def long():\n    x = 1\n    x = 1\n    x = 1\n    ..."
+    assert sum(map(len, encoded)) < 1000
+
+
+def test_skeleton_prompts_apply_to_original_source(
+    tmp_path: pathlib.Path, tokenizer: tiktoken.Encoding
+) -> None:
+    file_path = tmp_path / "module.py"
+    file_path.write_text(source)
+
+    request = DocstringRequest.from_file(
+        file_path, tokenizer, 4096, skeleton=SkeletonBuilder(tokenizer, 0)
+    )
+
+    (chunk,) = request.chunks
+    assert "values" not in chunk.message.content
+    result = request.apply_responses(
+        [
+            "class Cache:\n    def lookup(self, key, *, default=0):\n"
+            '        """Look up a key."""'
+        ]
+    )
+    assert result == source.replace(
+        "-> int:\n", '-> int:\n        """Look up a key."""\n'
+    )
@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+from assistant.startup import StartupProfile
+
+
+def test_command_line_imports_no_slow_libraries() -> None:
+    code = (
+        "import sys, assistant.__main__; "
+        "print(*(m for m in ('openai', 'tiktoken', 'libcst', 'asyncio') "
+        "if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_profile_times_new_imports_and_phases() -> None:
+    profile = StartupProfile()
+    try:
+        with profile.phase("work"):
+            import xml.dom.minidom  # noqa: F401
+    finally:
+        profile.stop()
+
+    assert "xml.dom.minidom" in profile.imports
+    assert "work" in profile.phases
+    assert "xml.dom.minidom" in profile.report()